@@ -0,0 +1,142 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+r"""Benchmarks encoding of AggregationStates for Beam shuffles.
+
+Compares the size and encode/decode times of pickle, which Beam uses by
+default, with beam_utils.AggregationStateCoder, with and without compression.
+
+Example usage:
+
+python benchmark_aggregation_state_coder.py \
+  --num_variables=10 \
+  --num_lead_times=40 \
+  --reduce_dims=init_time
+"""
+
+from collections.abc import Sequence
+import pickle
+import time
+
+from absl import app
+from absl import flags
+import numpy as np
+import pandas as pd
+from weatherbenchX import aggregation
+from weatherbenchX import beam_utils
+from weatherbenchX.metrics import base as metrics_base
+from weatherbenchX.metrics import deterministic
+import xarray as xr
+
+
+NUM_VARIABLES = flags.DEFINE_integer(
+    'num_variables', 10, help='Number of variables.'
+)
+NUM_LEAD_TIMES = flags.DEFINE_integer(
+    'num_lead_times', 40, help='Number of lead times.'
+)
+NUM_INIT_TIMES = flags.DEFINE_integer(
+    'num_init_times', 2, help='Number of init times in a chunk.'
+)
+RESOLUTION = flags.DEFINE_float(
+    'resolution', 1.5, help='Grid resolution in degrees.'
+)
+REDUCE_DIMS = flags.DEFINE_list(
+    'reduce_dims', ['init_time'], help='Dimensions to reduce over.'
+)
+REPEATS = flags.DEFINE_integer(
+    'repeats', 5, help='Number of timed repeats, the minimum is reported.'
+)
+
+
+def _make_aggregation_state() -> aggregation.AggregationState:
+  """Aggregation state of RMSE and MAE for a synthetic chunk."""
+  rng = np.random.default_rng(0)
+  coords = {
+      'init_time': pd.date_range(
+          '2020-01-01', periods=NUM_INIT_TIMES.value, freq='12h'
+      ),
+      'lead_time': pd.timedelta_range(
+          '0h', periods=NUM_LEAD_TIMES.value, freq='6h'
+      ),
+      'latitude': np.arange(-90, 90 + RESOLUTION.value / 2, RESOLUTION.value),
+      'longitude': np.arange(0, 360, RESOLUTION.value),
+  }
+  shape = tuple(len(c) for c in coords.values())
+
+  def random_dataset():
+    return xr.Dataset(
+        {
+            f'variable_{i}': (tuple(coords), rng.random(shape, np.float32))
+            for i in range(NUM_VARIABLES.value)
+        },
+        coords=coords,
+    )
+
+  statistics = metrics_base.compute_unique_statistics_for_all_metrics(
+      {'rmse': deterministic.RMSE(), 'mae': deterministic.MAE()},
+      random_dataset(),
+      random_dataset(),
+  )
+  aggregator = aggregation.Aggregator(reduce_dims=REDUCE_DIMS.value)
+  return aggregator.aggregate_statistics(statistics)
+
+
+def _time(fn) -> float:
+  times = []
+  for _ in range(REPEATS.value):
+    start = time.perf_counter()
+    fn()
+    times.append(time.perf_counter() - start)
+  return min(times)
+
+
+def main(argv: Sequence[str]) -> None:
+  if len(argv) > 1:
+    raise app.UsageError('Too many command-line arguments.')
+
+  aggregation_state = _make_aggregation_state()
+  packed = aggregation_state.pack()
+  print(f'Raw size of sums: {packed.nbytes / 1e6:.2f} MB')
+
+  encoders = {
+      'pickle': (pickle.dumps, pickle.loads),
+      'AggregationStateCoder': (
+          beam_utils.AggregationStateCoder().encode,
+          beam_utils.AggregationStateCoder().decode,
+      ),
+      'ZlibAggregationStateCoder': (
+          beam_utils.ZlibAggregationStateCoder().encode,
+          beam_utils.ZlibAggregationStateCoder().decode,
+      ),
+  }
+  print(
+      f'{"":<28}{"input":>10}{"size [MB]":>12}{"encode [ms]":>14}'
+      f'{"decode [ms]":>14}'
+  )
+  for name, (encode, decode) in encoders.items():
+    for input_name, state in (
+        ('nested', aggregation_state),
+        ('packed', packed),
+    ):
+      encoded = encode(state)
+      encode_time = _time(lambda: encode(state))  # pylint: disable=cell-var-from-loop
+      decode_time = _time(lambda: decode(encoded))  # pylint: disable=cell-var-from-loop
+      print(
+          f'{name:<28}{input_name:>10}{len(encoded) / 1e6:>12.2f}'
+          f'{encode_time * 1e3:>14.1f}{decode_time * 1e3:>14.1f}'
+      )
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -27,6 +27,9 @@ python run_example_evaluation.py \
   --output_path=./results.nc \
   --runner=DirectRunner
 
+or to run in this process without Beam:
+  --runner=local
+
 or to run on DataFlow:
   --output_path=gs://$BUCKET/results.nc \
   --runner=DataflowRunner \
@@ -47,6 +50,7 @@ import numpy as np
 from weatherbenchX import aggregation
 from weatherbenchX import beam_pipeline
 from weatherbenchX import binning
+from weatherbenchX import local_pipeline
 from weatherbenchX import time_chunks
 from weatherbenchX import weighting
 from weatherbenchX.data_loaders import xarray_loaders
@@ -128,7 +132,32 @@ MAX_CHUNKS_PER_AGGREGATION_STAGE = flags.DEFINE_integer(
     None,
     help='Max number of chunks per aggregation stage.',
 )
-RUNNER = flags.DEFINE_string('runner', None, 'beam.runners.Runner')
+NUM_WORKERS = flags.DEFINE_integer(
+    'num_workers',
+    None,
+    help='Number of worker processes, only used with --runner=local.',
+)
+CHECKPOINT_DIR = flags.DEFINE_string(
+    'checkpoint_dir',
+    None,
+    help=(
+        'Directory to store the statistics of each chunk in, so that a rerun '
+        'only computes missing chunks.'
+    ),
+)
+INCREMENTAL = flags.DEFINE_bool(
+    'incremental',
+    False,
+    help=(
+        'Add the statistics of the given init times to those stored next to '
+        '--output_path by previous incremental runs.'
+    ),
+)
+RUNNER = flags.DEFINE_string(
+    'runner',
+    None,
+    'beam.runners.Runner, or "local" to run in this process without Beam.',
+)
 
 
 def main(argv: Sequence[str]) -> None:
@@ -184,6 +213,21 @@ def main(argv: Sequence[str]) -> None:
       bin_by=bin_by,
   )
 
+  if RUNNER.value == 'local':
+    local_pipeline.run_pipeline(
+        times,
+        prediction_loader,
+        target_loader,
+        all_metrics,
+        aggregation_method,
+        out_path=OUTPUT_PATH.value,
+        max_chunks_per_aggregation_stage=MAX_CHUNKS_PER_AGGREGATION_STAGE.value,
+        num_workers=NUM_WORKERS.value,
+        checkpoint_dir=CHECKPOINT_DIR.value,
+        incremental=INCREMENTAL.value,
+    )
+    return
+
   with beam.Pipeline(runner=RUNNER.value, argv=argv) as root:
     beam_pipeline.define_pipeline(
         root,
@@ -193,6 +237,8 @@ def main(argv: Sequence[str]) -> None:
         all_metrics,
         aggregation_method,
         out_path=OUTPUT_PATH.value,
+        checkpoint_dir=CHECKPOINT_DIR.value,
+        incremental=INCREMENTAL.value,
     )
 
 
@@ -98,6 +98,13 @@ INIT_TIME_CHUNK_SIZE = flags.DEFINE_integer(
 LEAD_TIME_CHUNK_SIZE = flags.DEFINE_integer(
     'lead_time_chunk_size', 12, 'Lead time chunk size.'
 )
+CHUNK_MEMORY_BUDGET_BYTES = flags.DEFINE_integer(
+    'chunk_memory_budget_bytes',
+    None,
+    'If set, chunk sizes are chosen automatically, aligned with the storage'
+    ' chunks of predictions and targets and within this budget, instead of'
+    ' using init_time_chunk_size and lead_time_chunk_size.',
+)
 TEMPORAL = flags.DEFINE_bool(
     'temporal', False, 'If true, do not reduce over init time.'
 )
@@ -257,7 +264,7 @@ def main(argv: Sequence[str]) -> None:
           dtype='timedelta64[h]',
       )
     else:
-      lead_times = prediction_loader._ds.lead_time.values  # pylint: disable=protected-access
+      lead_times = prediction_loader.dataset.lead_time.values
   else:
     lead_time_start = LEAD_TIME_START.value
     lead_time_stop = LEAD_TIME_STOP.value
@@ -267,12 +274,24 @@ def main(argv: Sequence[str]) -> None:
         LEAD_TIME_FREQUENCY.value,
         dtype='timedelta64[h]',
     )
-  times = time_chunks.TimeChunks(
-      init_times,
-      lead_times,
-      init_time_chunk_size=INIT_TIME_CHUNK_SIZE.value,
-      lead_time_chunk_size=LEAD_TIME_CHUNK_SIZE.value,
-  )
+  if CHUNK_MEMORY_BUDGET_BYTES.value is None:
+    times = time_chunks.TimeChunks(
+        init_times,
+        lead_times,
+        init_time_chunk_size=INIT_TIME_CHUNK_SIZE.value,
+        lead_time_chunk_size=LEAD_TIME_CHUNK_SIZE.value,
+    )
+  else:
+    # Climatologies and persistence aren't stored by init and lead time.
+    datasets = [target_loader.dataset]
+    if 'init_time' in prediction_loader.dataset.dims:
+      datasets.append(prediction_loader.dataset)
+    times = time_chunks.TimeChunks.aligned_to_storage(
+        init_times,
+        lead_times,
+        datasets,
+        memory_budget_bytes=CHUNK_MEMORY_BUDGET_BYTES.value,
+    )
 
   ##############################################################################
   # 3. Define metrics
@@ -371,21 +390,34 @@ def main(argv: Sequence[str]) -> None:
       f'{PREDICTION.value}_vs_{TARGET.value}_{RESOLUTION.value}_{init_time_str}'
   )
   if TEMPORAL.value:
-    filename += '_temporal'
-  filename += '.nc'
+    # Written in parallel by block of init times.
+    filename += '_temporal.zarr'
+  else:
+    filename += '.nc'
   out_path = os.path.join(OUTPUT_DIR.value, filename)
   print(f'Save path: {out_path}')
 
   with beam.Pipeline(runner=RUNNER.value, argv=argv) as root:
-    beam_pipeline.define_pipeline(
-        root,
-        times,
-        prediction_loader,
-        target_loader,
-        all_metrics,
-        aggregation_method,
-        out_path=out_path,
-    )
+    if TEMPORAL.value:
+      beam_pipeline.define_time_series_pipeline(
+          root,
+          times,
+          prediction_loader,
+          target_loader,
+          all_metrics,
+          aggregation_method,
+          out_path=out_path,
+      )
+    else:
+      beam_pipeline.define_pipeline(
+          root,
+          times,
+          prediction_loader,
+          target_loader,
+          all_metrics,
+          aggregation_method,
+          out_path=out_path,
+      )
 
 
 if __name__ == '__main__':
@@ -14,15 +14,44 @@
 """Definition of aggregation methods and AggregationState."""
 
 import dataclasses
-from typing import Collection, Hashable, Mapping, Optional, Sequence
+import functools
+import hashlib
+import logging
+import math
+import pickle
+import struct
+from typing import Collection, Hashable, Mapping, NamedTuple, Optional, Sequence
+import zlib
 
+import numpy as np
+import pandas as pd
 from weatherbenchX import binning
+from weatherbenchX import caching
 from weatherbenchX import weighting
 from weatherbenchX import xarray_tree
 from weatherbenchX.metrics import base as metrics_base
 import xarray as xr
 
 
+# Temporary dimension used to stack the weighted statistics and the weights of
+# a single statistic, so that both are reduced in a single contraction.
+_COMPONENT_DIM = '_aggregation_component'
+
+# Binary format of serialized PackedAggregationStates: a fixed-size prefix with
+# magic bytes, format version, compression and header length, followed by the
+# pickled header (layout and coordinates) and the raw, possibly compressed,
+# buffers.
+_SERIALIZATION_MAGIC = b'WBXAGG'
+_SERIALIZATION_VERSION = 1
+_SERIALIZATION_PREFIX = struct.Struct('<6sBBQ')
+_COMPRESSIONS = {None: 0, 'zlib': 1}
+
+# Layouts of recently deserialized states, keyed by a digest of their header.
+# States decoded from the same layout then share it, which avoids rebuilding
+# coordinates and makes summing them take the fast path.
+_DESERIALIZED_LAYOUTS = caching.LRUCache(maxsize=16)
+
+
 def _combining_sum(
     data_arrays: Sequence[Optional[xr.DataArray]],
 ) -> Optional[xr.DataArray]:
@@ -78,6 +107,12 @@ def _combining_sum(
       # Coordinates were not exactly aligned.
       pass
 
+  # Path for misaligned coordinates, which builds the union of the indexes once
+  # and adds each array into a preallocated output.
+  summed = _union_index_sum(data_arrays)
+  if summed is not None:
+    return summed
+
   # Potentially-slow but general path, the other paths above do the same thing
   # as this but may be faster.
   # This will extend each array to use the union of all the coordinates, padding
@@ -97,6 +132,187 @@ def _combining_sum(
   return summed
 
 
+def _union_index(indexes: Sequence[Optional[pd.Index]]) -> Optional[pd.Index]:
+  """Union of indexes, in the same order as xarray's outer join.
+
+  Args:
+    indexes: Indexes to combine.
+
+  Returns:
+    The union, or None if it's not supported here, e.g. for missing indexes,
+    duplicate or NaN values, MultiIndexes or different dtypes.
+  """
+  for index in indexes:
+    if (
+        index is None
+        or isinstance(index, pd.MultiIndex)
+        or index.dtype != indexes[0].dtype
+        or not index.is_unique
+        or index.hasnans
+    ):
+      return None
+  # Like pd.Index.union, only sort if indexes differ.
+  non_empty = [index for index in indexes if len(index)]  # pylint: disable=g-explicit-length-test
+  if not non_empty:
+    return indexes[0]
+  if all(non_empty[0].equals(index) for index in non_empty[1:]):
+    return non_empty[0]
+  union = non_empty[0].append(non_empty[1:]).unique()
+  try:
+    return union.sort_values()
+  except TypeError:
+    # Values can't be compared, keep the order of appearance.
+    return union
+
+
+def _indexer(
+    positions: Sequence[slice | np.ndarray],
+) -> tuple[slice | np.ndarray, ...]:
+  """Indexer for an outer product of per-dimension positions."""
+  if all(isinstance(p, slice) for p in positions):
+    return tuple(positions)
+  return np.ix_(*[
+      np.arange(p.stop) if isinstance(p, slice) else p for p in positions
+  ])
+
+
+@functools.lru_cache(maxsize=None)
+def _promote_for_fill(dtype: np.dtype) -> tuple[np.dtype, object]:
+  """Dtype and fill value xarray uses for coordinates padded by an alignment."""
+  padded = xr.DataArray(
+      np.zeros(1, dtype), dims='x', coords={'x': [0]}
+  ).reindex(x=[1])
+  return padded.dtype, padded.values[0]
+
+
+def _union_coords(
+    data_arrays: Sequence[xr.DataArray],
+    union_indexes: Mapping[Hashable, pd.Index],
+    positions: Sequence[Mapping[Hashable, slice | np.ndarray]],
+) -> Optional[dict[Hashable, xr.Variable | pd.Index]]:
+  """Coordinates combined like xr.merge, or None if unsupported."""
+  coords = {}
+  for dim, union_index in union_indexes.items():
+    variables = [a.coords.variables[dim] for a in data_arrays]
+    # pd.Index doesn't preserve e.g. fixed width string dtypes.
+    dtype = np.result_type(*[v.dtype for v in variables])
+    coords[dim] = xr.Variable(
+        dim, np.asarray(union_index, dtype=dtype), attrs=variables[0].attrs
+    )
+  names = []
+  for a in data_arrays:
+    names.extend(n for n in a.coords if n not in coords and n not in names)
+
+  for name in names:
+    if any(name not in a.coords for a in data_arrays):
+      return None
+    variables = [a.coords.variables[name] for a in data_arrays]
+    first = variables[0]
+    dims = first.dims
+    if any(
+        set(v.dims) != set(dims) or v.dtype != first.dtype for v in variables
+    ):
+      return None
+
+    if not dims:
+      if not all(first.equals(v) for v in variables[1:]):
+        return None
+      coords[name] = first
+      continue
+
+    dtype = first.dtype
+    fill_value = None
+    if any(isinstance(p[d], np.ndarray) for p in positions for d in dims):
+      # Arrays are padded by the outer join, so missing values are filled.
+      dtype, fill_value = _promote_for_fill(dtype)
+    shape = [len(union_indexes[d]) for d in dims]
+    values = np.full(shape, fill_value, dtype=dtype)
+    not_null = np.zeros(shape, dtype=bool)
+    for v, p in zip(variables, positions):
+      indexer = _indexer([p[d] for d in dims])
+      new_values = np.asarray(v.transpose(*dims).values)
+      new_not_null = np.asarray(pd.notnull(new_values))
+      current_values = values[indexer]
+      current_not_null = not_null[indexer]
+      both = current_not_null & new_not_null
+      if not np.array_equal(current_values[both], new_values[both]):
+        # Conflicting values, let xr.merge handle (and report) these.
+        return None
+      update = new_not_null & ~current_not_null
+      current_values[update] = new_values[update]
+      values[indexer] = current_values
+      not_null[indexer] = current_not_null | new_not_null
+    coords[name] = xr.Variable(dims, values, attrs=first.attrs)
+  return coords
+
+
+def _union_index_sum(
+    data_arrays: Sequence[xr.DataArray],
+) -> Optional[xr.DataArray]:
+  """Sum over the union of the index coordinates.
+
+  Equivalent to summing the arrays after xr.align(join='outer', fill_value=0)
+  and merging their coordinates, but the union index is built once and each
+  array is added into a preallocated output, so the cost is linear in the total
+  size of the inputs, rather than quadratic in their number.
+
+  Args:
+    data_arrays: Arrays with the same dims, and an index for each dim.
+
+  Returns:
+    The sum, or None if the inputs are not supported here (e.g. non-numeric
+    data, duplicate index values or coordinates which need xr.merge), in which
+    case the caller should fall back to xr.align.
+  """
+  dims = data_arrays[0].dims
+  dtype = np.result_type(*[a.dtype for a in data_arrays])
+  if dtype.kind not in 'iufc':
+    return None
+
+  indexes = [a.indexes for a in data_arrays]
+  union_indexes = {}
+  for dim in dims:
+    union_index = _union_index([i.get(dim) for i in indexes])
+    if union_index is None:
+      return None
+    union_indexes[dim] = union_index
+
+  # Positions of each array in the output along each dim, as a slice when it
+  # covers the whole output dim.
+  positions = []
+  for a_indexes in indexes:
+    positions.append({})
+    for dim in dims:
+      index = a_indexes[dim]
+      if index.equals(union_indexes[dim]):
+        positions[-1][dim] = slice(len(index))
+      else:
+        positions[-1][dim] = union_indexes[dim].get_indexer(index)
+
+  coords = _union_coords(data_arrays, union_indexes, positions)
+  if coords is None:
+    return None
+
+  out = np.zeros([len(union_indexes[d]) for d in dims], dtype=dtype)
+  for i, (a, p) in enumerate(zip(data_arrays, positions)):
+    indexer = _indexer([p[d] for d in dims])
+    values = a.variable.transpose(*dims).values
+    # Assign rather than add the first summand, for results identical to the
+    # sum of zero-padded arrays.
+    if i == 0:
+      out[indexer] = values
+    else:
+      out[indexer] += values
+
+  names = {a.name for a in data_arrays}
+  return xr.DataArray(
+      out,
+      dims=dims,
+      coords=coords,
+      name=names.pop() if len(names) == 1 else None,
+  )
+
+
 @dataclasses.dataclass
 class AggregationState:
   """An object that contains sum of weighted statistics and sum of weights.
@@ -116,35 +332,84 @@ class AggregationState:
   @classmethod
   def zero(cls) -> 'AggregationState':
     """An initial/'zero' aggregation state."""
-    return cls(sum_weighted_statistics=None, sum_weights=None)
+    return AggregationState(sum_weighted_statistics=None, sum_weights=None)
+
+  def is_zero(self) -> bool:
+    """Whether this is an initial/'zero' aggregation state."""
+    return self.sum_weighted_statistics is None
 
   def __add__(self, other: 'AggregationState') -> 'AggregationState':
     return self.sum([self, other])
 
+  @property
+  def nbytes(self) -> int:
+    """Total size of the summed statistics and weights in bytes."""
+    if self.is_zero():
+      return 0
+    return sum(
+        data_array.nbytes
+        for tree in (self.sum_weighted_statistics, self.sum_weights)
+        for statistic in tree.values()
+        for data_array in statistic.values()
+    )
+
   @classmethod
   def sum(
       cls, aggregation_states: list['AggregationState']
   ) -> 'AggregationState':
-    """Sum of aggregation states."""
-    sum_weighted_statistics_and_sum_weights_tuples = [
-        (a.sum_weighted_statistics, a.sum_weights)
-        for a in aggregation_states
-        if a.sum_weighted_statistics is not None
-    ]
+    """Sum of aggregation states.
+
+    If all non-zero states are PackedAggregationStates, the result is packed
+    too. If they also share the same layout, the sum is a plain sum of their
+    buffers.
+
+    Args:
+      aggregation_states: States to sum.
+
+    Returns:
+      The summed AggregationState.
+    """
+    aggregation_states = [a for a in aggregation_states if not a.is_zero()]
 
     # Sometimes beam does a reduction with only Zero states. In this case, we
     # end up with an empty collection. In these cases, we need to return a zero
     # state.
-    if not sum_weighted_statistics_and_sum_weights_tuples:
+    if not aggregation_states:
       return cls.zero()
 
+    all_packed = all(
+        isinstance(a, PackedAggregationState) for a in aggregation_states
+    )
+    if all_packed:
+      layout = aggregation_states[0].layout
+      if all(a.layout == layout for a in aggregation_states[1:]):
+        return PackedAggregationState.sum_with_same_layout(aggregation_states)
+
+    sum_weighted_statistics_and_sum_weights_tuples = [
+        (a.sum_weighted_statistics, a.sum_weights) for a in aggregation_states
+    ]
+
     # Sum over each element in the nested dictionaries
     sum_weighted_statistics, sum_weights = xarray_tree.map_structure(
         lambda *a: _combining_sum(a),
         *sum_weighted_statistics_and_sum_weights_tuples,
     )
 
-    return cls(sum_weighted_statistics, sum_weights)
+    summed = AggregationState(sum_weighted_statistics, sum_weights)
+    return summed.pack() if all_packed else summed
+
+  def pack(self) -> 'AggregationState':
+    """Returns the PackedAggregationState equivalent to this state.
+
+    Zero states are returned as is.
+    """
+    if self.is_zero():
+      return self
+    return PackedAggregationState.from_aggregation_state(self)
+
+  def unpack(self) -> 'AggregationState':
+    """Returns the equivalent AggregationState with nested DataArrays."""
+    return self
 
   def mean_statistics(self) -> Mapping[str, Mapping[Hashable, xr.DataArray]]:
     """Returns the statistics normalized by their corresponding weights."""
@@ -180,6 +445,614 @@ class AggregationState:
     return values
 
 
+class _PackedLeaf(NamedTuple):
+  """Location and metadata of a single DataArray in packed buffers."""
+
+  statistic: str
+  variable: Hashable
+  name: Hashable
+  dims: tuple[Hashable, ...]
+  shape: tuple[int, ...]
+  coords_index: int
+  dtype: str
+  offset: int
+
+
+class _PackedLayout:
+  """Describes where each DataArray of an AggregationState lives in buffers.
+
+  Each distinct set of coordinates is stored only once and shared by all
+  DataArrays that have it.
+  """
+
+  def __init__(
+      self,
+      statistics_leaves: Sequence[_PackedLeaf],
+      weights_leaves: Sequence[_PackedLeaf],
+      coords: Sequence[xr.Dataset],
+      coords_fingerprints: Sequence[Hashable],
+      datasets: Collection[str],
+  ):
+    self.statistics_leaves = tuple(statistics_leaves)
+    self.weights_leaves = tuple(weights_leaves)
+    self.coords = tuple(coords)
+    self.datasets = frozenset(datasets)
+    # Cheap key for comparing layouts, without comparing coordinate values.
+    self._key = (
+        self.statistics_leaves,
+        self.weights_leaves,
+        tuple(coords_fingerprints),
+        tuple(sorted(self.datasets)),
+    )
+
+  def to_header(self) -> dict[str, object]:
+    """Returns a picklable description of the layout with raw coordinates.
+
+    Coordinate variables shared by several coordinate sets, e.g. time, are only
+    included once.
+    """
+    variables = []
+    variable_indices = {}
+    coords = []
+    for ds, fingerprint in zip(self.coords, self._key[2]):
+      indices = []
+      # Entries of the fingerprint after dims and shape identify the values of
+      # each coordinate.
+      for name, *key in fingerprint[2:]:
+        var = ds.variables[name]
+        key = (name, *key) if not var.attrs else (name, *key, id(var))
+        if key not in variable_indices:
+          variable_indices[key] = len(variables)
+          variables.append((name, var.dims, var.values, var.attrs))
+        indices.append(variable_indices[key])
+      coords.append(indices)
+    return dict(
+        statistics_leaves=[tuple(l) for l in self.statistics_leaves],
+        weights_leaves=[tuple(l) for l in self.weights_leaves],
+        variables=variables,
+        coords=coords,
+        coords_fingerprints=self._key[2],
+        datasets=sorted(self.datasets),
+    )
+
+  @classmethod
+  def from_header(cls, header: Mapping[str, object]) -> '_PackedLayout':
+    """Inverse of to_header."""
+    variables = header['variables']
+    coords = []
+    for indices in header['coords']:
+      coords.append(
+          xr.Dataset(
+              coords={
+                  name: xr.Variable(dims, values, attrs)
+                  for name, dims, values, attrs in (
+                      variables[i] for i in indices
+                  )
+              }
+          )
+      )
+    return cls(
+        statistics_leaves=[_PackedLeaf(*l) for l in header['statistics_leaves']],
+        weights_leaves=[_PackedLeaf(*l) for l in header['weights_leaves']],
+        coords=coords,
+        coords_fingerprints=header['coords_fingerprints'],
+        datasets=header['datasets'],
+    )
+
+  def __eq__(self, other: object) -> bool:
+    if not isinstance(other, _PackedLayout):
+      return NotImplemented
+    return self is other or self._key == other._key
+
+  def __hash__(self) -> int:
+    return hash(self._key)
+
+
+class PackedAggregationState(AggregationState):
+  """AggregationState with all sums stored in a few contiguous buffers.
+
+  There is one flat NumPy buffer per dtype, holding all sums of weighted
+  statistics and sums of weights, plus a layout shared by states with the same
+  structure and coordinates. Summing states with the same layout is a single
+  vectorized add per buffer, without any per-DataArray alignment checks.
+
+  sum_weighted_statistics and sum_weights are reconstructed on access, as
+  DataArrays which are views into the buffers, so the class can be used
+  wherever an AggregationState is expected.
+
+  Attributes:
+    layout: Shared description of the structure, dims and coordinates.
+    buffers: Mapping from dtype string to flat buffer.
+  """
+
+  def __init__(self, layout: _PackedLayout, buffers: Mapping[str, np.ndarray]):
+    # pylint: disable=super-init-not-called
+    self.layout = layout
+    self.buffers = dict(buffers)
+
+  @classmethod
+  def from_aggregation_state(
+      cls, aggregation_state: AggregationState
+  ) -> 'PackedAggregationState':
+    """Packs a non-zero AggregationState."""
+    if isinstance(aggregation_state, PackedAggregationState):
+      return aggregation_state
+    if aggregation_state.is_zero():
+      raise ValueError('Zero AggregationStates can not be packed.')
+    sum_weighted_statistics = aggregation_state.sum_weighted_statistics
+    sum_weights = aggregation_state.sum_weights
+
+    coords = []
+    coords_fingerprints = []
+    coords_indices = {}
+    values_per_dtype = {}
+    offsets = {}
+
+    def add_leaf(statistic, variable, data_array):
+      fingerprint = caching.coordinates_fingerprint(data_array, exclude=())
+      if fingerprint not in coords_indices:
+        coords_indices[fingerprint] = len(coords)
+        # Keep a coordinates-only Dataset, rather than data_array.coords, which
+        # would keep a reference to the data.
+        coords.append(data_array.coords.to_dataset())
+        coords_fingerprints.append(fingerprint)
+      values = np.asarray(data_array.values)
+      dtype = values.dtype.str
+      offset = offsets.get(dtype, 0)
+      offsets[dtype] = offset + values.size
+      values_per_dtype.setdefault(dtype, []).append(values.ravel())
+      return _PackedLeaf(
+          statistic=statistic,
+          variable=variable,
+          name=data_array.name,
+          dims=tuple(data_array.dims),
+          shape=values.shape,
+          coords_index=coords_indices[fingerprint],
+          dtype=dtype,
+          offset=offset,
+      )
+
+    def add_tree(tree):
+      return [
+          add_leaf(statistic, variable, values[variable])
+          for statistic, values in tree.items()
+          for variable in values.keys()
+      ]
+
+    statistics_leaves = add_tree(sum_weighted_statistics)
+    weights_leaves = add_tree(sum_weights)
+    datasets = [
+        statistic
+        for statistic, values in sum_weighted_statistics.items()
+        if isinstance(values, xr.Dataset)
+    ]
+    layout = _PackedLayout(
+        statistics_leaves, weights_leaves, coords, coords_fingerprints, datasets
+    )
+    buffers = {
+        dtype: np.concatenate(values)
+        for dtype, values in values_per_dtype.items()
+    }
+    return cls(layout, buffers)
+
+  @classmethod
+  def sum_with_same_layout(
+      cls, aggregation_states: Sequence['PackedAggregationState']
+  ) -> 'PackedAggregationState':
+    """Sums packed states which all have the same layout."""
+    first, *rest = aggregation_states
+    buffers = {}
+    for dtype, buffer in first.buffers.items():
+      # Sum in the same order as AggregationState.sum, for identical results.
+      buffer = buffer.copy()
+      for a in rest:
+        buffer += a.buffers[dtype]
+      buffers[dtype] = buffer
+    return cls(first.layout, buffers)
+
+  def _unpack_tree(
+      self, leaves: Sequence[_PackedLeaf]
+  ) -> Mapping[str, Mapping[Hashable, xr.DataArray]]:
+    tree = {}
+    for leaf in leaves:
+      size = int(np.prod(leaf.shape))
+      data = self.buffers[leaf.dtype][leaf.offset : leaf.offset + size]
+      tree.setdefault(leaf.statistic, {})[leaf.variable] = xr.DataArray(
+          data.reshape(leaf.shape),
+          dims=leaf.dims,
+          coords=self.layout.coords[leaf.coords_index].coords,
+          name=leaf.name,
+      )
+    for statistic in self.layout.datasets:
+      tree[statistic] = xr.Dataset(tree[statistic])
+    return tree
+
+  @property
+  def sum_weighted_statistics(
+      self,
+  ) -> Mapping[str, Mapping[Hashable, xr.DataArray]]:
+    return self._unpack_tree(self.layout.statistics_leaves)
+
+  @property
+  def sum_weights(self) -> Mapping[str, Mapping[Hashable, xr.DataArray]]:
+    return self._unpack_tree(self.layout.weights_leaves)
+
+  def is_zero(self) -> bool:
+    return False
+
+  def pack(self) -> 'PackedAggregationState':
+    return self
+
+  def unpack(self) -> AggregationState:
+    return AggregationState(self.sum_weighted_statistics, self.sum_weights)
+
+  def to_bytes(
+      self, compression: Optional[str] = None, compression_level: int = 1
+  ) -> bytes:
+    """Serializes the state into a compact binary representation.
+
+    Coordinates and the layout are stored once, in a small pickled header,
+    followed by the raw buffers. This is much smaller and faster than pickling
+    the equivalent AggregationState, which repeats the coordinates and xarray
+    metadata for every DataArray.
+
+    Args:
+      compression: None or 'zlib'. Compression of the buffers is lossless.
+      compression_level: Compression level, if compression is used.
+
+    Returns:
+      Bytes which can be deserialized with `from_bytes`.
+    """
+    if compression not in _COMPRESSIONS:
+      raise ValueError(
+          f'Unknown compression {compression}, must be one of'
+          f' {list(_COMPRESSIONS)}.'
+      )
+    header = self.layout.to_header()
+    header['buffers'] = [(dtype, b.size) for dtype, b in self.buffers.items()]
+    header = pickle.dumps(header, protocol=pickle.HIGHEST_PROTOCOL)
+    prefix = _SERIALIZATION_PREFIX.pack(
+        _SERIALIZATION_MAGIC,
+        _SERIALIZATION_VERSION,
+        _COMPRESSIONS[compression],
+        len(header),
+    )
+    buffers = [np.ascontiguousarray(b).data for b in self.buffers.values()]
+    if compression == 'zlib':
+      compressor = zlib.compressobj(compression_level)
+      chunks = [compressor.compress(b) for b in buffers]
+      return b''.join([prefix, header, *chunks, compressor.flush()])
+    return b''.join([prefix, header, *buffers])
+
+  @classmethod
+  def from_bytes(cls, data: bytes) -> 'PackedAggregationState':
+    """Deserializes a state serialized with `to_bytes`."""
+    magic, version, compression, header_size = (
+        _SERIALIZATION_PREFIX.unpack_from(data)
+    )
+    if magic != _SERIALIZATION_MAGIC:
+      raise ValueError('Data is not a serialized PackedAggregationState.')
+    if version != _SERIALIZATION_VERSION:
+      raise ValueError(f'Unsupported serialization version {version}.')
+    start = _SERIALIZATION_PREFIX.size
+    header_bytes = bytes(data[start : start + header_size])
+    payload = data[start + header_size :]
+    if compression == _COMPRESSIONS['zlib']:
+      payload = zlib.decompress(payload)
+
+    header = pickle.loads(header_bytes)
+    layout = _DESERIALIZED_LAYOUTS.get_or_compute(
+        hashlib.blake2b(header_bytes, digest_size=16).digest(),
+        lambda: _PackedLayout.from_header(header),
+    )
+    buffers = {}
+    offset = 0
+    for dtype, size in header['buffers']:
+      # Copy, so that the buffers are writeable and don't keep payload alive.
+      buffers[dtype] = np.frombuffer(
+          payload, dtype=dtype, count=size, offset=offset
+      ).copy()
+      offset += buffers[dtype].nbytes
+    return cls(layout, buffers)
+
+  @property
+  def nbytes(self) -> int:
+    """Total size of the buffers in bytes."""
+    return sum(b.nbytes for b in self.buffers.values())
+
+  def __repr__(self) -> str:
+    num_leaves = len(self.layout.statistics_leaves)
+    return (
+        f'{type(self).__name__}(<{num_leaves} statistics, '
+        f'{len(self.layout.coords)} coordinate sets, {self.nbytes} bytes>)'
+    )
+
+
+class AggregationStateAccumulator:
+  """Mutable sum of AggregationStates, which adds packed states in place.
+
+  The sum is kept as a PackedAggregationState which owns its buffers. Packed
+  states with the same layout are added into these buffers, so adding many
+  states doesn't allocate any new arrays. Only if the layout changes, e.g. if
+  coordinates need to grow, or for unpacked states, a new sum is allocated with
+  AggregationState.sum. Added states are never modified. Results are identical
+  to summing the states in the order they are added.
+
+  Example:
+    accumulator = AggregationStateAccumulator()
+    for aggregation_state in aggregation_states:
+      accumulator.add(aggregation_state)
+    total = accumulator.result()
+  """
+
+  def __init__(self, aggregation_state: Optional[AggregationState] = None):
+    """Init.
+
+    Args:
+      aggregation_state: (Optional) Initial state. It is not modified.
+    """
+    self._sum = AggregationState.zero()
+    # Whether self._sum is a PackedAggregationState with buffers that can be
+    # modified in place, i.e. which aren't shared with any added state.
+    self._owns_buffers = False
+    if aggregation_state is not None:
+      self.add(aggregation_state)
+
+  def add(self, aggregation_state: AggregationState) -> None:
+    """Adds a state to the sum."""
+    if aggregation_state.is_zero():
+      return
+    if (
+        self._owns_buffers
+        and isinstance(aggregation_state, PackedAggregationState)
+        and aggregation_state.layout == self._sum.layout
+    ):
+      for dtype, buffer in self._sum.buffers.items():
+        np.add(buffer, aggregation_state.buffers[dtype], out=buffer)
+      return
+    # Allocates new buffers for packed sums, see
+    # PackedAggregationState.sum_with_same_layout.
+    self._sum = AggregationState.sum([self._sum, aggregation_state])
+    self._owns_buffers = isinstance(self._sum, PackedAggregationState)
+
+  def result(self) -> AggregationState:
+    """Returns the sum, which must not be modified by the caller.
+
+    Adding further states modifies the returned state.
+    """
+    return self._sum
+
+
+def num_bins_per_aggregation_stage(
+    total_num_elements: int, max_bin_size: int
+) -> list[int]:
+  """Number of bins in each stage of a multi-stage aggregation.
+
+  Elements are aggregated in stages, such that no bin at any stage has to
+  aggregate more than `max_bin_size` elements. The last stage has a single bin.
+
+  Args:
+    total_num_elements: Number of elements to aggregate.
+    max_bin_size: Maximum number of elements aggregated in each bin.
+
+  Returns:
+    The number of bins for each stage.
+  """
+  if max_bin_size < 2:
+    raise ValueError('The maximum bin size must be at least 2.')
+  num_current_elements = total_num_elements
+  num_bins_per_stage = []
+  while num_current_elements > max_bin_size:
+    num_bins = math.ceil(num_current_elements / max_bin_size)
+    num_bins_per_stage.append(num_bins)
+    num_current_elements = num_bins
+  num_bins_per_stage.append(1)
+  return num_bins_per_stage
+
+
+def max_bin_size_for_memory_budget(
+    state_nbytes: int,
+    memory_budget_bytes: int,
+    max_bin_size: Optional[int] = None,
+) -> int:
+  """Largest bin size for which summing a bin fits into a memory budget.
+
+  In the worst case, a bin holds all of its input states and the sum at once,
+  i.e. summing n states takes (n + 1) * state_nbytes. Note that states with
+  preserved time dimensions grow as they are summed, in which case
+  `state_nbytes` should be the size of the largest partial sum.
+
+  Args:
+    state_nbytes: Estimated size of a single AggregationState in bytes, e.g.
+      PackedAggregationState.nbytes of a sampled state.
+    memory_budget_bytes: Memory available for summing a single bin.
+    max_bin_size: (Optional) Upper limit of the bin size.
+
+  Returns:
+    The bin size, which is at least 2.
+  """
+  bin_size = memory_budget_bytes // max(state_nbytes, 1) - 1
+  if bin_size < 2:
+    logging.warning(
+        'AggregationStates of %d bytes exceed the memory budget of %d bytes'
+        ' for summing even 2 states at a time.',
+        state_nbytes,
+        memory_budget_bytes,
+    )
+    bin_size = 2
+  if max_bin_size is not None:
+    bin_size = min(bin_size, max_bin_size)
+  return bin_size
+
+
+class MultiStageSum:
+  """Sums keyed AggregationStates in stages, like beam_utils.CombineMultiStage.
+
+  At each stage, an element with key k is summed into the bin with key
+  k % num_bins, in increasing order of k, and the bins become the elements of
+  the next stage. This gives bit-identical results to the Beam pipeline (as long
+  as Beam adds elements in the order of their keys), while only keeping one
+  partial sum per stage in memory, provided that elements are added in the
+  order given by `keys_in_order`.
+
+  Example:
+    multi_stage_sum = MultiStageSum(len(chunks), max_bin_size=10)
+    for key in multi_stage_sum.keys_in_order():
+      multi_stage_sum.add(key, compute_aggregation_state(chunks[key]))
+    aggregation_state = multi_stage_sum.result()
+  """
+
+  def __init__(self, total_num_elements: int, max_bin_size: Optional[int]):
+    """Init.
+
+    Args:
+      total_num_elements: Number of elements, with keys in [0,
+        total_num_elements).
+      max_bin_size: Maximum number of elements summed in each bin. If None,
+        everything is summed in a single stage.
+    """
+    self.total_num_elements = total_num_elements
+    if max_bin_size is None:
+      self.num_bins_per_stage = [1]
+    else:
+      self.num_bins_per_stage = num_bins_per_aggregation_stage(
+          total_num_elements, max_bin_size
+      )
+    # (bin key, AggregationStateAccumulator) of the current bin of each stage.
+    self._partial_sums = [None] * len(self.num_bins_per_stage)
+    self._last_path = None
+
+  def _path(self, key: int) -> tuple[int, ...]:
+    """Keys of the bins an element ends up in, from the last stage backwards."""
+    path = [key]
+    for num_bins in self.num_bins_per_stage:
+      path.append(path[-1] % num_bins)
+    return tuple(reversed(path))
+
+  def keys_in_order(self) -> list[int]:
+    """Keys in an order which completes one bin at a time at every stage."""
+    return sorted(range(self.total_num_elements), key=self._path)
+
+  def _close(self, stage: int) -> None:
+    """Adds the partial sum of the current bin of a stage to the next stage."""
+    bin_key, partial_sum = self._partial_sums[stage]
+    self._partial_sums[stage] = None
+    self._add_to_stage(stage + 1, bin_key, partial_sum.result())
+
+  def _add_to_stage(
+      self, stage: int, key: int, aggregation_state: AggregationState
+  ) -> None:
+    bin_key = key % self.num_bins_per_stage[stage]
+    if self._partial_sums[stage] is None:
+      self._partial_sums[stage] = (bin_key, AggregationStateAccumulator())
+    self._partial_sums[stage][1].add(aggregation_state)
+
+  def add(self, key: int, aggregation_state: AggregationState) -> None:
+    """Adds the state of an element, in the order of keys_in_order."""
+    path = self._path(key)
+    if self._last_path is not None and path <= self._last_path:
+      raise ValueError(
+          f'Key {key} was added out of the order given by keys_in_order.'
+      )
+    self._last_path = path
+    # Close the bins this element doesn't belong to, from the first stage on.
+    for stage in range(len(self._partial_sums) - 1):
+      current = self._partial_sums[stage]
+      # path[-stage - 2] is the key of the bin of this element at this stage.
+      if current is not None and current[0] != path[-stage - 2]:
+        self._close(stage)
+    self._add_to_stage(0, key, aggregation_state)
+
+  def result(self) -> AggregationState:
+    """Returns the sum of all added states."""
+    for stage in range(len(self._partial_sums) - 1):
+      if self._partial_sums[stage] is not None:
+        self._close(stage)
+    if self._partial_sums[-1] is None:
+      return AggregationState.zero()
+    return self._partial_sums[-1][1].result()
+
+
+class _WeightsAndBins(NamedTuple):
+  """Weights and bins for statistics with a given set of coordinates."""
+
+  weights: list[xr.DataArray]
+  bin_masks: list[xr.DataArray]
+  bin_indices: list[binning.BinIndices]
+  # Dims of the aggregated statistic, in the order xr.dot would return them.
+  output_dims: list[Hashable]
+
+
+def _segmented_sum(
+    x: xr.DataArray,
+    bin_indices: Sequence[binning.BinIndices],
+) -> xr.DataArray:
+  """Sums x over the dims of bin_indices, separately for each bin.
+
+  Equivalent to xr.dot(x, *bin_masks) for the corresponding bin masks, but
+  with a bincount over a flat bin index instead of a contraction with a dense
+  [n_bins, ...] mask. Sums are accumulated in float64, so results equal those
+  of the masks up to float rounding, and non-finite values propagate the same
+  way.
+
+  Args:
+    x: DataArray to sum.
+    bin_indices: Indices of mutually exclusive bins, their dims are reduced.
+
+  Returns:
+    DataArray with the remaining dims of x followed by one dim per binning.
+  """
+  # Combine the indices of all binnings into a single flat index.
+  flat_indices = xr.DataArray(0)
+  invalid = xr.DataArray(False)
+  for indices, bins in bin_indices:
+    flat_indices = flat_indices * bins.size + indices
+    invalid = invalid | (indices < 0)
+  flat_indices = xr.where(invalid, -1, flat_indices)
+  segment_dims = list(flat_indices.dims)
+  flat_indices = flat_indices.values.ravel()
+  num_bins = [bins.size for _, bins in bin_indices]
+  num_flat_bins = int(np.prod(num_bins))
+
+  other_dims = [d for d in x.dims if d not in segment_dims]
+  other_shape = tuple(x.sizes[d] for d in other_dims)
+  num_rows = int(np.prod(other_shape))
+  values = x.transpose(*other_dims, *segment_dims).values
+  values = values.reshape(num_rows, -1)
+
+  valid = flat_indices >= 0
+  rows = np.arange(num_rows)[:, np.newaxis] * num_flat_bins
+  summed = np.bincount(
+      (rows + flat_indices[valid]).ravel(),
+      weights=values[:, valid].ravel(),
+      minlength=num_rows * num_flat_bins,
+  ).reshape(num_rows, num_flat_bins)
+  non_finite = ~np.isfinite(values) if values.dtype.kind in 'fc' else None
+  if non_finite is not None and non_finite.any():
+    # Mimic the contraction with a mask, where non-finite values are summed
+    # into their own bin by the bincount (e.g. inf stays inf), but make every
+    # other bin NaN, since 0 * inf = 0 * NaN = NaN.
+    non_finite_in_bin = np.bincount(
+        (rows + flat_indices[valid]).ravel(),
+        weights=non_finite[:, valid].ravel(),
+        minlength=num_rows * num_flat_bins,
+    ).reshape(num_rows, num_flat_bins)
+    non_finite_in_row = non_finite.sum(axis=1, keepdims=True)
+    summed[non_finite_in_row > non_finite_in_bin] = np.nan
+  summed = summed.astype(x.dtype).reshape(other_shape + tuple(num_bins))
+
+  coords = {
+      k: v for k, v in x.coords.items() if set(v.dims).issubset(other_dims)
+  }
+  for _, bins in bin_indices:
+    coords.update(bins.coords)
+  return xr.DataArray(
+      summed,
+      dims=other_dims + [bins.dims[0] for _, bins in bin_indices],
+      coords=coords,
+  )
+
+
 @dataclasses.dataclass
 class Aggregator:
   """Defines aggregation over set of dataset dimensions.
@@ -191,6 +1064,12 @@ class Aggregator:
   different region from the binning region, the aggregated statistics will
   still be NaN. Use the masking option to avoid this.
 
+  Binnings with mutually exclusive bins that provide bin indices (see
+  binning.Binning.create_bin_indices) are aggregated with a segmented sum when
+  the binned dimensions are reduced, so that memory and compute don't grow with
+  the number of bins. The results are the same as with the bin masks, up to
+  float rounding.
+
   Attributes:
     reduce_dims: Dimensions to average over. Any variables that don't have these
       dimensions will be filtered out during aggregation.
@@ -201,6 +1080,12 @@ class Aggregator:
       passed to aggregate_statistics.
     skipna: If True, NaNs will be omitted in the aggregation. This option is not
       recommended, as it won't catch unexpected NaNs.
+    cache_size: Maximum number of entries in the cache of weights, bin masks and
+      sums of weights, which are memoized per set of coordinates across calls
+      to aggregate_statistics. Since these only depend on the coordinates of a
+      statistic, they can be reused for all chunks with the same coordinates,
+      e.g. the same latitude/longitude grid. Zero disables the cache. Default:
+      16.
   """
 
   reduce_dims: Collection[str]
@@ -208,15 +1093,20 @@ class Aggregator:
   weigh_by: Sequence[weighting.Weighting] | None = None
   masked: bool = False
   skipna: bool = False
+  cache_size: int = 16
 
-  def aggregation_fn(
+  def __post_init__(self):
+    self._cache = caching.LRUCache(self.cache_size)
+
+  def cache_info(self) -> caching.CacheInfo:
+    """Returns hit/miss statistics of the weights and bin masks cache."""
+    return self._cache.cache_info()
+
+  def _weights_and_bins(
       self,
       stat: xr.DataArray,
-  ) -> xr.DataArray | None:
-    """Returns the aggregation function."""
-    # Recall that masked out values have already been set to zero in
-    # aggregate_statistics. The logic below has to respect this.
-
+  ) -> _WeightsAndBins | None:
+    """Returns weights and bins for a statistic, or None if not possible."""
     reduce_dims_set = set(self.reduce_dims)
     eval_unit_dims = set(stat.dims)
     if not reduce_dims_set.issubset(eval_unit_dims):
@@ -233,18 +1123,144 @@ class Aggregator:
       raise ValueError('Bin dimension names must be unique.')
 
     bin_masks = []
+    bin_indices = []
+    # Bin dimensions in the order of bin_by, used to order the output dims.
+    bin_dims = []
     for binning_method in self.bin_by or []:
+      indices = binning_method.create_bin_indices(stat)
+      if (
+          indices is not None
+          and indices.indices.dims
+          and set(indices.indices.dims).issubset(reduce_dims_set)
+      ):
+        # Mutually exclusive bins over reduced dims, use a segmented sum.
+        bin_indices.append(indices)
+        bin_dims.append([binning_method.bin_dim_name])
+        continue
       bin_mask = binning_method.create_bin_mask(stat)
       # bin_masks_dims are all of the dims the mask operate with on the input
       # data (e.g. the actual bin dimension does not count).
       bin_masks_dims = set(bin_mask.dims) - {binning_method.bin_dim_name}
       if bin_masks_dims.issubset(eval_unit_dims):
         bin_masks.append(bin_mask)
+        bin_dims.append(list(bin_mask.dims))
       else:
         # Can't bin based on dims that aren't present as evaluation unit dims:
         return None
 
-    return xr.dot(stat, *weights, *bin_masks, dims=reduce_dims_set)
+    # Order of output dims of xr.dot with all weights and bin masks.
+    output_dims = []
+    for dims in [stat.dims] + [w.dims for w in weights] + bin_dims:
+      output_dims.extend(
+          d for d in dims if d not in reduce_dims_set and d not in output_dims
+      )
+    return _WeightsAndBins(weights, bin_masks, bin_indices, output_dims)
+
+  def _weighted_sum(
+      self,
+      x: xr.DataArray,
+      weights_and_bins: _WeightsAndBins,
+  ) -> xr.DataArray:
+    """Weighted sum of x over reduce_dims for each bin."""
+    weights, bin_masks, bin_indices, output_dims = weights_and_bins
+    reduce_dims_set = set(self.reduce_dims)
+    if not bin_indices:
+      return xr.dot(x, *weights, *bin_masks, dim=reduce_dims_set)
+    # Reduce all dims except those with bin indices with a contraction, and the
+    # rest with a segmented sum.
+    segment_dims = set()
+    for indices in bin_indices:
+      segment_dims.update(indices.indices.dims)
+    partial = xr.dot(x, *weights, *bin_masks, dim=reduce_dims_set - segment_dims)
+    # Transpose so that extra dims from x (e.g. _COMPONENT_DIM) come first.
+    return _segmented_sum(partial, bin_indices).transpose(*output_dims, ...)
+
+  def aggregation_fn(
+      self,
+      stat: xr.DataArray,
+  ) -> xr.DataArray | None:
+    """Returns the aggregation function."""
+    # Recall that masked out values have already been set to zero in
+    # aggregate_statistics. The logic below has to respect this.
+    weights_and_bins = self._weights_and_bins(stat)
+    if weights_and_bins is None:
+      return None
+    return self._weighted_sum(stat, weights_and_bins)
+
+  def _aggregate_statistic_and_weights(
+      self,
+      stat: xr.DataArray,
+  ) -> xr.DataArray | None:
+    """Returns the weighted sums of a statistic and of its weights.
+
+    The two sums are stacked along _COMPONENT_DIM so that they can be computed
+    with a single contraction and passed through xarray_tree as one leaf.
+
+    Args:
+      stat: Individual statistic DataArray.
+
+    Returns:
+      DataArray with the sum of weighted statistics at index 0 and the sum of
+      weights at index 1 along _COMPONENT_DIM, or None if the statistic can't be
+      aggregated.
+    """
+    key = caching.coordinates_fingerprint(stat)
+    weights_and_bins = self._cache.get_or_compute(
+        ('weights_and_bins', key), lambda: self._weights_and_bins(stat)
+    )
+    if weights_and_bins is None:
+      return None
+
+    def weighted_sum(x):
+      return self._weighted_sum(x, weights_and_bins)
+
+    has_mask = self.masked and hasattr(stat, 'mask')
+    if not has_mask and not self.skipna:
+      # Without masking, the sum of weights only depends on the coordinates and
+      # dtype of the statistic, so it can be shared between all statistics
+      # and variables with the same coordinates.
+      sum_weights = self._cache.get_or_compute(
+          ('sum_weights', key, stat.dtype), lambda: weighted_sum(xr.ones_like(stat))
+      )
+      return xr.concat(
+          [weighted_sum(stat), sum_weights],
+          dim=_COMPONENT_DIM,
+          coords='minimal',
+          compat='override',
+          join='override',
+      )
+
+    # Avoid use of DataArray.where for the weights which is much slower than
+    # casting of booleans and/or element-wise logical operations on booleans.
+    if has_mask:
+      mask = stat.mask
+      if self.skipna:
+        mask = mask & ~stat.isnull()
+      mask = mask.astype(stat.dtype)
+      # We need to broadcast the mask to the same shape as the stat, so that
+      # reductions over it behave the same as reductions over the full stat.
+      mask = mask.broadcast_like(stat)
+    else:
+      mask = (~stat.isnull()).astype(stat.dtype)
+
+    if self.skipna:
+      # Set NaNs to zero, so that they will be ignored in the sum.
+      stat = stat.where(~stat.isnull(), 0)
+    if has_mask:
+      # Set masked values to Zero for stat and weights, which will therefore
+      # be ignored in mean_statistics(). this is equivalent to multiplying by
+      # the mask, but avoids NaN * 0 -> NaN in cases where there are NaNs in
+      # masked positions. Only for variables with a mask attribute.
+      stat = stat.where(stat.mask, 0)
+
+    stacked = xr.concat(
+        [stat, mask.transpose(*stat.dims)],
+        dim=_COMPONENT_DIM,
+        coords='minimal',
+        compat='override',
+        join='override',
+    )
+    return weighted_sum(stacked)
 
   def aggregate_statistics(
       self,
@@ -252,6 +1268,11 @@ class Aggregator:
   ) -> AggregationState:
     """Aggregate all statistics for a batch.
 
+    Weights and bin masks are computed once for each distinct set of
+    coordinates and shared between statistics, variables and (see cache_size)
+    batches. The weighted statistics and the weights are then summed in a
+    single pass.
+
     Args:
       statistics: Full statistics for a batch.
 
@@ -261,39 +1282,9 @@ class Aggregator:
       and then used to compute weighted mean statistics, and from these the
       final values of the metrics.
     """
-
-    # Different aggregator for each variable
-    def batch_aggregator_for_var_and_stat(stat):
-      if self.skipna:
-        # Set NaNs to zero, so that they will be ignored in the sum.
-        stat = stat.where(~stat.isnull(), 0)
-
-      if self.masked and hasattr(stat, 'mask'):
-        # Set masked values to Zero for stat and weights, which will therefore
-        # be ignored in mean_statistics(). this is equivalent to multiplying by
-        # the mask, but avoids NaN * 0 -> NaN in cases where there are NaNs in
-        # masked positions. Only for variables with a mask attribute.
-        stat = stat.where(stat.mask, 0)
-
-      return self.aggregation_fn(stat)
-
-    def batch_aggregator_weights_for_var_and_stat(stat):
-      # Avoid use of DataArray.where here which is much slower than casting
-      # of booleans and/or element-wise logical operations on booleans.
-      if self.masked and hasattr(stat, 'mask'):
-        mask = stat.mask
-        if self.skipna:
-          mask = mask & ~stat.isnull()
-        mask = mask.astype(stat.dtype)
-        # We need to broadcast the mask to the same shape as the stat, so that
-        # reductions over it behave the same as reductions over the full stat.
-        mask = mask.broadcast_like(stat)
-      elif self.skipna:
-        mask = (~stat.isnull()).astype(stat.dtype)
-      else:
-        mask = xr.ones_like(stat)
-
-      return self.aggregation_fn(mask)
+    sums = xarray_tree.map_structure(
+        self._aggregate_statistic_and_weights, statistics
+    )
 
     def filter_nones(x):
       result = {}
@@ -306,13 +1297,12 @@ class Aggregator:
           result[name] = {k: v for k, v in values.items() if v is not None}
       return result
 
-    sum_weighted_statistics = filter_nones(
-        xarray_tree.map_structure(batch_aggregator_for_var_and_stat, statistics)
+    sums = filter_nones(sums)
+    sum_weighted_statistics = xarray_tree.map_structure(
+        lambda x: x.isel({_COMPONENT_DIM: 0}, drop=True), sums
     )
-    sum_weights = filter_nones(
-        xarray_tree.map_structure(
-            batch_aggregator_weights_for_var_and_stat, statistics
-        )
+    sum_weights = xarray_tree.map_structure(
+        lambda x: x.isel({_COMPONENT_DIM: 1}, drop=True), sums
     )
 
     # Aggregator for every dataset in statistics
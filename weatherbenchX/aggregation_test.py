@@ -13,17 +13,20 @@
 # limitations under the License.
 
 from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
 from weatherbenchX import aggregation
 from weatherbenchX import binning
 from weatherbenchX import test_utils
 from weatherbenchX import weighting
+from weatherbenchX import xarray_tree
 from weatherbenchX.data_loaders import base as data_loaders_base
 from weatherbenchX.metrics import base as metrics_base
 from weatherbenchX.metrics import deterministic
 import xarray as xr
 
 
-class AggregationTest(absltest.TestCase):
+class AggregationTest(parameterized.TestCase):
 
   def _get_test_data(self):
     template = test_utils.mock_prediction_data(
@@ -228,6 +231,335 @@ class AggregationTest(absltest.TestCase):
         set(actual.dims), set(['bins1', 'bins2', 'lead_time', 'level'])
     )
 
+  def test_weights_and_bin_masks_computed_once_per_coordinates(self):
+    predictions, targets = self._get_test_data()
+    all_metrics = {'rmse': deterministic.RMSE(), 'mae': deterministic.MAE()}
+
+    class CountingWeighting(weighting.GridAreaWeighting):
+      num_calls = 0
+
+      def weights(self, statistic):
+        CountingWeighting.num_calls += 1
+        return super().weights(statistic)
+
+    class CountingRegions(binning.Regions):
+      num_calls = 0
+
+      def create_bin_mask(self, statistic):
+        CountingRegions.num_calls += 1
+        return super().create_bin_mask(statistic)
+
+    regions = {'north': ((0, 90), (0, 360)), 'south': ((-90, 0), (0, 360))}
+    aggregation_kwargs = {
+        'reduce_dims': ['init_time', 'latitude', 'longitude'],
+        'bin_by': [CountingRegions(regions)],
+        'weigh_by': [CountingWeighting()],
+    }
+    aggregation_state = self._aggregate(
+        all_metrics, predictions, targets, aggregation_kwargs
+    )
+    # 2 statistics x 2 variables, but only two distinct sets of coordinates
+    # (with and without level).
+    self.assertEqual(CountingWeighting.num_calls, 2)
+    self.assertEqual(CountingRegions.num_calls, 2)
+
+    # Results are reused across calls with the same coordinates.
+    aggregator = aggregation.Aggregator(**aggregation_kwargs)
+    statistics = metrics_base.compute_unique_statistics_for_all_metrics(
+        all_metrics, predictions, targets
+    )
+    aggregator.aggregate_statistics(statistics)
+    aggregator.aggregate_statistics(statistics)
+    self.assertEqual(CountingWeighting.num_calls, 4)
+    self.assertEqual(CountingRegions.num_calls, 4)
+    self.assertEqual(aggregator.cache_info().misses, 4)
+    self.assertEqual(aggregator.cache_info().hits, 12)
+
+    # Results should match aggregating each statistic separately.
+    for stat_name, stat in statistics.items():
+      for var_name in stat:
+        xr.testing.assert_allclose(
+            aggregation_state.sum_weighted_statistics[stat_name][var_name],
+            aggregator.aggregation_fn(stat[var_name]),
+        )
+        xr.testing.assert_allclose(
+            aggregation_state.sum_weights[stat_name][var_name],
+            aggregator.aggregation_fn(xr.ones_like(stat[var_name])),
+        )
+
+  def test_segmented_sum_matches_bin_masks(self):
+    predictions, targets = self._get_test_data()
+    rng = np.random.default_rng(0)
+    predictions = predictions.map(lambda x: x + rng.random(x.shape))
+    # A NaN outside of the reduced bins propagates the same way for both.
+    targets['2m_temperature'][0, 0, 0, 0] = np.nan
+    all_metrics = {'rmse': deterministic.RMSE(), 'bias': deterministic.Bias()}
+
+    class ByTimeUnitWithMasks(binning.ByTimeUnit):
+
+      def create_bin_indices(self, statistic):
+        return None
+
+    for bin_by_class in [binning.ByTimeUnit, ByTimeUnitWithMasks]:
+      bin_by = [
+          bin_by_class('day', 'init_time'),
+          binning.Regions({'north': ((0, 90), (0, 360))}),
+      ]
+      aggregation_state = self._aggregate(
+          all_metrics,
+          predictions,
+          targets,
+          {
+              'reduce_dims': ['init_time', 'latitude', 'longitude'],
+              'bin_by': bin_by,
+              'weigh_by': [weighting.GridAreaWeighting()],
+          },
+      )
+      if bin_by_class is binning.ByTimeUnit:
+        segmented_values = aggregation_state.metric_values(all_metrics)
+      else:
+        masked_values = aggregation_state.metric_values(all_metrics)
+
+    xr.testing.assert_allclose(segmented_values, masked_values)
+    self.assertEqual(segmented_values.init_time_day.size, 2)
+
+  def test_segmented_sum_non_finite_and_float32(self):
+    rng = np.random.default_rng(0)
+    x = xr.DataArray(
+        rng.random((4, 7)).astype(np.float32), dims=['row', 'point']
+    )
+    # inf within its own bin, NaN in another bin, -inf outside of all bins,
+    # and +inf and -inf in the same bin.
+    x[0, 1] = np.inf
+    x[1, 3] = np.nan
+    x[2, 6] = -np.inf
+    x[3, 4] = np.inf
+    x[3, 5] = -np.inf
+    indices = xr.DataArray([0, 0, 1, 1, 2, 2, -1], dims=['point'])
+    bins = xr.DataArray(['a', 'b', 'c'], dims=['bin'])
+    bins = bins.assign_coords(bin=bins)
+    segmented = aggregation._segmented_sum(
+        x, [binning.BinIndices(indices, bins)]
+    )
+    masks = (indices == xr.DataArray(np.arange(3), dims=['bin'])).astype(
+        np.float32
+    ).assign_coords(bin=bins)
+    with np.errstate(invalid='ignore'):
+      masked = xr.dot(x, masks, dim='point')
+    self.assertEqual(segmented.dtype, np.float32)
+    xr.testing.assert_allclose(segmented, masked.transpose(*segmented.dims))
+    np.testing.assert_array_equal(
+        segmented.values[:, 0], [np.inf, np.nan, np.nan, np.nan]
+    )
+    np.testing.assert_array_equal(np.isnan(segmented.values[3]), [1, 1, 1])
+
+  def test_packed_aggregation_state(self):
+    predictions, targets = self._get_test_data()
+    all_metrics = {'rmse': deterministic.RMSE(), 'mae': deterministic.MAE()}
+    statistics = metrics_base.compute_unique_statistics_for_all_metrics(
+        all_metrics, predictions, targets
+    )
+    statistics['Dataset'] = xr.Dataset(statistics['SquaredError'])
+    aggregator = aggregation.Aggregator(reduce_dims=['latitude', 'longitude'])
+    aggregation_state = aggregator.aggregate_statistics(statistics)
+
+    packed = aggregation_state.pack()
+    self.assertIsInstance(packed, aggregation.PackedAggregationState)
+    self.assertLen(packed.buffers, 1)
+    # Two sets of coordinates, with and without level.
+    self.assertLen(packed.layout.coords, 2)
+
+    def assert_states_identical(actual, expected):
+      for tree in ('sum_weighted_statistics', 'sum_weights'):
+        actual_tree = getattr(actual, tree)
+        expected_tree = getattr(expected, tree)
+        self.assertCountEqual(actual_tree.keys(), expected_tree.keys())
+        for stat in expected_tree:
+          self.assertIsInstance(actual_tree[stat], type(expected_tree[stat]))
+          for var in expected_tree[stat]:
+            xr.testing.assert_identical(
+                actual_tree[stat][var], expected_tree[stat][var]
+            )
+
+    # Lossless round trip.
+    assert_states_identical(packed.unpack(), aggregation_state)
+
+    # Sum with the same layout stays packed.
+    summed = aggregation.AggregationState.sum(
+        [packed, aggregation.AggregationState.zero(), packed]
+    )
+    self.assertIsInstance(summed, aggregation.PackedAggregationState)
+    assert_states_identical(summed, aggregation_state + aggregation_state)
+
+    # Sum with a different layout falls back to aligning coordinates.
+    other_state = aggregator.aggregate_statistics(
+        xarray_tree.map_structure(
+            lambda x: x.isel(init_time=slice(1)), statistics
+        )
+    )
+    summed = packed + other_state.pack()
+    self.assertIsInstance(summed, aggregation.PackedAggregationState)
+    assert_states_identical(summed, aggregation_state + other_state)
+    xr.testing.assert_identical(
+        summed.metric_values(all_metrics),
+        (aggregation_state + other_state).metric_values(all_metrics),
+    )
+
+  def test_combining_sum_misaligned_coordinates(self):
+    rng = np.random.default_rng(0)
+    all_stations = np.array([f'station_{i}' for i in range(20)])
+    init_times = np.array(
+        ['2020-01-01T00', '2020-01-01T12', '2020-01-02T00'],
+        dtype='datetime64[ns]',
+    )
+    data_arrays = []
+    for i in range(5):
+      stations = np.sort(rng.choice(20, size=8, replace=False))
+      times = init_times[i % 2 : i % 2 + 2]
+      data_array = xr.DataArray(
+          rng.random((len(times), len(stations))),
+          dims=['init_time', 'station'],
+          coords={
+              'init_time': times,
+              'station': all_stations[stations],
+              'elevation': ('station', stations),
+              'valid_time': (
+                  ('init_time', 'station'),
+                  np.broadcast_to(times[:, None], (len(times), 8)),
+              ),
+              'lead_time': np.timedelta64(6, 'h'),
+          },
+      )
+      data_arrays.append(data_array.transpose() if i % 2 else data_array)
+
+    result = aggregation._combining_sum(data_arrays)
+    self.assertIsNotNone(aggregation._union_index_sum(data_arrays))
+
+    coords = xr.merge([a.coords for a in data_arrays], join='outer')
+    aligned = xr.align(
+        *[a.reset_coords(drop=True) for a in data_arrays],
+        join='outer',
+        fill_value=0,
+    )
+    expected = sum(aligned[1:], start=aligned[0])
+    expected.coords.update(coords.variables)
+    xr.testing.assert_identical(result, expected)
+    for name, coord in expected.coords.items():
+      self.assertEqual(result[name].dtype, coord.dtype)
+
+  def test_aggregation_state_accumulator(self):
+    rng = np.random.default_rng(0)
+
+    def state(x):
+      values = xr.DataArray(rng.random(len(x)), dims=['x'], coords={'x': x})
+      return aggregation.AggregationState(
+          {'stat': {'var': values}}, {'stat': {'var': xr.ones_like(values)}}
+      ).pack()
+
+    states = [state(range(5)) for _ in range(4)] + [state(range(3, 8))]
+    states += [state(range(8)) for _ in range(3)]
+    inputs = [s.buffers['<f8'].copy() for s in states]
+
+    accumulator = aggregation.AggregationStateAccumulator()
+    self.assertTrue(accumulator.result().is_zero())
+    buffers = []
+    for s in states:
+      accumulator.add(s)
+      accumulator.add(aggregation.AggregationState.zero())
+      buffers.append(accumulator.result().buffers['<f8'])
+    # Only reallocated when the coordinates grow.
+    for i in (1, 2, 3, 6, 7):
+      self.assertIs(buffers[i], buffers[i - 1])
+    self.assertIsNot(buffers[4], buffers[3])
+
+    expected = states[0]
+    for s in states[1:]:
+      expected = expected + s
+    result = accumulator.result()
+    self.assertIsInstance(result, aggregation.PackedAggregationState)
+    self.assertEqual(result.layout, expected.layout)
+    np.testing.assert_array_equal(
+        result.buffers['<f8'], expected.buffers['<f8']
+    )
+    # Inputs are not modified.
+    for s, buffer in zip(states, inputs):
+      np.testing.assert_array_equal(s.buffers['<f8'], buffer)
+
+  def test_num_bins_per_aggregation_stage(self):
+    self.assertEqual(aggregation.num_bins_per_aggregation_stage(10, 10), [1])
+    self.assertEqual(
+        aggregation.num_bins_per_aggregation_stage(250, 10), [25, 3, 1]
+    )
+    with self.assertRaises(ValueError):
+      aggregation.num_bins_per_aggregation_stage(10, 1)
+
+  def test_max_bin_size_for_memory_budget(self):
+    self.assertEqual(
+        aggregation.max_bin_size_for_memory_budget(100, 1000), 9
+    )
+    self.assertEqual(
+        aggregation.max_bin_size_for_memory_budget(100, 1000, max_bin_size=5),
+        5,
+    )
+    with self.assertLogs(level='WARNING'):
+      self.assertEqual(
+          aggregation.max_bin_size_for_memory_budget(100, 150), 2
+      )
+
+  @parameterized.parameters(
+      {'num_elements': 1, 'max_bin_size': 3},
+      {'num_elements': 7, 'max_bin_size': None},
+      {'num_elements': 50, 'max_bin_size': 3},
+      {'num_elements': 101, 'max_bin_size': 10},
+  )
+  def test_multi_stage_sum(self, num_elements, max_bin_size):
+    rng = np.random.default_rng(0)
+
+    def state(i):
+      values = xr.DataArray(rng.random(5), dims=['x'], coords={'x': range(5)})
+      return aggregation.AggregationState(
+          {'stat': {'var': values * 10.0**i}}, {'stat': {'var': values}}
+      ).pack()
+
+    states = [state(i % 7) for i in range(num_elements)]
+
+    # Sum in stages, like beam_utils.CombineMultiStage.
+    keyed_states = dict(enumerate(states))
+    if max_bin_size is None:
+      num_bins_per_stage = [1]
+    else:
+      num_bins_per_stage = aggregation.num_bins_per_aggregation_stage(
+          num_elements, max_bin_size
+      )
+    for num_bins in num_bins_per_stage:
+      bins = {}
+      for key in sorted(keyed_states):
+        bins[key % num_bins] = (
+            bins.get(key % num_bins, aggregation.AggregationState.zero())
+            + keyed_states[key]
+        )
+      keyed_states = bins
+    expected = keyed_states[0]
+
+    multi_stage_sum = aggregation.MultiStageSum(num_elements, max_bin_size)
+    keys = multi_stage_sum.keys_in_order()
+    self.assertCountEqual(keys, range(num_elements))
+    for key in keys:
+      multi_stage_sum.add(key, states[key])
+    result = multi_stage_sum.result()
+
+    for stat in ('sum_weighted_statistics', 'sum_weights'):
+      np.testing.assert_array_equal(
+          getattr(result, stat)['stat']['var'].values,
+          getattr(expected, stat)['stat']['var'].values,
+      )
+
+    if num_elements > 1:
+      with self.assertRaisesRegex(ValueError, 'out of the order'):
+        multi_stage_sum = aggregation.MultiStageSum(num_elements, max_bin_size)
+        multi_stage_sum.add(keys[1], states[keys[1]])
+        multi_stage_sum.add(keys[0], states[keys[0]])
+
 
 if __name__ == '__main__':
   absltest.main()
@@ -13,21 +13,39 @@
 # limitations under the License.
 """Defines the beam pipeline for evaluation."""
 
+from concurrent import futures
 import logging
-from typing import Callable, Hashable, Iterable, Mapping, Optional, Tuple, Union
+from typing import Callable, Hashable, Iterable, Mapping, Optional, Sequence, Tuple, Union
 import apache_beam as beam
-import fsspec
 import numpy as np
 from weatherbenchX import aggregation
 from weatherbenchX import beam_utils
+from weatherbenchX import checkpointing
+from weatherbenchX import logging_utils
+from weatherbenchX import prefetching
+from weatherbenchX import profiling
 from weatherbenchX import time_chunks
+from weatherbenchX import writers
 from weatherbenchX.data_loaders import base as data_loaders_base
 from weatherbenchX.metrics import base as metrics_base
 import xarray as xr
 
 
 class LoadChunksAndAggregateStatistics(beam.DoFn):
-  """Loads prediction and target chunks, computes and aggregates statistics."""
+  """Loads prediction and target chunks, computes and aggregates statistics.
+
+  Chunks are loaded on a thread pool, with targets and predictions loaded
+  concurrently where possible. With prefetch_depth > 0, the following elements
+  of a bundle are loaded while the current one is being computed. Their outputs
+  are then emitted later, at the latest in finish_bundle (in the global window).
+
+  With checkpoints, the AggregationState of every chunk is stored, and chunks
+  which are already stored (e.g. by a previous, failed run) aren't loaded again.
+
+  The timings and sizes of the stages of each chunk (loading, interpolation,
+  compute, statistics and aggregation, see profiling) are reported as Beam
+  distributions in the 'weatherbenchX' namespace.
+  """
 
   def __init__(
       self,
@@ -36,6 +54,11 @@ class LoadChunksAndAggregateStatistics(beam.DoFn):
       metrics: Mapping[str, metrics_base.Metric],
       aggregator: aggregation.Aggregator,
       setup_fn: Optional[Callable[[], None]] = None,
+      pack_aggregation_states: bool = True,
+      prefetch_depth: int = 0,
+      prefetch_max_bytes: Optional[int] = None,
+      checkpoints: Optional[checkpointing.ChunkCheckpoints] = None,
+      grouped_targets: Optional[prefetching.ValidTimeGroupedTargets] = None,
   ):
     """Init.
 
@@ -45,13 +68,38 @@ class LoadChunksAndAggregateStatistics(beam.DoFn):
       metrics: A dictionary of metrics to compute.
       aggregator: Aggregation instance.
       setup_fn: (Optional) A function to call once per worker.
+      pack_aggregation_states: Whether to output PackedAggregationStates, which
+        are much cheaper to sum in the combine stages. Default: True.
+      prefetch_depth: Number of chunks to load ahead while the current chunk is
+        being computed. Default: 0.
+      prefetch_max_bytes: (Optional) Limit on the size of prefetched chunks per
+        DoFn instance, see prefetching.ChunkPrefetcher.
+      checkpoints: (Optional) Where to store the AggregationState of each
+        chunk, and to load already computed chunks from.
+      grouped_targets: (Optional) Loads the targets of chunks by group of valid
+        times, which are kept across elements, see
+        prefetching.ValidTimeGroupedTargets.
     """
     self.predictions_loader = predictions_loader
     self.targets_loader = targets_loader
     self.metrics = metrics
     self.aggregator = aggregator
     self.setup_fn = setup_fn
+    self.pack_aggregation_states = pack_aggregation_states
+    self.prefetch_depth = prefetch_depth
+    self.prefetch_max_bytes = prefetch_max_bytes
+    self.checkpoints = checkpoints
+    self.grouped_targets = grouped_targets
     self.is_initialized = False
+    self._prefetcher = None
+    # Measurements of each chunk in flight, by chunk index.
+    self._chunk_profiles = {}
+    self._chunks_computed = beam.metrics.Metrics.counter(
+        beam_utils.METRICS_NAMESPACE, 'chunks_computed'
+    )
+    self._chunks_from_checkpoints = beam.metrics.Metrics.counter(
+        beam_utils.METRICS_NAMESPACE, 'chunks_from_checkpoints'
+    )
 
   def setup(self):
     # Call this function once per process.
@@ -59,37 +107,215 @@ class LoadChunksAndAggregateStatistics(beam.DoFn):
       if not self.is_initialized:
         self.setup_fn()
         self.is_initialized = True
+    self._prefetcher = prefetching.ChunkPrefetcher(
+        self.predictions_loader,
+        self.targets_loader,
+        depth=self.prefetch_depth,
+        max_bytes=self.prefetch_max_bytes,
+        grouped_targets=self.grouped_targets,
+    )
+
+  def _aggregate_chunk(
+      self,
+      chunk_index: int,
+      predictions_chunk: prefetching.Chunk,
+      targets_chunk: prefetching.Chunk,
+  ) -> Tuple[int, aggregation.AggregationState]:
+    logging.info(
+        'LoadChunksAndAggregateStatistics chunks: %s',
+        logging_utils.Summary(
+            (chunk_index, (predictions_chunk, targets_chunk))
+        ),
+    )
+    # Includes the loads of this chunk, on other threads.
+    with profiling.collect(self._chunk_profiles.pop(chunk_index)) as profile:
+      with profiling.timer('statistics'):
+        statistics = metrics_base.compute_unique_statistics_for_all_metrics(
+            self.metrics, predictions_chunk, targets_chunk
+        )
+      with profiling.timer('aggregation'):
+        aggregation_state = self.aggregator.aggregate_statistics(statistics)
+        if self.pack_aggregation_states:
+          aggregation_state = aggregation_state.pack()
+      profiling.record('aggregation_state_bytes', aggregation_state.nbytes)
+    if self.checkpoints is not None:
+      self.checkpoints.save(chunk_index, aggregation_state)
+    logging.info(
+        'LoadChunksAndAggregateStatistics outputs: %s',
+        logging_utils.Summary((chunk_index, aggregation_state)),
+    )
+    beam_utils.report_measurements(profile.drain())
+    self._chunks_computed.inc()
+    return chunk_index, aggregation_state
 
   def process(
       self, all_inputs: Tuple[int, Tuple[np.ndarray, Union[np.ndarray, slice]]]
   ) -> Iterable[Tuple[int, aggregation.AggregationState]]:
-    """Returns AggregationState for a given init/lead time.
+    """Returns AggregationStates of this or previously prefetched chunks.
 
     Args:
       all_inputs: (chunk_index, (init_times, lead_times))
 
-    Returns:
+    Yields:
       (chunk_index, aggregation_state)
     """
-    logging.info('LoadChunksAndAggregateStatistics inputs: %s', all_inputs)
-    chunk_index, (init_times, lead_times) = all_inputs
-    targets_chunk = self.targets_loader.load_chunk(init_times, lead_times)
-    predictions_chunk = self.predictions_loader.load_chunk(
-        init_times, lead_times, targets_chunk
-    )
     logging.info(
-        'LoadChunksAndAggregateStatistics chunks: %s',
-        (chunk_index, (predictions_chunk, targets_chunk)),
+        'LoadChunksAndAggregateStatistics inputs: %s',
+        logging_utils.Summary(all_inputs),
     )
-    statistics = metrics_base.compute_unique_statistics_for_all_metrics(
-        self.metrics, predictions_chunk, targets_chunk
+    chunk_index, (init_times, lead_times) = all_inputs
+    if self.checkpoints is not None and self.checkpoints.exists(chunk_index):
+      logging.info('Loading chunk %d from checkpoints', chunk_index)
+      self._chunks_from_checkpoints.inc()
+      yield chunk_index, self.checkpoints.load(chunk_index)
+      return
+    with profiling.collect() as self._chunk_profiles[chunk_index]:
+      self._prefetcher.submit(chunk_index, init_times, lead_times)
+    while self._prefetcher.is_full():
+      yield self._aggregate_chunk(*self._prefetcher.pop())
+
+  def finish_bundle(self) -> Iterable[beam.utils.windowed_value.WindowedValue]:
+    # Elements are only created by define_pipeline, in the global window.
+    while self._prefetcher:
+      yield beam.transforms.window.GlobalWindows.windowed_value(
+          self._aggregate_chunk(*self._prefetcher.pop())
+      )
+
+  def teardown(self):
+    if self._prefetcher is not None:
+      self._prefetcher.close()
+
+
+class LoadChunksAndAggregateStatisticsForModels(beam.DoFn):
+  """Loads each target chunk once and aggregates statistics for every model.
+
+  Targets and the predictions of all models are loaded concurrently on a thread
+  pool, with predictions that require the targets as reference loaded once the
+  targets are available. The statistics of each model are computed as soon as
+  its predictions are loaded, so a worker holds a target chunk and at most one
+  prediction chunk per model.
+  """
+
+  def __init__(
+      self,
+      predictions_loaders: Mapping[str, data_loaders_base.DataLoader],
+      targets_loader: data_loaders_base.DataLoader,
+      metrics: Mapping[str, metrics_base.Metric],
+      aggregator: aggregation.Aggregator,
+      setup_fn: Optional[Callable[[], None]] = None,
+      pack_aggregation_states: bool = True,
+      grouped_targets: Optional[prefetching.ValidTimeGroupedTargets] = None,
+  ):
+    """Init.
+
+    Args:
+      predictions_loaders: The data loaders for the predictions, by model name.
+      targets_loader: The data loader for the targets, shared by all models.
+      metrics: A dictionary of metrics to compute.
+      aggregator: Aggregation instance.
+      setup_fn: (Optional) A function to call once per worker.
+      pack_aggregation_states: Whether to output PackedAggregationStates, which
+        are much cheaper to sum in the combine stages. Default: True.
+      grouped_targets: (Optional) Loads the targets of chunks by group of valid
+        times, which are kept across elements, see
+        prefetching.ValidTimeGroupedTargets.
+    """
+    self.predictions_loaders = predictions_loaders
+    self.targets_loader = targets_loader
+    self.metrics = metrics
+    self.aggregator = aggregator
+    self.setup_fn = setup_fn
+    self.pack_aggregation_states = pack_aggregation_states
+    self.grouped_targets = grouped_targets
+    self.is_initialized = False
+    self._executor = None
+
+  def setup(self):
+    # Call this function once per process.
+    if self.setup_fn is not None:
+      if not self.is_initialized:
+        self.setup_fn()
+        self.is_initialized = True
+    self._executor = futures.ThreadPoolExecutor(
+        max_workers=len(self.predictions_loaders) + 1,
+        thread_name_prefix='LoadChunksForModels',
     )
-    aggregation_state = self.aggregator.aggregate_statistics(statistics)
+
+  def process(
+      self, all_inputs: Tuple[int, Tuple[np.ndarray, Union[np.ndarray, slice]]]
+  ) -> Iterable[Tuple[str, Tuple[int, aggregation.AggregationState]]]:
+    """Returns the AggregationState of the chunk for every model.
+
+    Args:
+      all_inputs: (chunk_index, (init_times, lead_times))
+
+    Yields:
+      (model_name, (chunk_index, aggregation_state))
+    """
     logging.info(
-        'LoadChunksAndAggregateStatistics outputs: %s',
-        (chunk_index, aggregation_state),
+        'LoadChunksAndAggregateStatisticsForModels inputs: %s',
+        logging_utils.Summary(all_inputs),
     )
-    return [(chunk_index, aggregation_state)]
+    chunk_index, (init_times, lead_times) = all_inputs
+    # Measurements of this chunk only, including its loads on other threads.
+    with profiling.collect() as profile:
+      if self.grouped_targets is not None:
+        targets_future = self._executor.submit(
+            profiling.in_active_profile(self.grouped_targets.load),
+            chunk_index,
+            init_times,
+            lead_times,
+        )
+      else:
+        targets_future = self._executor.submit(
+            profiling.in_active_profile(prefetching.load_targets),
+            self.targets_loader,
+            init_times,
+            lead_times,
+        )
+      predictions_futures = {}
+      for model_name, loader in self.predictions_loaders.items():
+        if loader.requires_reference:
+          # The executor runs tasks in submission order, so the targets are
+          # already being loaded by the time this waits on them.
+          predictions_futures[model_name] = self._executor.submit(
+              profiling.in_active_profile(
+                  lambda loader=loader: prefetching.load_predictions(
+                      loader, init_times, lead_times, targets_future.result()
+                  )
+              )
+          )
+        else:
+          predictions_futures[model_name] = self._executor.submit(
+              profiling.in_active_profile(prefetching.load_predictions),
+              loader,
+              init_times,
+              lead_times,
+          )
+      targets_chunk = targets_future.result()
+    for model_name in list(predictions_futures):
+      # Not around the yield, which runs downstream transforms.
+      with profiling.collect(profile):
+        predictions_chunk = predictions_futures.pop(model_name).result()
+        with profiling.timer('statistics'):
+          statistics = metrics_base.compute_unique_statistics_for_all_metrics(
+              self.metrics, predictions_chunk, targets_chunk
+          )
+        with profiling.timer('aggregation'):
+          aggregation_state = self.aggregator.aggregate_statistics(statistics)
+          if self.pack_aggregation_states:
+            aggregation_state = aggregation_state.pack()
+        profiling.record('aggregation_state_bytes', aggregation_state.nbytes)
+      beam_utils.report_measurements(profile.drain())
+      logging.info(
+          'LoadChunksAndAggregateStatisticsForModels outputs: %s',
+          logging_utils.Summary((model_name, chunk_index, aggregation_state)),
+      )
+      yield model_name, (chunk_index, aggregation_state)
+
+  def teardown(self):
+    if self._executor is not None:
+      self._executor.shutdown(wait=True)
 
 
 class ComputeMetrics(beam.DoFn):
@@ -115,33 +341,298 @@ class ComputeMetrics(beam.DoFn):
     Returns:
       A Dataset with the metrics (in a list for Beam).
     """
-    logging.info('ComputeMetrics inputs: %s', aggregation_state)
+    logging.info(
+        'ComputeMetrics inputs: %s', logging_utils.Summary(aggregation_state)
+    )
     return [aggregation_state.metric_values(self.metrics)]
 
 
 class WriteMetrics(beam.DoFn):
   """Writes the metrics to a file."""
 
-  def __init__(self, out_path: str):
+  def __init__(
+      self,
+      out_path: str,
+      compression: Optional[str] = None,
+      compression_level: int = 4,
+  ):
     """Init.
 
     Args:
-      out_path: The full path to write the metrics to.
+      out_path: The full path to write the metrics to, see
+        writers.write_metrics.
+      compression: (Optional) Lossless compression of NetCDF output, None or
+        'zlib'. Default: None.
+      compression_level: Compression level, if compression is used. Default: 4.
     """
     self.out_path = out_path
+    self.compression = compression
+    self.compression_level = compression_level
 
   def process(self, metrics: xr.Dataset) -> None:
-    """Writes the metrics to a NetCDF file.
+    """Writes the metrics to a NetCDF file or Zarr store.
 
     Args:
       metrics: Metrics dataset to write to disc.
     """
-    logging.info('WriteMetrics inputs: %s', metrics)
-    with fsspec.open(self.out_path, 'wb', auto_mkdir=True) as f:
-      f.write(metrics.to_netcdf())
+    logging.info('WriteMetrics inputs: %s', logging_utils.Summary(metrics))
+    writers.write_metrics(
+        metrics,
+        self.out_path,
+        compression=self.compression,
+        compression_level=self.compression_level,
+    )
     return None
 
 
+class WriteTimeSeriesTemplate(beam.DoFn):
+  """Creates the Zarr store for time series metrics.
+
+  The structure is taken from the metrics of any block of init times, and
+  extended to all init times. Variables without init_time are written with the
+  store, the others by WriteTimeSeriesBlock. The store is chunked by block, so
+  that blocks can be written in parallel.
+  """
+
+  def __init__(
+      self, out_path: str, init_times: np.ndarray, init_time_chunk_size: int
+  ):
+    """Init.
+
+    Args:
+      out_path: Path of the Zarr store.
+      init_times: All init times.
+      init_time_chunk_size: Number of init times per block.
+    """
+    self.out_path = out_path
+    self.init_times = init_times
+    self.init_time_chunk_size = init_time_chunk_size
+
+  def process(self, block_metrics: Optional[xr.Dataset]) -> None:
+    logging.info(
+        'WriteTimeSeriesTemplate inputs: %s',
+        logging_utils.Summary(block_metrics),
+    )
+    if block_metrics is None:
+      # There are no blocks to write.
+      return None
+    data_vars = {}
+    coords = {}
+    for name, variable in block_metrics.variables.items():
+      if name == 'init_time':
+        variable = xr.Variable('init_time', self.init_times)
+      elif 'init_time' in variable.dims:
+        # Broadcast the values of the first init time, without copying them.
+        # Dask arrays are only written when computed, i.e. not at all here.
+        variable = (
+            variable.isel(init_time=0)
+            .set_dims(dict(variable.sizes, init_time=len(self.init_times)))
+            .transpose(*variable.dims)
+            .chunk({'init_time': self.init_time_chunk_size})
+        )
+      else:
+        # Written with the template, since blocks only write init_time.
+        variable = variable.copy(deep=False)
+      variable.encoding = {}
+      if name in block_metrics.coords:
+        coords[name] = variable
+      else:
+        data_vars[name] = variable
+    template = xr.Dataset(data_vars, coords, attrs=block_metrics.attrs)
+    template.to_zarr(self.out_path, mode='w', compute=False)
+    return None
+
+
+class WriteTimeSeriesBlock(beam.DoFn):
+  """Writes the metrics of a block of init times into its Zarr region."""
+
+  def __init__(self, out_path: str, block_offsets: Sequence[int]):
+    """Init.
+
+    Args:
+      out_path: Path of the Zarr store, created by WriteTimeSeriesTemplate.
+      block_offsets: Index of the first init time of each block.
+    """
+    self.out_path = out_path
+    self.block_offsets = block_offsets
+
+  def process(
+      self,
+      block_index_and_metrics: Tuple[int, xr.Dataset],
+      unused_template_written: Iterable[None],
+  ) -> None:
+    block_index, block_metrics = block_index_and_metrics
+    logging.info('WriteTimeSeriesBlock inputs: %s', block_index)
+    # Variables without init_time are already written with the template.
+    block_metrics = block_metrics.drop_vars([
+        name
+        for name, variable in block_metrics.variables.items()
+        if 'init_time' not in variable.dims
+    ])
+    start = self.block_offsets[block_index]
+    block_metrics.to_zarr(
+        self.out_path,
+        region={
+            'init_time': slice(start, start + block_metrics.sizes['init_time'])
+        },
+    )
+    return None
+
+
+class AddToIncrementalState(beam.DoFn):
+  """Adds the AggregationState to the stored incremental state."""
+
+  def __init__(
+      self,
+      path: str,
+      metrics: Mapping[str, metrics_base.Metric],
+      aggregator: aggregation.Aggregator,
+      init_times: np.ndarray,
+  ):
+    """Init.
+
+    Args:
+      path: Path of the stored checkpointing.IncrementalAggregationState.
+      metrics: A dictionary of metrics to compute.
+      aggregator: Aggregation instance.
+      init_times: Init times included in the AggregationState.
+    """
+    self.path = path
+    self.metrics = metrics
+    self.aggregator = aggregator
+    self.init_times = init_times
+
+  def process(
+      self, aggregation_state: aggregation.AggregationState
+  ) -> Iterable[checkpointing.IncrementalAggregationState]:
+    incremental_state = (
+        checkpointing.IncrementalAggregationState.load_for_update(
+            self.path, self.metrics, self.aggregator, self.init_times
+        )
+    )
+    return [incremental_state.add(aggregation_state, self.init_times)]
+
+
+class WriteIncrementalState(beam.DoFn):
+  """Stores the updated incremental state."""
+
+  def __init__(self, path: str):
+    """Init.
+
+    Args:
+      path: Path to store the checkpointing.IncrementalAggregationState at.
+    """
+    self.path = path
+
+  def process(
+      self,
+      incremental_state: checkpointing.IncrementalAggregationState,
+      unused_metrics_written: Iterable[None],
+  ) -> None:
+    logging.info(
+        'WriteIncrementalState inputs: %s',
+        logging_utils.Summary(incremental_state),
+    )
+    incremental_state.save(self.path)
+    return None
+
+
+def _create_time_chunks(
+    root: beam.Pipeline,
+    times: time_chunks.TimeChunks,
+    groups: Optional[Sequence[Sequence[int]]] = None,
+) -> beam.PCollection:
+  """Creates (chunk_index, (init_times, lead_times)) for all chunks of times.
+
+  Only the chunk indices are part of the pipeline graph, and the chunks are
+  computed from them on the workers, which keeps the graph small for
+  evaluations with many chunks.
+
+  Args:
+    root: Pipeline root.
+    times: TimeChunks instance, or any sequence of (init_times, lead_times).
+    groups: (Optional) Groups of chunk indices, e.g. from
+      time_chunks.group_by_valid_time. The chunks of a group are created
+      together, and are loaded one after the other by the same worker, since
+      loading is fused with creating them.
+
+  Returns:
+    PCollection of (chunk_index, (init_times, lead_times)).
+  """
+  if groups is None:
+    return (
+        root
+        | 'CreateTimeChunkIndices' >> beam.Create(range(len(times)))
+        | 'GetTimeChunks' >> beam.Map(lambda index: (index, times[index]))
+    )
+  return (
+      root
+      | 'CreateTimeChunkGroups' >> beam.Create(range(len(groups)))
+      | 'GetTimeChunks'
+      >> beam.FlatMap(
+          lambda group: [(index, times[index]) for index in groups[group]]
+      )
+  )
+
+
+def _group_by_valid_time(
+    times: time_chunks.TimeChunks,
+    targets_loader: data_loaders_base.DataLoader,
+    max_valid_times_per_group: Optional[int],
+) -> Tuple[
+    Optional[list[list[int]]], Optional[prefetching.ValidTimeGroupedTargets]
+]:
+  """Groups of chunks and the targets loader for them, if enabled."""
+  if max_valid_times_per_group is None:
+    return None, None
+  groups = time_chunks.group_by_valid_time(times, max_valid_times_per_group)
+  logging.info(
+      'Grouped %d chunks into %d groups of at most %d valid times.',
+      len(times),
+      len(groups),
+      max_valid_times_per_group,
+  )
+  return groups, prefetching.ValidTimeGroupedTargets(
+      targets_loader, times, groups
+  )
+
+
+def sample_aggregation_state_nbytes(
+    times: Iterable[Tuple[np.ndarray, Union[np.ndarray, slice]]],
+    predictions_loader: data_loaders_base.DataLoader,
+    targets_loader: data_loaders_base.DataLoader,
+    metrics: Mapping[str, metrics_base.Metric],
+    aggregator: aggregation.Aggregator,
+) -> int:
+  """Size of the packed AggregationState of the first time chunk in bytes.
+
+  Args:
+    times: TimeChunks instance.
+    predictions_loader: DataLoader instance.
+    targets_loader: DataLoader instance.
+    metrics: A dictionary of metrics to compute.
+    aggregator: Aggregation instance.
+
+  Returns:
+    PackedAggregationState.nbytes of the first chunk, 0 if there are no chunks.
+  """
+  first_chunk = next(iter(times), None)
+  if first_chunk is None:
+    return 0
+  init_times, lead_times = first_chunk
+  targets_chunk = targets_loader.load_chunk(init_times, lead_times)
+  predictions_chunk = predictions_loader.load_chunk(
+      init_times, lead_times, targets_chunk
+  )
+  statistics = metrics_base.compute_unique_statistics_for_all_metrics(
+      metrics, predictions_chunk, targets_chunk
+  )
+  aggregation_state = aggregator.aggregate_statistics(statistics)
+  if aggregation_state.is_zero():
+    return 0
+  return aggregation_state.pack().nbytes
+
+
 def define_pipeline(
     root: beam.Pipeline,
     times: time_chunks.TimeChunks,
@@ -152,6 +643,16 @@ def define_pipeline(
     out_path: str,
     max_chunks_per_aggregation_stage: Optional[int] = 10,
     setup_fn: Optional[Callable[[], None]] = None,
+    pack_aggregation_states: bool = True,
+    aggregation_state_compression: Optional[str] = None,
+    prefetch_depth: int = 0,
+    prefetch_max_bytes: Optional[int] = None,
+    checkpoint_dir: Optional[str] = None,
+    checkpoint_key: Optional[str] = None,
+    incremental: bool = False,
+    aggregation_memory_budget_bytes: Optional[int] = None,
+    output_compression: Optional[str] = None,
+    max_valid_times_per_group: Optional[int] = None,
 ):
   """Defines the beam pipeline.
 
@@ -162,19 +663,99 @@ def define_pipeline(
     targets_loader: DataLoader instance.
     metrics: A dictionary of metrics to compute.
     aggregator: Aggregation instance.
-    out_path: The full path to write the metrics to.
+    out_path: The full path to write the metrics to, as NetCDF, or as Zarr if
+      it ends in '.zarr'.
     max_chunks_per_aggregation_stage: The maximum number of chunks to aggregate
       in a single worker. If None, does aggregation in a single step. Default:
       10
     setup_fn: (Optional) A function to call once per worker in
       LoadChunksAndAggregateStatistics.
+    pack_aggregation_states: Whether to pass PackedAggregationStates between
+      stages, which are much cheaper to sum when combining. Default: True.
+    aggregation_state_compression: (Optional) Lossless compression of the
+      AggregationStates shuffled between stages, None or 'zlib'. Selects the
+      Beam coder of these states, see beam_utils.aggregation_state_type.
+      Default: None.
+    prefetch_depth: Number of chunks each LoadChunksAndAggregateStatistics
+      instance loads ahead while computing the current chunk. Default: 0.
+    prefetch_max_bytes: (Optional) Limit on the size of prefetched chunks per
+      LoadChunksAndAggregateStatistics instance.
+    checkpoint_dir: (Optional) Local or fsspec directory to store the
+      AggregationState of each chunk in, see checkpointing.ChunkCheckpoints. A
+      rerun of the same evaluation only computes the chunks which are missing.
+    checkpoint_key: (Optional) Key of the checkpoints, instead of a fingerprint
+      of times, loaders, metrics and aggregator.
+    incremental: Whether to add the AggregationState of `times` to the one
+      stored next to `out_path` by previous incremental runs, see
+      checkpointing.IncrementalAggregationState. The metrics are then computed
+      from the total state, and the total state is stored for the next run,
+      after the metrics are written. Raises a ValueError if metrics or
+      aggregator differ from previous runs, or if any init times were already
+      included. Default: False.
+    aggregation_memory_budget_bytes: (Optional) Memory available for summing
+      a single bin of AggregationStates. If given, the first chunk is loaded
+      and aggregated when defining the pipeline, to measure the size of its
+      state, and max_chunks_per_aggregation_stage is lowered such that a bin
+      fits into the budget, see aggregation.max_bin_size_for_memory_budget.
+    output_compression: (Optional) Lossless compression of NetCDF output, see
+      writers.write_metrics. Default: None.
+    max_valid_times_per_group: (Optional) If given, chunks which share valid
+      times are grouped and processed by the same worker, which loads the
+      targets of each valid time of a group once, see
+      time_chunks.group_by_valid_time. Requires exact lead times, and a
+      targets loader which loads valid times without lead times, like
+      TargetsFromXarray.
   """
   if max_chunks_per_aggregation_stage is None:
     max_chunks_per_aggregation_stage = len(times)
+  if aggregation_memory_budget_bytes is not None:
+    state_nbytes = sample_aggregation_state_nbytes(
+        times, predictions_loader, targets_loader, metrics, aggregator
+    )
+    max_chunks_per_aggregation_stage = (
+        aggregation.max_bin_size_for_memory_budget(
+            state_nbytes,
+            aggregation_memory_budget_bytes,
+            max_chunks_per_aggregation_stage,
+        )
+    )
+    logging.info(
+        'Sampled AggregationState of %d bytes, summing at most %d chunks per'
+        ' aggregation stage for a memory budget of %d bytes.',
+        state_nbytes,
+        max_chunks_per_aggregation_stage,
+        aggregation_memory_budget_bytes,
+    )
 
-  _ = (
-      root
-      | 'CreateTimeChunks' >> beam.Create(enumerate(times))  # pytype: disable=wrong-arg-types
+  state_type = beam_utils.aggregation_state_type(
+      aggregation_state_compression
+  )
+
+  checkpoints = None
+  if checkpoint_dir is not None:
+    checkpoints = checkpointing.ChunkCheckpoints.for_evaluation(
+        checkpoint_dir,
+        times,
+        predictions_loader,
+        targets_loader,
+        metrics,
+        aggregator,
+        checkpoint_key=checkpoint_key,
+    )
+
+  if incremental:
+    incremental_state_path = checkpointing.incremental_state_path(out_path)
+    init_times = checkpointing.init_times_of_chunks(times)
+    # Fail when defining the pipeline rather than after computing everything.
+    checkpointing.IncrementalAggregationState.load_for_update(
+        incremental_state_path, metrics, aggregator, init_times
+    )
+
+  groups, grouped_targets = _group_by_valid_time(
+      times, targets_loader, max_valid_times_per_group
+  )
+  aggregation_states = (
+      _create_time_chunks(root, times, groups)
       | 'LoadChunksAndAggregateStatistics'
       >> beam.ParDo(
           LoadChunksAndAggregateStatistics(
@@ -183,14 +764,265 @@ def define_pipeline(
               metrics,
               aggregator,
               setup_fn=setup_fn,
+              pack_aggregation_states=pack_aggregation_states,
+              prefetch_depth=prefetch_depth,
+              prefetch_max_bytes=prefetch_max_bytes,
+              checkpoints=checkpoints,
+              grouped_targets=grouped_targets,
           )
-      )
+      ).with_output_types(Tuple[int, state_type])
       | 'AggregateStates'
       >> beam_utils.CombineMultiStage(
           total_num_elements=len(times),
           max_bin_size=max_chunks_per_aggregation_stage,
-          combine_fn=beam_utils.SumAggregationStates(),
+          combine_fn=beam_utils.SumAggregationStates(state_type),
+          element_type=state_type,
       )
+  )
+  if incremental:
+    incremental_states = aggregation_states | 'AddToIncrementalState' >> (
+        beam.ParDo(
+            AddToIncrementalState(
+                incremental_state_path, metrics, aggregator, init_times
+            )
+        )
+    )
+    aggregation_states = incremental_states | 'GetAggregationState' >> (
+        beam.Map(lambda state: state.aggregation_state)
+    )
+
+  metrics_written = (
+      aggregation_states
       | 'ComputeMetrics' >> beam.ParDo(ComputeMetrics(metrics))
-      | 'WriteMetrics' >> beam.ParDo(WriteMetrics(out_path))
+      | 'WriteMetrics' >> beam.ParDo(
+          WriteMetrics(out_path, compression=output_compression)
+      )
+  )
+  if incremental:
+    # The empty output of WriteMetrics as side input makes sure that the state
+    # is only stored once the metrics are written.
+    _ = incremental_states | 'WriteIncrementalState' >> beam.ParDo(
+        WriteIncrementalState(incremental_state_path),
+        beam.pvalue.AsIter(metrics_written),
+    )
+
+
+def define_multi_model_pipeline(
+    root: beam.Pipeline,
+    times: time_chunks.TimeChunks,
+    predictions_loaders: Mapping[str, data_loaders_base.DataLoader],
+    targets_loader: data_loaders_base.DataLoader,
+    metrics: Mapping[str, metrics_base.Metric],
+    aggregator: aggregation.Aggregator,
+    out_paths: Mapping[str, str],
+    max_chunks_per_aggregation_stage: Optional[int] = 10,
+    setup_fn: Optional[Callable[[], None]] = None,
+    pack_aggregation_states: bool = True,
+    output_compression: Optional[str] = None,
+    max_valid_times_per_group: Optional[int] = None,
+):
+  """Defines a beam pipeline evaluating several models against the same targets.
+
+  This is equivalent to running define_pipeline for each model, but every
+  target chunk is only loaded once and used for all models. The
+  AggregationStates of each model are then aggregated and written separately.
+
+  Args:
+    root: Pipeline root.
+    times: TimeChunks instance.
+    predictions_loaders: DataLoader instances for the predictions, by model
+      name.
+    targets_loader: DataLoader instance for the targets of all models.
+    metrics: A dictionary of metrics to compute.
+    aggregator: Aggregation instance.
+    out_paths: The full paths to write the metrics of each model to, by model
+      name, see writers.write_metrics.
+    max_chunks_per_aggregation_stage: The maximum number of chunks to aggregate
+      in a single worker. If None, does aggregation in a single step. Default:
+      10
+    setup_fn: (Optional) A function to call once per worker in
+      LoadChunksAndAggregateStatisticsForModels.
+    pack_aggregation_states: Whether to pass PackedAggregationStates between
+      stages, which are much cheaper to sum when combining. Default: True.
+    output_compression: (Optional) Lossless compression of NetCDF output, see
+      writers.write_metrics. Default: None.
+    max_valid_times_per_group: (Optional) If given, loads the targets of each
+      valid time once per group of chunks, as in define_pipeline.
+  """
+  model_names = list(predictions_loaders)
+  if set(model_names) != set(out_paths):
+    raise ValueError(
+        f'Models of predictions_loaders {sorted(model_names)} and out_paths'
+        f' {sorted(out_paths)} differ.'
+    )
+  if max_chunks_per_aggregation_stage is None:
+    max_chunks_per_aggregation_stage = len(times)
+  groups, grouped_targets = _group_by_valid_time(
+      times, targets_loader, max_valid_times_per_group
+  )
+
+  aggregation_states = (
+      _create_time_chunks(root, times, groups)
+      | 'LoadChunksAndAggregateStatistics'
+      >> beam.ParDo(
+          LoadChunksAndAggregateStatisticsForModels(
+              predictions_loaders,
+              targets_loader,
+              metrics,
+              aggregator,
+              setup_fn=setup_fn,
+              pack_aggregation_states=pack_aggregation_states,
+              grouped_targets=grouped_targets,
+          )
+      ).with_output_types(
+          Tuple[str, Tuple[int, aggregation.AggregationState]]
+      )
+      | 'PartitionByModel'
+      >> beam.Partition(
+          lambda element, _: model_names.index(element[0]), len(model_names)
+      )
+  )
+  for model_name, model_states in zip(model_names, aggregation_states):
+    _ = (
+        model_states
+        | f'DropModelName_{model_name}'
+        >> beam.Values().with_output_types(
+            Tuple[int, aggregation.AggregationState]
+        )
+        | f'AggregateStates_{model_name}'
+        >> beam_utils.CombineMultiStage(
+            total_num_elements=len(times),
+            max_bin_size=max_chunks_per_aggregation_stage,
+            combine_fn=beam_utils.SumAggregationStates(),
+            element_type=aggregation.AggregationState,
+        )
+        | f'ComputeMetrics_{model_name}' >> beam.ParDo(ComputeMetrics(metrics))
+        | f'WriteMetrics_{model_name}'
+        >> beam.ParDo(
+            WriteMetrics(
+                out_paths[model_name], compression=output_compression
+            )
+        )
+    )
+
+
+def _take_any(elements: Iterable[xr.Dataset]) -> Optional[xr.Dataset]:
+  return next((e for e in elements if e is not None), None)
+
+
+def define_time_series_pipeline(
+    root: beam.Pipeline,
+    times: time_chunks.TimeChunks,
+    predictions_loader: data_loaders_base.DataLoader,
+    targets_loader: data_loaders_base.DataLoader,
+    metrics: Mapping[str, metrics_base.Metric],
+    aggregator: aggregation.Aggregator,
+    out_path: str,
+    setup_fn: Optional[Callable[[], None]] = None,
+    pack_aggregation_states: bool = True,
+    prefetch_depth: int = 0,
+    prefetch_max_bytes: Optional[int] = None,
+):
+  """Defines a beam pipeline for metrics which aren't reduced over init_time.
+
+  Unlike define_pipeline, AggregationStates are only summed within blocks of
+  init times, given by the init time chunks of `times`, and never across
+  blocks. The metrics of each block are written in parallel into their region of
+  a single Zarr store, chunked by block, rather than computing and writing all
+  metrics on a single worker.
+
+  Args:
+    root: Pipeline root.
+    times: TimeChunks instance. Each chunk of init times is written as a block.
+      All chunks must have the same number of init times, except the last one,
+      which can have fewer, e.g. not CostBalancedTimeChunks.
+    predictions_loader: DataLoader instance.
+    targets_loader: DataLoader instance.
+    metrics: A dictionary of metrics to compute.
+    aggregator: Aggregation instance, which must not reduce over init_time.
+    out_path: The path of the Zarr store to write the metrics to.
+    setup_fn: (Optional) A function to call once per worker in
+      LoadChunksAndAggregateStatistics.
+    pack_aggregation_states: Whether to pass PackedAggregationStates between
+      stages, which are much cheaper to sum when combining. Default: True.
+    prefetch_depth: Number of chunks each LoadChunksAndAggregateStatistics
+      instance loads ahead while computing the current chunk. Default: 0.
+    prefetch_max_bytes: (Optional) Limit on the size of prefetched chunks per
+      LoadChunksAndAggregateStatistics instance.
+  """
+  if 'init_time' in aggregator.reduce_dims:
+    raise ValueError(
+        'Time series metrics require an aggregator which does not reduce over'
+        ' init_time.'
+    )
+  init_time_chunks = times.init_time_chunks
+  # Blocks must match the (regular) Zarr chunks, since blocks sharing a Zarr
+  # chunk would overwrite each other's data when written in parallel.
+  block_sizes = [len(c) for c in init_time_chunks]
+  if any(size != block_sizes[0] for size in block_sizes[:-1]) or (
+      block_sizes and block_sizes[-1] > block_sizes[0]
+  ):
+    raise ValueError(
+        'Time series metrics require init time chunks of equal size, except'
+        f' for a smaller last one, got sizes {block_sizes}.'
+    )
+  num_lead_time_chunks = times.num_lead_time_chunks
+  block_offsets = np.cumsum([0] + block_sizes).tolist()
+
+  def _block_key(
+      inputs: Tuple[int, aggregation.AggregationState],
+  ) -> Tuple[int, aggregation.AggregationState]:
+    # TimeChunks iterates over all lead time chunks of each init time chunk.
+    chunk_index, aggregation_state = inputs
+    return chunk_index // num_lead_time_chunks, aggregation_state
+
+  block_metrics = (
+      _create_time_chunks(root, times)
+      | 'LoadChunksAndAggregateStatistics'
+      >> beam.ParDo(
+          LoadChunksAndAggregateStatistics(
+              predictions_loader,
+              targets_loader,
+              metrics,
+              aggregator,
+              setup_fn=setup_fn,
+              pack_aggregation_states=pack_aggregation_states,
+              prefetch_depth=prefetch_depth,
+              prefetch_max_bytes=prefetch_max_bytes,
+          )
+      ).with_output_types(Tuple[int, aggregation.AggregationState])
+      | 'KeyByInitTimeBlock'
+      >> beam.Map(_block_key).with_output_types(
+          Tuple[int, aggregation.AggregationState]
+      )
+      | 'AggregateStatesPerBlock'
+      >> beam.CombinePerKey(
+          beam_utils.SumAggregationStates()
+      ).with_output_types(Tuple[int, aggregation.AggregationState])
+      | 'ComputeBlockMetrics'
+      >> beam.MapTuple(
+          lambda block_index, aggregation_state: (
+              block_index,
+              aggregation_state.metric_values(metrics),
+          )
+      )
+  )
+  template_written = (
+      block_metrics
+      | 'DropBlockIndex' >> beam.Values()
+      | 'TakeAnyBlock' >> beam.CombineGlobally(_take_any)
+      | 'WriteTemplate'
+      >> beam.ParDo(
+          WriteTimeSeriesTemplate(
+              out_path,
+              np.concatenate(init_time_chunks),
+              len(init_time_chunks[0]),
+          )
+      )
+  )
+  # The empty output of WriteTemplate as side input makes sure that the store
+  # exists before any block is written.
+  _ = block_metrics | 'WriteBlocks' >> beam.ParDo(
+      WriteTimeSeriesBlock(out_path, block_offsets),
+      beam.pvalue.AsIter(template_written),
   )
@@ -12,12 +12,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
+
 from absl.testing import absltest
 from absl.testing import parameterized
+import apache_beam as beam
 from apache_beam.testing import test_pipeline
 import numpy as np
 from weatherbenchX import aggregation
 from weatherbenchX import beam_pipeline
+from weatherbenchX import beam_utils
 from weatherbenchX import test_utils
 from weatherbenchX import time_chunks
 from weatherbenchX.data_loaders import xarray_loaders
@@ -33,8 +37,27 @@ class BeamPipelineTest(parameterized.TestCase):
       {'reduce_dims': ['init_time']},
       {'reduce_dims': ['latitude', 'longitude']},
       {'reduce_dims': []},
+      {
+          'reduce_dims': ['init_time'],
+          'aggregation_state_compression': 'zlib',
+      },
+      {'reduce_dims': ['init_time'], 'prefetch_depth': 2},
+      {'reduce_dims': [], 'aggregation_memory_budget_bytes': 10**5},
+      {'reduce_dims': ['init_time'], 'max_valid_times_per_group': 4},
+      {
+          'reduce_dims': [],
+          'prefetch_depth': 2,
+          'max_valid_times_per_group': 4,
+      },
   )
-  def test_pipeline(self, reduce_dims):
+  def test_pipeline(
+      self,
+      reduce_dims,
+      aggregation_state_compression=None,
+      prefetch_depth=0,
+      aggregation_memory_budget_bytes=None,
+      max_valid_times_per_group=None,
+  ):
     """Test equivalence of pipeline results to directly computed results."""
     predictions_path = self.create_tempdir('predictions.zarr').full_path
     targets_path = self.create_tempdir('targets.zarr').full_path
@@ -102,12 +125,280 @@ class BeamPipelineTest(parameterized.TestCase):
           all_metrics,
           aggregation_method,
           out_path=results_path,
+          aggregation_state_compression=aggregation_state_compression,
+          prefetch_depth=prefetch_depth,
+          aggregation_memory_budget_bytes=aggregation_memory_budget_bytes,
+          max_valid_times_per_group=max_valid_times_per_group,
       )
     pipeline_results = xr.open_dataset(results_path).compute()
 
     # There can be small differences due to numerical errors.
     xr.testing.assert_allclose(direct_results, pipeline_results, rtol=1e-3)
 
+  @parameterized.parameters(
+      {'init_time_chunk_size': 1},
+      {'init_time_chunk_size': 2},
+  )
+  def test_time_series_pipeline(self, init_time_chunk_size):
+    predictions_path = self.create_tempdir('predictions.zarr').full_path
+    targets_path = self.create_tempdir('targets.zarr').full_path
+    results_path = self.create_tempdir('results.zarr').full_path
+
+    predictions = test_utils.mock_prediction_data(
+        time_start='2020-01-01T00',
+        time_stop='2020-01-03T12',
+        lead_start='0 days',
+        lead_stop='1 day',
+        random=True,
+    )
+    targets = test_utils.mock_target_data(
+        time_start='2020-01-01T00',
+        time_stop='2020-01-05T00',
+        random=True,
+    )
+    predictions.to_zarr(predictions_path)
+    targets.to_zarr(targets_path)
+
+    init_times = predictions.time.values
+    lead_times = predictions.prediction_timedelta.values
+    times = time_chunks.TimeChunks(
+        init_times,
+        lead_times,
+        init_time_chunk_size=init_time_chunk_size,
+        lead_time_chunk_size=1,
+    )
+    target_loader = xarray_loaders.TargetsFromXarray(path=targets_path)
+    prediction_loader = xarray_loaders.PredictionsFromXarray(
+        path=predictions_path
+    )
+    all_metrics = {'rmse': deterministic.RMSE(), 'mse': deterministic.MSE()}
+    aggregation_method = aggregation.Aggregator(
+        reduce_dims=['latitude', 'longitude']
+    )
+
+    statistics = metrics_base.compute_unique_statistics_for_all_metrics(
+        all_metrics,
+        prediction_loader.load_chunk(init_times, lead_times),
+        target_loader.load_chunk(init_times, lead_times),
+    )
+    direct_results = aggregation_method.aggregate_statistics(
+        statistics
+    ).metric_values(all_metrics)
+
+    with test_pipeline.TestPipeline() as root:
+      beam_pipeline.define_time_series_pipeline(
+          root,
+          times,
+          prediction_loader,
+          target_loader,
+          all_metrics,
+          aggregation_method,
+          out_path=results_path,
+      )
+    pipeline_results = xr.open_zarr(results_path)
+    self.assertEqual(
+        pipeline_results.chunks['init_time'][0], init_time_chunk_size
+    )
+    pipeline_results = pipeline_results.compute()
+    xr.testing.assert_allclose(
+        direct_results, pipeline_results.transpose(*direct_results.dims)
+    )
+
+    with self.assertRaisesRegex(ValueError, 'does not reduce over init_time'):
+      beam_pipeline.define_time_series_pipeline(
+          test_pipeline.TestPipeline(),
+          times,
+          prediction_loader,
+          target_loader,
+          all_metrics,
+          aggregation.Aggregator(reduce_dims=['init_time']),
+          out_path=results_path,
+      )
+
+    # Blocks of different sizes don't match the chunks of the Zarr store.
+    costs = np.ones(len(init_times))
+    costs[0] = len(init_times)
+    uneven_times = time_chunks.CostBalancedTimeChunks(
+        init_times, lead_times, costs=costs, num_init_time_chunks=2
+    )
+    with self.assertRaisesRegex(ValueError, 'chunks of equal size'):
+      beam_pipeline.define_time_series_pipeline(
+          test_pipeline.TestPipeline(),
+          uneven_times,
+          prediction_loader,
+          target_loader,
+          all_metrics,
+          aggregation_method,
+          out_path=results_path,
+      )
+
+  def test_time_series_variables_without_init_time(self):
+    results_path = self.create_tempdir('results.zarr').full_path
+    init_times = np.arange(4).astype('datetime64[D]').astype('datetime64[ns]')
+
+    def block_metrics(block_index):
+      return xr.Dataset(
+          {
+              'rmse': (
+                  ('init_time', 'lead_time'),
+                  np.full((2, 3), float(block_index)),
+              ),
+              'weight': ('lead_time', np.array([1.0, 2.0, 3.0])),
+          },
+          coords={
+              'init_time': init_times[2 * block_index : 2 * block_index + 2],
+              'lead_time': np.arange(3),
+              'lead_name': ('lead_time', ['a', 'b', 'c']),
+          },
+      )
+
+    beam_pipeline.WriteTimeSeriesTemplate(results_path, init_times, 2).process(
+        block_metrics(1)
+    )
+    for block_index in range(2):
+      beam_pipeline.WriteTimeSeriesBlock(results_path, [0, 2]).process(
+          (block_index, block_metrics(block_index)), []
+      )
+    expected = xr.concat(
+        [block_metrics(0), block_metrics(1)],
+        dim='init_time',
+        data_vars='minimal',
+        coords='minimal',
+    )
+    xr.testing.assert_identical(
+        xr.open_zarr(results_path).compute(), expected
+    )
+
+  def test_reports_beam_metrics(self):
+    predictions_path = self.create_tempdir('predictions.zarr').full_path
+    targets_path = self.create_tempdir('targets.zarr').full_path
+    predictions = test_utils.mock_prediction_data(
+        time_start='2020-01-01T00',
+        time_stop='2020-01-03T00',
+        lead_start='0 days',
+        lead_stop='1 day',
+    )
+    test_utils.mock_target_data(
+        time_start='2020-01-01T00',
+        time_stop='2020-01-05T00',
+    ).to_zarr(targets_path)
+    predictions.to_zarr(predictions_path)
+    times = time_chunks.TimeChunks(
+        predictions.time.values,
+        predictions.prediction_timedelta.values,
+        init_time_chunk_size=1,
+        lead_time_chunk_size=1,
+    )
+
+    root = test_pipeline.TestPipeline()
+    beam_pipeline.define_pipeline(
+        root,
+        times,
+        xarray_loaders.PredictionsFromXarray(path=predictions_path),
+        xarray_loaders.TargetsFromXarray(path=targets_path),
+        {'rmse': deterministic.RMSE()},
+        aggregation.Aggregator(reduce_dims=['init_time']),
+        out_path=self.create_tempfile('results.nc').full_path,
+        max_chunks_per_aggregation_stage=2,
+    )
+    result = root.run()
+    result.wait_until_finish()
+    query_result = result.metrics().query(
+        beam.metrics.MetricsFilter().with_namespace(
+            beam_utils.METRICS_NAMESPACE
+        )
+    )
+    counters = {
+        c.key.metric.name: c.committed for c in query_result['counters']
+    }
+    distributions = collections.defaultdict(int)
+    for d in query_result['distributions']:
+      distributions[d.key.metric.name] += d.committed.count
+    self.assertEqual(counters['chunks_computed'], len(times))
+    for name in [
+        'targets_load_msec',
+        'targets_load/compute_msec',
+        'targets_load/bytes',
+        'predictions_load_msec',
+        'statistics_msec',
+        'aggregation_msec',
+        'aggregation_state_bytes',
+    ]:
+      self.assertEqual(distributions[name], len(times), msg=name)
+    self.assertGreaterEqual(
+        distributions['sum_aggregation_states_msec'], len(times)
+    )
+
+  def test_multi_model_pipeline(self):
+    targets_path = self.create_tempdir('targets.zarr').full_path
+    targets = test_utils.mock_target_data(
+        time_start='2020-01-01T00',
+        time_stop='2020-01-05T00',
+        random=True,
+    )
+    targets.to_zarr(targets_path)
+    target_loader = xarray_loaders.TargetsFromXarray(path=targets_path)
+
+    prediction_loaders = {}
+    results_paths = {}
+    for model_name in ['model_a', 'model_b']:
+      predictions_path = self.create_tempdir(f'{model_name}.zarr').full_path
+      test_utils.mock_prediction_data(
+          time_start='2020-01-01T00',
+          time_stop='2020-01-03T00',
+          lead_start='0 days',
+          lead_stop='1 day',
+          random=True,
+      ).to_zarr(predictions_path)
+      prediction_loaders[model_name] = xarray_loaders.PredictionsFromXarray(
+          path=predictions_path
+      )
+      results_paths[model_name] = self.create_tempfile(
+          f'{model_name}.nc'
+      ).full_path
+    predictions = xr.open_zarr(predictions_path)
+    init_times = predictions.time.values
+    lead_times = predictions.prediction_timedelta.values
+    times = time_chunks.TimeChunks(
+        init_times, lead_times, init_time_chunk_size=1, lead_time_chunk_size=1
+    )
+    all_metrics = {'rmse': deterministic.RMSE(), 'mse': deterministic.MSE()}
+    aggregation_method = aggregation.Aggregator(reduce_dims=['init_time'])
+
+    with test_pipeline.TestPipeline() as root:
+      beam_pipeline.define_multi_model_pipeline(
+          root,
+          times,
+          prediction_loaders,
+          target_loader,
+          all_metrics,
+          aggregation_method,
+          out_paths=results_paths,
+          max_chunks_per_aggregation_stage=2,
+      )
+
+    for model_name, prediction_loader in prediction_loaders.items():
+      statistics = metrics_base.compute_unique_statistics_for_all_metrics(
+          all_metrics,
+          prediction_loader.load_chunk(init_times, lead_times),
+          target_loader.load_chunk(init_times, lead_times),
+      )
+      direct_results = aggregation_method.aggregate_statistics(
+          statistics
+      ).metric_values(all_metrics)
+      pipeline_results = xr.open_dataset(results_paths[model_name]).compute()
+      xr.testing.assert_allclose(direct_results, pipeline_results, rtol=1e-3)
+
+    with self.assertRaisesRegex(ValueError, 'differ'):
+      beam_pipeline.define_multi_model_pipeline(
+          test_pipeline.TestPipeline(),
+          times,
+          prediction_loaders,
+          target_loader,
+          all_metrics,
+          aggregation_method,
+          out_paths={'model_a': results_paths['model_a']},
+      )
 
 if __name__ == '__main__':
   absltest.main()
@@ -13,35 +13,225 @@
 # limitations under the License.
 r"""Beam-specific utils for beam pipelines."""
 
-import math
-from typing import Sequence, Tuple, TypeVar
+import logging
+import time
+from typing import Any, Iterable, Mapping, Optional, Tuple, TypeVar
 
 import apache_beam as beam
 from weatherbenchX import aggregation
 
 
+class AggregationStateCoder(beam.coders.Coder):
+  """Compact binary Beam coder for AggregationStates.
+
+  States are encoded as PackedAggregationStates using
+  `PackedAggregationState.to_bytes`, which stores coordinates once and the sums
+  as raw buffers, rather than pickling nested xarray objects. Decoded states
+  are therefore always PackedAggregationStates (or zero states), which behave
+  like any other AggregationState.
+  """
+
+  _ZERO = b'\x00'
+  _PACKED = b'\x01'
+
+  def __init__(
+      self, compression: Optional[str] = None, compression_level: int = 1
+  ):
+    """Init.
+
+    Args:
+      compression: None or 'zlib', see `PackedAggregationState.to_bytes`.
+      compression_level: Compression level, if compression is used.
+    """
+    self.compression = compression
+    self.compression_level = compression_level
+
+  def encode(self, value: aggregation.AggregationState) -> bytes:
+    if value.is_zero():
+      return self._ZERO
+    return self._PACKED + value.pack().to_bytes(
+        self.compression, self.compression_level
+    )
+
+  def decode(self, encoded: bytes) -> aggregation.AggregationState:
+    if encoded[:1] == self._ZERO:
+      return aggregation.AggregationState.zero()
+    return aggregation.PackedAggregationState.from_bytes(
+        memoryview(encoded)[1:]
+    )
+
+  def is_deterministic(self) -> bool:
+    return False
+
+  def to_type_hint(self) -> Any:
+    return aggregation.AggregationState
+
+
+class ZlibAggregationStateCoder(AggregationStateCoder):
+  """AggregationStateCoder with (lossless) zlib compression."""
+
+  def __init__(self, compression_level: int = 1):
+    super().__init__(compression='zlib', compression_level=compression_level)
+
+  def to_type_hint(self) -> Any:
+    return ZlibAggregationState
+
+
+class ZlibAggregationState(aggregation.AggregationState):
+  """Type hint of AggregationStates encoded with ZlibAggregationStateCoder.
+
+  Never instantiated. Beam picks the coder of a PCollection by its type hint,
+  so declaring e.g. `.with_output_types(Tuple[int, ZlibAggregationState])`
+  compresses the states of that PCollection, without changing the coder of
+  AggregationStates in other pipelines of the process.
+  """
+
+
+class AggregationStateAccumulatorCoder(beam.coders.Coder):
+  """Coder for AggregationStateAccumulators, via their summed state."""
+
+  def __init__(self, state_coder: beam.coders.Coder):
+    """Init.
+
+    Args:
+      state_coder: Coder for the summed AggregationState.
+    """
+    self.state_coder = state_coder
+
+  def encode(self, value: aggregation.AggregationStateAccumulator) -> bytes:
+    return self.state_coder.encode(value.result())
+
+  def decode(self, encoded: bytes) -> aggregation.AggregationStateAccumulator:
+    return aggregation.AggregationStateAccumulator(
+        self.state_coder.decode(encoded)
+    )
+
+  def is_deterministic(self) -> bool:
+    return False
+
+  def to_type_hint(self) -> Any:
+    return aggregation.AggregationStateAccumulator
+
+
+def aggregation_state_type(compression: Optional[str] = None) -> Any:
+  """Type hint of AggregationStates, selecting their coder.
+
+  Args:
+    compression: (Optional) Lossless compression of the encoded states, None
+      or 'zlib'.
+
+  Returns:
+    aggregation.AggregationState, encoded with AggregationStateCoder, or
+    ZlibAggregationState, encoded with ZlibAggregationStateCoder.
+  """
+  if compression is None:
+    return aggregation.AggregationState
+  elif compression == 'zlib':
+    return ZlibAggregationState
+  else:
+    raise ValueError(f'Unknown aggregation state compression {compression}')
+
+
+# Registered once, for all pipelines. Pipelines select a coder per PCollection
+# with the type hints of aggregation_state_type.
+for _state_type in (
+    aggregation.AggregationState,
+    aggregation.PackedAggregationState,
+):
+  beam.coders.registry.register_coder(_state_type, AggregationStateCoder)
+beam.coders.registry.register_coder(
+    ZlibAggregationState, ZlibAggregationStateCoder
+)
+
+
+METRICS_NAMESPACE = 'weatherbenchX'
+
+
+def report_measurements(samples: Mapping[str, Iterable[float]]) -> None:
+  """Reports measurements from a profiling.Profile as Beam distributions.
+
+  Durations, named '<stage>_seconds', are reported in milliseconds as
+  '<stage>_msec', since Beam distributions only hold integers. Must be called
+  from the thread running the DoFn, since Beam drops metrics from other threads.
+
+  Args:
+    samples: Measurements by name.
+  """
+  for name, values in samples.items():
+    scale = 1
+    if name.endswith('_seconds'):
+      name = name.removesuffix('_seconds') + '_msec'
+      scale = 1000
+    distribution = beam.metrics.Metrics.distribution(METRICS_NAMESPACE, name)
+    for value in values:
+      distribution.update(int(round(value * scale)))
+
+
 class SumAggregationStates(beam.transforms.CombineFn):
-  """An object to sum all AggregationState."""
+  """An object to sum all AggregationState.
+
+  Packed states are added in place into the buffers of the accumulator, see
+  aggregation.AggregationStateAccumulator, so memory use doesn't grow with the
+  number of elements. Input states are never modified.
+
+  The time spent summing and the sizes of the summed states are reported as Beam
+  distributions, per combine stage.
+  """
+
+  def __init__(self, state_type: Any = aggregation.AggregationState):
+    """Init.
 
-  def create_accumulator(self) -> aggregation.AggregationState:
-    return aggregation.AggregationState.zero()
+    Args:
+      state_type: Type hint of the states, see aggregation_state_type, whose
+        coder is used for accumulators. Default: aggregation.AggregationState.
+    """
+    super().__init__()
+    self._state_type = state_type
+
+  def _add(
+      self,
+      accumulator: aggregation.AggregationStateAccumulator,
+      aggregation_state: aggregation.AggregationState,
+  ) -> None:
+    start = time.perf_counter()
+    accumulator.add(aggregation_state)
+    report_measurements({
+        'sum_aggregation_states_seconds': [time.perf_counter() - start],
+        'summed_aggregation_state_bytes': [aggregation_state.nbytes],
+    })
+
+  def create_accumulator(self) -> aggregation.AggregationStateAccumulator:
+    return aggregation.AggregationStateAccumulator()
 
   def add_input(
       self,
-      accumulator: aggregation.AggregationState,
+      accumulator: aggregation.AggregationStateAccumulator,
       new_element: aggregation.AggregationState,
-  ) -> aggregation.AggregationState:
-    return accumulator + new_element
+  ) -> aggregation.AggregationStateAccumulator:
+    self._add(accumulator, new_element)
+    return accumulator
 
   def merge_accumulators(
-      self, accumulators: Sequence[aggregation.AggregationState]
-  ) -> aggregation.AggregationState:
-    return sum(accumulators, aggregation.AggregationState.zero())
+      self, accumulators: Iterable[aggregation.AggregationStateAccumulator]
+  ) -> aggregation.AggregationStateAccumulator:
+    # Beam allows modifying the first accumulator.
+    accumulators = iter(accumulators)
+    merged = next(accumulators, None)
+    if merged is None:
+      return self.create_accumulator()
+    for accumulator in accumulators:
+      self._add(merged, accumulator.result())
+    return merged
 
   def extract_output(
-      self, accumulator: aggregation.AggregationState
+      self, accumulator: aggregation.AggregationStateAccumulator
   ) -> aggregation.AggregationState:
-    return accumulator
+    return accumulator.result()
+
+  def get_accumulator_coder(self) -> beam.coders.Coder:
+    return AggregationStateAccumulatorCoder(
+        beam.coders.registry.get_coder(self._state_type)
+    )
 
 
 Element = TypeVar("Element")
@@ -74,6 +264,7 @@ class CombineMultiStage(beam.PTransform):
       total_num_elements: int,
       max_bin_size: int,
       combine_fn: beam.transforms.CombineFn,
+      element_type: Optional[Any] = None,
   ):
     """Inits the object.
 
@@ -85,24 +276,27 @@ class CombineMultiStage(beam.PTransform):
       max_bin_size: Maximum number of elements that will be aggregated in each
         bin at any given stage.
       combine_fn: `beam.transforms.CombineFn` used tocombine data.
+      element_type: (Optional) Type of the elements, used as type hint so that
+        Beam picks the registered coder for them between stages.
     """
     super().__init__()
 
-    if max_bin_size < 2:
-      raise ValueError("The maximum bin size must be at least 2.")
-
     # We will divide the aggregation into multiple stages, such that at any
     # stage, no accumulator has to accumulate more than `max_group_size`
     # elements.
-    num_current_elements = total_num_elements
-    num_bins_per_stage = []
-    while num_current_elements > max_bin_size:
-      num_bins = math.ceil(num_current_elements / max_bin_size)
-      num_bins_per_stage.append(num_bins)
-      num_current_elements = num_bins
-    num_bins_per_stage.append(1)
-    self._num_bins_per_stage = num_bins_per_stage
+    self._num_bins_per_stage = aggregation.num_bins_per_aggregation_stage(
+        total_num_elements, max_bin_size
+    )
+    logging.info(
+        'CombineMultiStage plan: %d elements in %d stages of %s bins, with at'
+        ' most %d elements per bin.',
+        total_num_elements,
+        len(self._num_bins_per_stage),
+        self._num_bins_per_stage,
+        max_bin_size,
+    )
     self._combine_fn = combine_fn
+    self._element_type = element_type
 
   def _aggregation_stage(
       self, pcoll: beam.pvalue.PCollection, num_bins: int
@@ -113,10 +307,15 @@ class CombineMultiStage(beam.PTransform):
       output_key = input_key % num_bins
       return output_key, element
 
+    add_key = beam.Map(_bin_key)
+    combine = beam.CombinePerKey(self._combine_fn)
+    if self._element_type is not None:
+      add_key = add_key.with_output_types(Tuple[int, self._element_type])
+      combine = combine.with_output_types(Tuple[int, self._element_type])
     return (
         pcoll
-        | f"AddKeyForBins{num_bins}" >> beam.Map(_bin_key)
-        | f"SumForBins{num_bins}" >> beam.CombinePerKey(self._combine_fn)
+        | f"AddKeyForBins{num_bins}" >> add_key
+        | f"SumForBins{num_bins}" >> combine
     )
 
   def expand(self, pcoll: beam.pvalue.PCollection) -> beam.pvalue.PCollection:
@@ -128,9 +327,14 @@ class CombineMultiStage(beam.PTransform):
       assert key == 0  # All keys should be the same at this point.
       return element
 
+    remove_redundant_key = beam.Map(remove_key)
+    if self._element_type is not None:
+      remove_redundant_key = remove_redundant_key.with_output_types(
+          self._element_type
+      )
     return (
         pcoll
         # Using beam.Values() seems to fail, because it does not do type
         # inference correctly, and uses the wrong encoder for the next stage.
-        | "RemoveRedundantKey" >> beam.Map(remove_key)
+        | "RemoveRedundantKey" >> remove_redundant_key
     )
@@ -0,0 +1,156 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pickle
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+from weatherbenchX import aggregation
+from weatherbenchX import beam_utils
+from weatherbenchX import test_utils
+from weatherbenchX.metrics import base as metrics_base
+from weatherbenchX.metrics import deterministic
+import xarray as xr
+
+
+def _get_aggregation_state(reduce_dims):
+  target = test_utils.mock_target_data(random=True)
+  prediction = test_utils.mock_prediction_data(random=True)
+  target = target.sel(time=prediction.time)
+  prediction = prediction.isel(prediction_timedelta=0)
+  statistics = metrics_base.compute_unique_statistics_for_all_metrics(
+      {'rmse': deterministic.RMSE(), 'mae': deterministic.MAE()},
+      prediction,
+      target,
+  )
+  # Include a Dataset statistic and non-index coordinates.
+  statistics['Dataset'] = xr.Dataset(statistics['SquaredError']).assign_coords(
+      forecast_hour=('time', np.arange(prediction.sizes['time']) * 12)
+  )
+  aggregator = aggregation.Aggregator(reduce_dims=reduce_dims)
+  return aggregator.aggregate_statistics(statistics)
+
+
+class _AggregationStateTestCase(parameterized.TestCase):
+
+  def assert_states_identical(self, actual, expected):
+    self.assertEqual(actual.is_zero(), expected.is_zero())
+    if expected.is_zero():
+      return
+    for tree in ('sum_weighted_statistics', 'sum_weights'):
+      actual_tree = getattr(actual, tree)
+      expected_tree = getattr(expected, tree)
+      self.assertCountEqual(actual_tree.keys(), expected_tree.keys())
+      for stat in expected_tree:
+        self.assertIsInstance(actual_tree[stat], type(expected_tree[stat]))
+        for var in expected_tree[stat]:
+          xr.testing.assert_identical(
+              actual_tree[stat][var], expected_tree[stat][var]
+          )
+
+
+class AggregationStateCoderTest(_AggregationStateTestCase):
+
+  @parameterized.parameters(
+      {'coder': beam_utils.AggregationStateCoder()},
+      {'coder': beam_utils.ZlibAggregationStateCoder()},
+      {'coder': beam_utils.ZlibAggregationStateCoder(compression_level=9)},
+  )
+  def test_round_trip(self, coder):
+    aggregation_state = _get_aggregation_state(['latitude', 'longitude'])
+    for state in (
+        aggregation_state,
+        aggregation_state.pack(),
+        aggregation.AggregationState.zero(),
+    ):
+      decoded = coder.decode(coder.encode(state))
+      self.assert_states_identical(decoded, state)
+
+  def test_decoded_states_share_layout(self):
+    coder = beam_utils.AggregationStateCoder()
+    packed = _get_aggregation_state(['latitude', 'longitude']).pack()
+    decoded1 = coder.decode(coder.encode(packed))
+    decoded2 = coder.decode(coder.encode(packed))
+    self.assertIs(decoded1.layout, decoded2.layout)
+    summed = decoded1 + decoded2
+    self.assertIsInstance(summed, aggregation.PackedAggregationState)
+    self.assert_states_identical(summed, packed + packed)
+
+  def test_smaller_than_pickle(self):
+    aggregation_state = _get_aggregation_state(['latitude'])
+    encoded = beam_utils.AggregationStateCoder().encode(aggregation_state)
+    self.assertLess(len(encoded), len(pickle.dumps(aggregation_state)))
+
+  def test_registered_coder(self):
+    registry = beam_utils.beam.coders.registry
+    coder = registry.get_coder(beam_utils.aggregation_state_type())
+    self.assertIsInstance(coder, beam_utils.AggregationStateCoder)
+    self.assertIsNone(coder.compression)
+    coder = registry.get_coder(beam_utils.aggregation_state_type('zlib'))
+    self.assertIsInstance(coder, beam_utils.ZlibAggregationStateCoder)
+    # Selecting a compression doesn't change the coder of AggregationStates.
+    coder = registry.get_coder(aggregation.AggregationState)
+    self.assertIsNone(coder.compression)
+    with self.assertRaisesRegex(ValueError, 'Unknown'):
+      beam_utils.aggregation_state_type('gzip')
+
+
+class SumAggregationStatesTest(_AggregationStateTestCase):
+
+  def test_sum_in_place(self):
+    packed = _get_aggregation_state(['latitude', 'longitude']).pack()
+    packed_values = packed.buffers['<f8'].copy()
+    states = [packed, aggregation.AggregationState.zero(), packed, packed]
+    combine_fn = beam_utils.SumAggregationStates()
+
+    accumulators = []
+    for i in range(2):
+      accumulator = combine_fn.create_accumulator()
+      for state in states[2 * i : 2 * i + 2]:
+        accumulator = combine_fn.add_input(accumulator, state)
+      accumulators.append(accumulator)
+    buffer = accumulators[0].result().buffers['<f8']
+    merged = combine_fn.merge_accumulators(iter(accumulators))
+    result = combine_fn.extract_output(merged)
+
+    self.assertIs(result.buffers['<f8'], buffer)
+    self.assert_states_identical(
+        result, aggregation.AggregationState.sum(states)
+    )
+    # Inputs are not modified.
+    np.testing.assert_array_equal(packed.buffers['<f8'], packed_values)
+    self.assertTrue(
+        combine_fn.extract_output(combine_fn.merge_accumulators([])).is_zero()
+    )
+
+  def test_accumulator_coder(self):
+    combine_fn = beam_utils.SumAggregationStates()
+    coder = combine_fn.get_accumulator_coder()
+    packed = _get_aggregation_state(['latitude']).pack()
+    accumulator = combine_fn.add_input(combine_fn.create_accumulator(), packed)
+    decoded = coder.decode(coder.encode(accumulator))
+    self.assert_states_identical(decoded.result(), packed)
+    # Decoded buffers can be added to in place.
+    decoded.add(packed)
+    self.assert_states_identical(decoded.result(), packed + packed)
+    self.assertTrue(
+        coder.decode(coder.encode(combine_fn.create_accumulator()))
+        .result()
+        .is_zero()
+    )
+
+
+if __name__ == '__main__':
+  absltest.main()
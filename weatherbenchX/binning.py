@@ -14,11 +14,26 @@
 """Binning class definitions."""
 
 import abc
-from typing import Any, Hashable, Mapping, Optional, Sequence, Tuple, Union
+from typing import Any, Hashable, Mapping, NamedTuple, Optional, Sequence, Tuple, Union
 import numpy as np
+import pandas as pd
 import xarray as xr
 
 
+class BinIndices(NamedTuple):
+  """Integer bin indices for mutually exclusive bins.
+
+  Attributes:
+    indices: Integer DataArray that broadcasts against the statistic, with the
+      position along `bins` of the bin each element belongs to, or -1 if it
+      doesn't belong to any bin.
+    bins: 1D DataArray along the bin dimension with the bin coordinates.
+  """
+
+  indices: xr.DataArray
+  bins: xr.DataArray
+
+
 class Binning(abc.ABC):
   """Binning base class."""
 
@@ -38,7 +53,8 @@ class Binning(abc.ABC):
     """Creates a bin mask for a statistic.
 
     It is assumed that all information required to compute bins is included in
-    the statistics element.
+    the coordinates of the statistics element. Masks may be reused for other
+    statistics with the same coordinates.
 
     Args:
       statistic: Individual DataArray with statistic values.
@@ -48,6 +64,26 @@ class Binning(abc.ABC):
         DataArray.
     """
 
+  def create_bin_indices(
+      self,
+      statistic: xr.DataArray,
+  ) -> Optional[BinIndices]:
+    """Optionally returns integer bin indices instead of a bin mask.
+
+    Binnings whose bins are mutually exclusive can implement this, which allows
+    aggregation with a segmented sum rather than a contraction with a dense
+    [n_bins, ...] mask, so that cost no longer grows with the number of bins.
+    The result must be equivalent to create_bin_mask.
+
+    Args:
+      statistic: Individual DataArray with statistic values.
+
+    Returns:
+      BinIndices, or None if not supported (default).
+    """
+    del statistic
+    return None
+
 
 def _region_to_mask(
     lat: xr.DataArray,
@@ -165,6 +201,36 @@ def vectorized_coord_mask(
   return masks
 
 
+def vectorized_coord_indices(
+    coord: xr.DataArray,
+    bin_dim_name: str,
+) -> BinIndices:
+  """Helper to create bin indices for unique coordinate values.
+
+  Equivalent to vectorized_coord_mask without a global bin.
+
+  Args:
+    coord: Coordinate to bin by.
+    bin_dim_name: Name of binning dimension.
+
+  Returns:
+    BinIndices with one bin per unique coordinate value.
+  """
+  unique_coord, inverse = np.unique(coord.values, return_inverse=True)
+  inverse = inverse.reshape(coord.shape)
+  # NaN/NaT never compare equal, so they don't belong to any bin in the mask.
+  inverse = np.where(pd.isnull(coord.values), -1, inverse)
+  indices = xr.DataArray(
+      inverse,
+      coords={dim: coord[dim] for dim in coord.dims},
+      dims=coord.dims,
+  )
+  bins = xr.DataArray(
+      unique_coord, coords={bin_dim_name: unique_coord}, dims=[bin_dim_name]
+  )
+  return BinIndices(indices, bins)
+
+
 class ByExactCoord(Binning):
   """Binning by unique coordinate values.
 
@@ -199,6 +265,18 @@ class ByExactCoord(Binning):
     )
     return masks
 
+  def create_bin_indices(
+      self,
+      statistic: xr.DataArray,
+  ) -> Optional[BinIndices]:
+    if self.add_global_bin:
+      # The global bin overlaps with all other bins.
+      return None
+    assert (
+        self.coord not in statistic.dims
+    ), 'For dimensions, specify reduce_dims in aggregation.'
+    return vectorized_coord_indices(statistic[self.coord], self.coord)
+
 
 class ByTimeUnit(Binning):
   """Bin by time unit for given axis.
@@ -235,10 +313,7 @@ class ByTimeUnit(Binning):
     self.time_dim = time_dim
     self.add_global_bin = add_global_bin
 
-  def create_bin_mask(
-      self,
-      statistic: xr.DataArray,
-  ) -> xr.DataArray:
+  def _time_unit_coord(self, statistic: xr.DataArray) -> xr.DataArray:
     dt = statistic[self.time_dim].dt
     if isinstance(dt, xr.core.accessor_dt.TimedeltaAccessor):
       coord = statistic[self.time_dim].dt.total_seconds()
@@ -257,14 +332,31 @@ class ByTimeUnit(Binning):
     else:
       assert isinstance(dt, xr.core.accessor_dt.DatetimeAccessor)
       coord = getattr(statistic[self.time_dim].dt, self.unit)
+    return coord
+
+  def create_bin_mask(
+      self,
+      statistic: xr.DataArray,
+  ) -> xr.DataArray:
     masks = vectorized_coord_mask(
-        coord,
+        self._time_unit_coord(statistic),
         self.time_dim,
         f'{self.time_dim}_{self.unit}',
         self.add_global_bin,
     )
     return masks
 
+  def create_bin_indices(
+      self,
+      statistic: xr.DataArray,
+  ) -> Optional[BinIndices]:
+    if self.add_global_bin:
+      # The global bin overlaps with all other bins.
+      return None
+    return vectorized_coord_indices(
+        self._time_unit_coord(statistic), f'{self.time_dim}_{self.unit}'
+    )
+
 
 class ByTimeUnitFromSeconds(Binning):
   """Similar to ByTimeUnit, but with the coordinate in seconds as a scalar.
@@ -319,6 +411,34 @@ class ByTimeUnitFromSeconds(Binning):
     masks = masks.assign_coords({bin_dim_name: bins})
     return masks
 
+  def create_bin_indices(
+      self,
+      statistic: xr.DataArray,
+  ) -> Optional[BinIndices]:
+    if self.unit not in ('second', 'minute', 'hour'):
+      raise ValueError(f'Unsupported unit: {self.unit}')
+    coord = statistic[self.time_dim]
+    if self.unit == 'minute':
+      coord = coord // (60)
+    elif self.unit == 'hour':
+      coord = coord // (60 * 60)
+    bins = self.bins
+    if bins is None:
+      bins = np.arange(0, 24) if self.unit == 'hour' else np.arange(0, 60)
+    bins = pd.Index(bins)
+    if not bins.is_unique:
+      return None
+    bin_dim_name = f'{self.time_dim}_{self.unit}'
+    indices = bins.get_indexer(coord.values.ravel()).reshape(coord.shape)
+    return BinIndices(
+        coord.copy(data=indices).drop_vars(self.time_dim, errors='ignore'),
+        xr.DataArray(
+            bins.values,
+            coords={bin_dim_name: bins.values},
+            dims=[bin_dim_name],
+        ),
+    )
+
 
 class ByCoordBins(Binning):
   """Binning by specified bins over a coordinate."""
@@ -373,6 +493,31 @@ class ByCoordBins(Binning):
     else:
       return xr.concat(masks, self.dim_name)
 
+  def create_bin_indices(
+      self,
+      statistic: xr.DataArray,
+  ) -> Optional[BinIndices]:
+    bin_edges = np.asarray(self.bin_edges)
+    if len(bin_edges) < 2 or np.any(bin_edges[1:] <= bin_edges[:-1]):
+      # Bins are only mutually exclusive for increasing edges.
+      return None
+    coord = statistic.coords[self.dim_name]
+    values = coord.values
+    if values.dtype.kind in 'mM':
+      bin_edges = bin_edges.astype(values.dtype)
+    # Bin i contains values in [bin_edges[i], bin_edges[i + 1]). Values outside
+    # of all bins, including NaN/NaT which sort last, get index -1.
+    indices = np.searchsorted(bin_edges, values, side='right') - 1
+    num_bins = len(bin_edges) - 1
+    indices = np.where((indices >= 0) & (indices < num_bins), indices, -1)
+    starts = np.asarray(self.bin_edges)[:-1]
+    return BinIndices(
+        coord.copy(data=indices).drop_vars(self.dim_name),
+        xr.DataArray(
+            starts, coords={self.dim_name: starts}, dims=[self.dim_name]
+        ),
+    )
+
 
 class BySets(Binning):
   """Bin by sets of values along a coordinate.
@@ -95,6 +95,56 @@ class BinningTest(parameterized.TestCase):
     mask = bins.create_bin_mask(statistic.isel(index=[]))
     self.assertEqual(mask.size, 0)
 
+    # Overlapping global bin can't be represented with bin indices.
+    self.assertIsNone(bins.create_bin_indices(statistic))
+
+  @parameterized.named_parameters(
+      dict(
+          testcase_name='by_exact_coord',
+          bins=binning.ByExactCoord(coord='stationName'),
+      ),
+      dict(
+          testcase_name='by_time_unit',
+          bins=binning.ByTimeUnit('hour', 'lead_time'),
+      ),
+      dict(
+          testcase_name='by_coord_bins',
+          bins=binning.ByCoordBins(
+              'lead_time', np.arange(1, 5, dtype='timedelta64[h]')
+          ),
+      ),
+  )
+  def test_bin_indices_match_bin_mask(self, bins):
+    target_path = resources.files('weatherbenchX').joinpath(
+        'test_data/metar-timeNominal-by-month'
+    )
+    target_loader = sparse_parquet.METARFromParquet(
+        path=target_path,
+        variables=['2m_temperature'],
+        partitioned_by='month',
+        split_variables=True,
+        dropna=True,
+        time_dim='timeObs',
+        file_tolerance=np.timedelta64(1, 'h'),
+    )
+    init_times = np.array(
+        ['2020-01-02T00', '2020-01-02T12'], dtype='datetime64[ns]'
+    )
+    lead_times = slice(np.timedelta64(1, 'h'), np.timedelta64(6, 'h'))
+    statistic = target_loader.load_chunk(init_times, lead_times)[
+        '2m_temperature'
+    ]
+
+    mask = bins.create_bin_mask(statistic)
+    indices, bin_coords = bins.create_bin_indices(statistic)
+    np.testing.assert_array_equal(
+        mask[bins.bin_dim_name].values, bin_coords.values
+    )
+    for i in range(bin_coords.size):
+      np.testing.assert_array_equal(
+          mask.isel({bins.bin_dim_name: i}).values, (indices == i).values
+      )
+
   def test_by_time_unit_binning_with_with_datetime64(self):
     statistic_values = test_utils.mock_prediction_data(
         time_start='2020-01-01T00',
@@ -0,0 +1,194 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Memoization utilities for results that only depend on coordinates.
+
+Weights and bin masks only depend on the coordinates of a statistic, which
+typically don't change between chunks of an evaluation (e.g. the latitude and
+longitude grid). These utilities allow such results to be reused across
+statistics, variables and chunks.
+"""
+
+import collections
+import hashlib
+import threading
+from typing import Any, Callable, Collection, Hashable, NamedTuple
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+
+def coordinates_fingerprint(
+    data_array: xr.DataArray,
+    exclude: Collection[Hashable] = ('mask',),
+) -> Hashable:
+  """Cheap hashable fingerprint of the dims and coordinates of a DataArray.
+
+  Args:
+    data_array: DataArray to compute the fingerprint for.
+    exclude: Names of coordinates to ignore. Default: ('mask',), since the mask
+      is applied separately during aggregation.
+
+  Returns:
+    Hashable fingerprint, equal for DataArrays with the same dims, shape and
+    coordinate values.
+  """
+  fingerprint = [tuple(data_array.dims), data_array.shape]
+  for name in sorted(data_array.coords, key=str):
+    if name in exclude:
+      continue
+    values = data_array.coords[name].values
+    if values.dtype == object:
+      # Hash the values rather than the object pointers.
+      data = pd.util.hash_array(values.ravel()).tobytes()
+    else:
+      data = np.ascontiguousarray(values).tobytes()
+    fingerprint.append((
+        name,
+        data_array.coords[name].dims,
+        values.dtype.str,
+        hashlib.blake2b(data, digest_size=16).digest(),
+    ))
+  return tuple(fingerprint)
+
+
+class CacheInfo(NamedTuple):
+  hits: int
+  misses: int
+  maxsize: int
+  currsize: int
+
+
+class LRUCache:
+  """Bounded least-recently-used cache with hit/miss counters.
+
+  The cache is emptied when pickled, so that e.g. Beam workers don't receive
+  arrays cached while constructing the pipeline.
+  """
+
+  def __init__(self, maxsize: int):
+    """Init.
+
+    Args:
+      maxsize: Maximum number of entries. Zero disables caching.
+    """
+    if maxsize < 0:
+      raise ValueError(f'{maxsize=} but should be non-negative.')
+    self.maxsize = maxsize
+    self.hits = 0
+    self.misses = 0
+    self._data = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def get_or_compute(self, key: Hashable, compute_fn: Callable[[], Any]) -> Any:
+    """Returns the cached value for key, computing and storing it if missing."""
+    with self._lock:
+      if key in self._data:
+        self.hits += 1
+        self._data.move_to_end(key)
+        return self._data[key]
+      self.misses += 1
+    value = compute_fn()
+    if self.maxsize:
+      with self._lock:
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+          self._data.popitem(last=False)
+    return value
+
+  def cache_info(self) -> CacheInfo:
+    return CacheInfo(self.hits, self.misses, self.maxsize, len(self._data))
+
+  def clear(self):
+    with self._lock:
+      self._data.clear()
+      self.hits = 0
+      self.misses = 0
+
+  def __len__(self) -> int:
+    return len(self._data)
+
+  def __reduce__(self):
+    return (type(self), (self.maxsize,))
+
+
+class BytesLRUCache:
+  """Least-recently-used cache bounded by the total size of its values.
+
+  Unlike LRUCache, values are stored and looked up explicitly, so that several
+  missing values can be computed at once. Like LRUCache, it's emptied when
+  pickled.
+  """
+
+  def __init__(self, max_bytes: int):
+    """Init.
+
+    Args:
+      max_bytes: Maximum total size of the cached values. Values larger than
+        that aren't cached.
+    """
+    if max_bytes < 0:
+      raise ValueError(f'{max_bytes=} but should be non-negative.')
+    self.max_bytes = max_bytes
+    self.hits = 0
+    self.misses = 0
+    self._nbytes = 0
+    self._data = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key: Hashable) -> Any:
+    """Returns the cached value for key, or None if it's not cached."""
+    with self._lock:
+      if key not in self._data:
+        self.misses += 1
+        return None
+      self.hits += 1
+      self._data.move_to_end(key)
+      return self._data[key][0]
+
+  def put(self, key: Hashable, value: Any, nbytes: int) -> None:
+    """Caches value of size nbytes, evicting least recently used values."""
+    if nbytes > self.max_bytes:
+      return
+    with self._lock:
+      if key in self._data:
+        self._nbytes -= self._data.pop(key)[1]
+      self._data[key] = (value, nbytes)
+      self._nbytes += nbytes
+      while self._nbytes > self.max_bytes:
+        _, (_, evicted_nbytes) = self._data.popitem(last=False)
+        self._nbytes -= evicted_nbytes
+
+  @property
+  def nbytes(self) -> int:
+    """Total size of the cached values."""
+    return self._nbytes
+
+  def cache_info(self) -> CacheInfo:
+    """Hits, misses, and maxsize and currsize in bytes."""
+    return CacheInfo(self.hits, self.misses, self.max_bytes, self._nbytes)
+
+  def clear(self):
+    with self._lock:
+      self._data.clear()
+      self._nbytes = 0
+      self.hits = 0
+      self.misses = 0
+
+  def __len__(self) -> int:
+    return len(self._data)
+
+  def __reduce__(self):
+    return (type(self), (self.max_bytes,))
@@ -0,0 +1,111 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pickle
+from absl.testing import absltest
+import numpy as np
+from weatherbenchX import caching
+from weatherbenchX import test_utils
+import xarray as xr
+
+
+class CachingTest(absltest.TestCase):
+
+  def test_coordinates_fingerprint(self):
+    data = test_utils.mock_target_data(
+        time_start='2020-01-01', time_stop='2020-01-03'
+    )
+    fingerprint = caching.coordinates_fingerprint(data['2m_temperature'])
+    # Same coordinates, different values and mask.
+    other = (data['2m_temperature'] + 1).assign_coords(
+        mask=data['2m_temperature'] > 0
+    )
+    self.assertEqual(fingerprint, caching.coordinates_fingerprint(other))
+    # Different coordinate values.
+    shifted = data['2m_temperature'].assign_coords(
+        longitude=data.longitude + 1
+    )
+    self.assertNotEqual(fingerprint, caching.coordinates_fingerprint(shifted))
+    # Different dims.
+    self.assertNotEqual(
+        fingerprint, caching.coordinates_fingerprint(data['geopotential'])
+    )
+
+  def test_coordinates_fingerprint_with_object_coords(self):
+    da = xr.DataArray(
+        np.zeros(3),
+        dims=['index'],
+        coords={'stationName': ('index', np.array(['a', 'b', 'c'], object))},
+    )
+    same = da.assign_coords(
+        stationName=('index', np.array(['a', 'b', 'c'], object))
+    )
+    different = da.assign_coords(
+        stationName=('index', np.array(['a', 'b', 'd'], object))
+    )
+    self.assertEqual(
+        caching.coordinates_fingerprint(da),
+        caching.coordinates_fingerprint(same),
+    )
+    self.assertNotEqual(
+        caching.coordinates_fingerprint(da),
+        caching.coordinates_fingerprint(different),
+    )
+
+  def test_lru_cache(self):
+    cache = caching.LRUCache(maxsize=2)
+    self.assertEqual(cache.get_or_compute('a', lambda: 1), 1)
+    self.assertEqual(cache.get_or_compute('a', lambda: 2), 1)
+    cache.get_or_compute('b', lambda: 3)
+    cache.get_or_compute('c', lambda: 4)  # Evicts 'a'.
+    self.assertEqual(cache.get_or_compute('a', lambda: 5), 5)
+    self.assertEqual(
+        cache.cache_info(),
+        caching.CacheInfo(hits=1, misses=4, maxsize=2, currsize=2),
+    )
+
+    # Pickling empties the cache.
+    unpickled = pickle.loads(pickle.dumps(cache))
+    self.assertLen(unpickled, 0)
+    self.assertEqual(unpickled.maxsize, 2)
+
+  def test_disabled_lru_cache(self):
+    cache = caching.LRUCache(maxsize=0)
+    cache.get_or_compute('a', lambda: 1)
+    self.assertEqual(cache.get_or_compute('a', lambda: 2), 2)
+    self.assertLen(cache, 0)
+
+  def test_bytes_lru_cache(self):
+    cache = caching.BytesLRUCache(max_bytes=10)
+    cache.put('a', 1, 4)
+    cache.put('b', 2, 4)
+    self.assertEqual(cache.get('a'), 1)
+    cache.put('c', 3, 4)  # Evicts 'b', the least recently used.
+    self.assertIsNone(cache.get('b'))
+    cache.put('d', 4, 11)  # Larger than the cache.
+    self.assertIsNone(cache.get('d'))
+    cache.put('a', 5, 2)
+    self.assertEqual(cache.get('a'), 5)
+    self.assertEqual(
+        cache.cache_info(),
+        caching.CacheInfo(hits=2, misses=2, maxsize=10, currsize=6),
+    )
+
+    unpickled = pickle.loads(pickle.dumps(cache))
+    self.assertLen(unpickled, 0)
+    self.assertEqual(unpickled.max_bytes, 10)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,433 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Persistence of AggregationStates for resumable and incremental evaluations.
+
+Each chunk's AggregationState can be stored in a directory (local or any fsspec
+path), keyed by the chunk index and a fingerprint of the evaluation config. A
+rerun of the same evaluation then skips the chunks which are already stored and
+only sums the stored states.
+
+For incremental evaluations, the total AggregationState is stored next to the
+metrics. A later run over new init times then adds its state to the stored one,
+instead of recomputing all init times.
+"""
+
+import functools
+import hashlib
+import json
+import posixpath
+import re
+import struct
+import threading
+import types
+from typing import Any, Iterable, Mapping, NamedTuple, Optional, Tuple, Union
+import uuid
+
+import fsspec
+import numpy as np
+import pandas as pd
+from weatherbenchX import aggregation
+from weatherbenchX import caching
+from weatherbenchX.data_loaders import base as data_loaders_base
+from weatherbenchX.metrics import base as metrics_base
+import xarray as xr
+
+
+_CHUNK_FILE_PATTERN = re.compile(r'^chunk-(\d+)\.wbx$')
+
+# Magic bytes and length of the JSON header of incremental states, followed by
+# the header and the serialized PackedAggregationState.
+_INCREMENTAL_PREFIX = struct.Struct('<6sQ')
+_INCREMENTAL_MAGIC = b'WBXINC'
+
+# Caches and synchronization don't affect results, and their state differs
+# between processes, so they are only fingerprinted by type.
+_STATEFUL_TYPES = (
+    caching.LRUCache,
+    caching.BytesLRUCache,
+    type(threading.Lock()),
+    type(threading.RLock()),
+    threading.Condition,
+    threading.Event,
+    threading.Semaphore,
+)
+
+
+def _hash_array(values: np.ndarray) -> str:
+  values = np.asarray(values)
+  if values.dtype == object:
+    data = pd.util.hash_array(values.ravel()).tobytes()
+  else:
+    data = np.ascontiguousarray(values).tobytes()
+  return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _normalize_xarray(obj: Union[xr.Dataset, xr.DataArray], seen) -> Any:
+  """Structure of an xarray object, without loading its data."""
+  if isinstance(obj, xr.DataArray):
+    obj = obj.to_dataset(name='__data__')
+  variables = []
+  for name, var in sorted(obj.variables.items(), key=lambda x: str(x[0])):
+    variables.append((
+        str(name),
+        var.dims,
+        var.dtype.str,
+        var.shape,
+        _normalize(dict(var.attrs), seen),
+        str(var.encoding.get('source', '')),
+        # Index values are always in memory, but other data may be lazy.
+        _hash_array(obj.indexes[name].values) if name in obj.indexes else None,
+    ))
+  return ('xarray', variables, _normalize(dict(obj.attrs), seen))
+
+
+def _normalize(obj: Any, seen: frozenset[int] = frozenset()) -> Any:
+  """Converts an object into a structure with a deterministic repr."""
+  if obj is None or isinstance(obj, (bool, int, float, complex, str, bytes)):
+    return obj
+  if isinstance(obj, np.generic):
+    return repr(obj)
+  if isinstance(obj, np.ndarray):
+    return ('ndarray', obj.dtype.str, obj.shape, _hash_array(obj))
+  if isinstance(obj, pd.Index):
+    return ('Index', _normalize(np.asarray(obj), seen))
+  if isinstance(obj, (xr.Dataset, xr.DataArray)):
+    return _normalize_xarray(obj, seen)
+  if isinstance(obj, slice):
+    return ('slice', _normalize((obj.start, obj.stop, obj.step), seen))
+  if isinstance(obj, _STATEFUL_TYPES):
+    return type(obj).__qualname__
+
+  if id(obj) in seen:
+    return ('cycle', type(obj).__qualname__)
+  seen = seen | {id(obj)}
+
+  if isinstance(obj, Mapping):
+    items = [(_normalize(k, seen), _normalize(v, seen)) for k, v in obj.items()]
+    return ('mapping', sorted(items, key=repr))
+  if isinstance(obj, (list, tuple)):
+    return (type(obj).__name__, [_normalize(x, seen) for x in obj])
+  if isinstance(obj, (set, frozenset)):
+    return ('set', sorted((_normalize(x, seen) for x in obj), key=repr))
+  if isinstance(obj, functools.partial):
+    return (
+        'partial',
+        _normalize(obj.func, seen),
+        _normalize(obj.args, seen),
+        _normalize(obj.keywords, seen),
+    )
+  if isinstance(obj, types.FunctionType):
+    # Include the code, to distinguish e.g. different lambdas.
+    return (
+        'function',
+        obj.__module__,
+        obj.__qualname__,
+        _normalize(obj.__code__, seen),
+        _normalize(obj.__defaults__, seen),
+    )
+  if isinstance(obj, types.CodeType):
+    # Not the repr of constants, which includes addresses of nested code, e.g.
+    # of lambdas and comprehensions.
+    return (
+        'code',
+        _hash_array(np.frombuffer(obj.co_code, np.uint8)),
+        obj.co_names,
+        _normalize(obj.co_consts, seen),
+    )
+  if hasattr(obj, '__wrapped__') and callable(obj):
+    # E.g. functools.lru_cache, whose cache is fingerprinted by type only.
+    return ('wrapped', _normalize(obj.__wrapped__, seen))
+  if isinstance(obj, (type, types.BuiltinFunctionType, types.MethodType)):
+    return ('callable', getattr(obj, '__module__', ''), obj.__qualname__)
+  if hasattr(obj, '__dict__'):
+    return (
+        f'{type(obj).__module__}.{type(obj).__qualname__}',
+        _normalize(vars(obj), seen),
+    )
+  return repr(obj)
+
+
+def config_fingerprint(*objects: Any) -> str:
+  """Deterministic fingerprint of an evaluation config.
+
+  Unlike pickle, this is stable across processes. Xarray objects are only
+  fingerprinted by their structure, coordinates and source, not by their data,
+  so that lazily opened datasets aren't loaded.
+
+  Args:
+    *objects: Objects to fingerprint, e.g. data loaders, metrics, aggregator
+      and time chunks.
+
+  Returns:
+    Hex string fingerprint.
+  """
+  return hashlib.sha256(repr(_normalize(objects)).encode()).hexdigest()[:16]
+
+
+def _write_atomically(
+    fs: fsspec.AbstractFileSystem, path: str, data: bytes
+) -> None:
+  """Writes to a temporary file first, to never leave partial files behind."""
+  directory = posixpath.dirname(path)
+  tmp_path = posixpath.join(directory, f'.tmp-{uuid.uuid4().hex}')
+  fs.makedirs(directory, exist_ok=True)
+  fs.pipe_file(tmp_path, data)
+  fs.mv(tmp_path, path)
+
+
+class ChunkCheckpoints:
+  """Stores AggregationStates of individual chunks of an evaluation.
+
+  States are stored as `<directory>/<key>/chunk-<chunk_index>.wbx`, serialized
+  with PackedAggregationState.to_bytes. Files are written to a temporary path
+  and then moved into place, so that a preempted write never leaves a partial
+  checkpoint behind.
+  """
+
+  def __init__(self, directory: str, key: str):
+    """Init.
+
+    Args:
+      directory: Local or fsspec directory to store checkpoints in.
+      key: Key of the evaluation, e.g. a config fingerprint. Checkpoints of
+        different keys are stored in separate subdirectories.
+    """
+    self.directory = directory
+    self.key = key
+
+  @classmethod
+  def for_evaluation(
+      cls,
+      directory: str,
+      times: Iterable[Tuple[np.ndarray, Union[np.ndarray, slice]]],
+      predictions_loader: data_loaders_base.DataLoader,
+      targets_loader: data_loaders_base.DataLoader,
+      metrics: Mapping[str, metrics_base.Metric],
+      aggregator: aggregation.Aggregator,
+      checkpoint_key: Optional[str] = None,
+  ) -> 'ChunkCheckpoints':
+    """Checkpoints keyed by a fingerprint of the evaluation config.
+
+    Args:
+      directory: Local or fsspec directory to store checkpoints in.
+      times: TimeChunks instance.
+      predictions_loader: DataLoader instance.
+      targets_loader: DataLoader instance.
+      metrics: A dictionary of metrics to compute.
+      aggregator: Aggregation instance.
+      checkpoint_key: (Optional) Key to use instead of the config fingerprint,
+        e.g. if the fingerprint isn't stable or the data changed in place.
+
+    Returns:
+      ChunkCheckpoints instance.
+    """
+    if checkpoint_key is None:
+      checkpoint_key = config_fingerprint(
+          list(times), predictions_loader, targets_loader, metrics, aggregator
+      )
+    return cls(directory, checkpoint_key)
+
+  @property
+  def _fs_and_root(self) -> Tuple[fsspec.AbstractFileSystem, str]:
+    fs, directory = fsspec.core.url_to_fs(self.directory)
+    return fs, posixpath.join(directory, self.key)
+
+  def _path(self, chunk_index: int) -> str:
+    _, root = self._fs_and_root
+    return posixpath.join(root, f'chunk-{chunk_index:08d}.wbx')
+
+  def completed_chunks(self) -> frozenset[int]:
+    """Indices of all stored chunks."""
+    fs, root = self._fs_and_root
+    if not fs.exists(root):
+      return frozenset()
+    completed = set()
+    for path in fs.ls(root, detail=False):
+      match = _CHUNK_FILE_PATTERN.match(posixpath.basename(path))
+      if match:
+        completed.add(int(match.group(1)))
+    return frozenset(completed)
+
+  def exists(self, chunk_index: int) -> bool:
+    fs, _ = self._fs_and_root
+    return fs.exists(self._path(chunk_index))
+
+  def save(
+      self, chunk_index: int, aggregation_state: aggregation.AggregationState
+  ) -> None:
+    """Stores the (non-zero) AggregationState of a chunk."""
+    fs, _ = self._fs_and_root
+    _write_atomically(
+        fs, self._path(chunk_index), aggregation_state.pack().to_bytes()
+    )
+
+  def load(self, chunk_index: int) -> aggregation.PackedAggregationState:
+    """Loads the stored AggregationState of a chunk."""
+    fs, _ = self._fs_and_root
+    return aggregation.PackedAggregationState.from_bytes(
+        fs.cat_file(self._path(chunk_index))
+    )
+
+
+def incremental_state_path(out_path: str) -> str:
+  """Path of the incremental AggregationState stored with the metrics."""
+  return out_path + '.aggregation_state'
+
+
+def incremental_config_key(
+    metrics: Mapping[str, metrics_base.Metric],
+    aggregator: aggregation.Aggregator,
+) -> str:
+  """Fingerprint of the parts of the config which states must agree on.
+
+  Data loaders are not included, since their datasets change as new init times
+  are added.
+
+  Args:
+    metrics: A dictionary of metrics to compute.
+    aggregator: Aggregation instance.
+
+  Returns:
+    Hex string fingerprint.
+  """
+  return config_fingerprint(metrics, aggregator)
+
+
+def init_times_of_chunks(
+    times: Iterable[Tuple[np.ndarray, Union[np.ndarray, slice]]],
+) -> np.ndarray:
+  """Sorted unique init times of all time chunks."""
+  init_times = [np.atleast_1d(init_times) for init_times, _ in times]
+  if not init_times:
+    return np.array([], dtype='datetime64[ns]')
+  return np.unique(np.concatenate(init_times).astype('datetime64[ns]'))
+
+
+class IncrementalAggregationState(NamedTuple):
+  """Total AggregationState of an incremental evaluation.
+
+  Attributes:
+    aggregation_state: Sum of the states of all runs so far.
+    config_key: incremental_config_key of the metrics and aggregator.
+    init_times: Sorted init times which are included in the state.
+  """
+
+  aggregation_state: aggregation.AggregationState
+  config_key: str
+  init_times: np.ndarray
+
+  def check_can_add(self, config_key: str, init_times: np.ndarray) -> None:
+    """Raises a ValueError if a state can't be added to this one.
+
+    Args:
+      config_key: incremental_config_key of the new state.
+      init_times: Init times of the new state.
+    """
+    if config_key != self.config_key:
+      raise ValueError(
+          'Metrics or aggregator differ from the stored incremental state'
+          f' ({config_key} != {self.config_key}).'
+      )
+    overlap = np.intersect1d(init_times, self.init_times)
+    if overlap.size:
+      raise ValueError(
+          f'{overlap.size} init times are already included in the stored'
+          f' incremental state, e.g. {overlap[0]}.'
+      )
+
+  def add(
+      self,
+      aggregation_state: aggregation.AggregationState,
+      init_times: np.ndarray,
+  ) -> 'IncrementalAggregationState':
+    """Returns the sum with the state of new init times."""
+    self.check_can_add(self.config_key, init_times)
+    return IncrementalAggregationState(
+        aggregation_state=self.aggregation_state + aggregation_state,
+        config_key=self.config_key,
+        init_times=np.union1d(self.init_times, init_times),
+    )
+
+  def to_bytes(self) -> bytes:
+    header = json.dumps({
+        'config_key': self.config_key,
+        'init_times': self.init_times.astype('datetime64[ns]')
+        .astype(np.int64)
+        .tolist(),
+    }).encode()
+    return b''.join([
+        _INCREMENTAL_PREFIX.pack(_INCREMENTAL_MAGIC, len(header)),
+        header,
+        self.aggregation_state.pack().to_bytes(),
+    ])
+
+  @classmethod
+  def from_bytes(cls, data: bytes) -> 'IncrementalAggregationState':
+    magic, header_size = _INCREMENTAL_PREFIX.unpack_from(data)
+    if magic != _INCREMENTAL_MAGIC:
+      raise ValueError('Not a serialized IncrementalAggregationState.')
+    offset = _INCREMENTAL_PREFIX.size
+    header = json.loads(data[offset : offset + header_size])
+    return cls(
+        aggregation_state=aggregation.PackedAggregationState.from_bytes(
+            data[offset + header_size :]
+        ),
+        config_key=header['config_key'],
+        init_times=np.array(header['init_times'], dtype=np.int64).astype(
+            'datetime64[ns]'
+        ),
+    )
+
+  @classmethod
+  def load_for_update(
+      cls,
+      path: str,
+      metrics: Mapping[str, metrics_base.Metric],
+      aggregator: aggregation.Aggregator,
+      init_times: np.ndarray,
+  ) -> 'IncrementalAggregationState':
+    """Loads the stored state and checks that `init_times` can be added.
+
+    Args:
+      path: Local or fsspec path of the stored state.
+      metrics: A dictionary of metrics to compute.
+      aggregator: Aggregation instance.
+      init_times: Init times of the new state.
+
+    Returns:
+      The stored state, or a zero state if nothing is stored yet.
+    """
+    config_key = incremental_config_key(metrics, aggregator)
+    state = cls.load(path)
+    if state is None:
+      state = cls(
+          aggregation_state=aggregation.AggregationState.zero(),
+          config_key=config_key,
+          init_times=np.array([], dtype='datetime64[ns]'),
+      )
+    state.check_can_add(config_key, init_times)
+    return state
+
+  def save(self, path: str) -> None:
+    """Writes the state to a local or fsspec path."""
+    fs, path = fsspec.core.url_to_fs(path)
+    _write_atomically(fs, path, self.to_bytes())
+
+  @classmethod
+  def load(cls, path: str) -> Optional['IncrementalAggregationState']:
+    """Reads the state from a local or fsspec path, None if it's missing."""
+    fs, path = fsspec.core.url_to_fs(path)
+    if not fs.exists(path):
+      return None
+    return cls.from_bytes(fs.cat_file(path))
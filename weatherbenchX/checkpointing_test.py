@@ -0,0 +1,454 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from concurrent import futures
+import multiprocessing
+import os
+
+from absl.testing import absltest
+from absl.testing import parameterized
+from apache_beam.testing import test_pipeline
+import numpy as np
+from weatherbenchX import aggregation
+from weatherbenchX import beam_pipeline
+from weatherbenchX import checkpointing
+from weatherbenchX import local_pipeline
+from weatherbenchX import test_utils
+from weatherbenchX import time_chunks
+from weatherbenchX.data_loaders import base as data_loaders_base
+from weatherbenchX.data_loaders import xarray_loaders
+from weatherbenchX.metrics import base as metrics_base
+from weatherbenchX.metrics import deterministic
+from weatherbenchX.metrics import wrappers
+import xarray as xr
+
+
+class _FailingLoader(data_loaders_base.DataLoader):
+
+  def _load_chunk_from_source(self, init_times, lead_times=None):
+    raise ValueError('Chunk should have been loaded from checkpoints.')
+
+
+def _clip_negative(da: xr.DataArray) -> xr.DataArray:
+  # Nested code, whose repr differs between processes.
+  return xr.apply_ufunc(lambda x: np.maximum(x, 0), da)
+
+
+def _evaluation_config(predictions_path, targets_path, init_times, lead_times):
+  times = time_chunks.TimeChunks(
+      init_times, lead_times, init_time_chunk_size=1, lead_time_chunk_size=1
+  )
+  predictions_loader = xarray_loaders.PredictionsFromXarray(
+      path=predictions_path
+  )
+  targets_loader = xarray_loaders.TargetsFromXarray(
+      path=targets_path, cache_max_bytes=2**20
+  )
+  metrics = {
+      'clipped_rmse': wrappers.WrappedMetric(
+          deterministic.RMSE(),
+          [wrappers.Inline('both', _clip_negative, 'clip')],
+      )
+  }
+  aggregator = aggregation.Aggregator(reduce_dims=['init_time'])
+  return times, predictions_loader, targets_loader, metrics, aggregator
+
+
+def _keys(times, predictions_loader, targets_loader, metrics, aggregator):
+  checkpoints = checkpointing.ChunkCheckpoints.for_evaluation(
+      'unused', times, predictions_loader, targets_loader, metrics, aggregator
+  )
+  return checkpoints.key, checkpointing.incremental_config_key(
+      metrics, aggregator
+  )
+
+
+def _config_keys(*config_args):
+  return _keys(*_evaluation_config(*config_args))
+
+
+def _run_incremental(results_path, *config_args):
+  local_pipeline.run_pipeline(
+      *_evaluation_config(*config_args), out_path=results_path, incremental=True
+  )
+
+
+def _run_in_subprocess(fn, *args):
+  with futures.ProcessPoolExecutor(
+      max_workers=1, mp_context=multiprocessing.get_context('spawn')
+  ) as executor:
+    return executor.submit(fn, *args).result()
+
+
+class ChunkCheckpointsTest(parameterized.TestCase):
+
+  def test_save_and_load(self):
+    predictions = test_utils.mock_prediction_data(random=True).rename(
+        {'time': 'init_time', 'prediction_timedelta': 'lead_time'}
+    )
+    targets = test_utils.mock_prediction_data(random=True).rename(
+        {'time': 'init_time', 'prediction_timedelta': 'lead_time'}
+    )
+    metrics = {'rmse': deterministic.RMSE()}
+    statistics = metrics_base.compute_unique_statistics_for_all_metrics(
+        metrics, predictions, targets
+    )
+    aggregation_state = aggregation.Aggregator(
+        reduce_dims=['init_time']
+    ).aggregate_statistics(statistics)
+
+    checkpoints = checkpointing.ChunkCheckpoints(
+        self.create_tempdir().full_path, 'key'
+    )
+    self.assertEmpty(checkpoints.completed_chunks())
+    self.assertFalse(checkpoints.exists(3))
+    checkpoints.save(3, aggregation_state)
+    checkpoints.save(12, aggregation_state.pack())
+
+    self.assertEqual(checkpoints.completed_chunks(), {3, 12})
+    self.assertTrue(checkpoints.exists(3))
+    for chunk_index in (3, 12):
+      xr.testing.assert_identical(
+          checkpoints.load(chunk_index).metric_values(metrics),
+          aggregation_state.metric_values(metrics),
+      )
+    # No temporary files are left behind.
+    self.assertLen(
+        os.listdir(os.path.join(checkpoints.directory, checkpoints.key)), 2
+    )
+
+  def test_config_fingerprint(self):
+    def fingerprint(metric, reduce_dims, init_times):
+      return checkpointing.config_fingerprint(
+          {'metric': metric},
+          aggregation.Aggregator(reduce_dims=reduce_dims),
+          time_chunks.TimeChunks(
+              init_times, np.array([0, 6], dtype='timedelta64[h]'), 1
+          ),
+          xr.Dataset(coords={'init_time': init_times}),
+      )
+
+    init_times = np.array(
+        ['2020-01-01T00', '2020-01-02T00'], dtype='datetime64[ns]'
+    )
+    reference = fingerprint(deterministic.RMSE(), ['init_time'], init_times)
+    self.assertLen(reference, 16)
+    self.assertEqual(
+        fingerprint(deterministic.RMSE(), ['init_time'], init_times.copy()),
+        reference,
+    )
+    self.assertNotEqual(
+        fingerprint(deterministic.MAE(), ['init_time'], init_times), reference
+    )
+    self.assertNotEqual(
+        fingerprint(deterministic.RMSE(), ['latitude'], init_times), reference
+    )
+    self.assertNotEqual(
+        fingerprint(deterministic.RMSE(), ['init_time'], init_times[:1]),
+        reference,
+    )
+
+  def test_incremental_aggregation_state(self):
+    predictions = test_utils.mock_prediction_data(random=True).rename(
+        {'time': 'init_time', 'prediction_timedelta': 'lead_time'}
+    )
+    targets = test_utils.mock_prediction_data(random=True).rename(
+        {'time': 'init_time', 'prediction_timedelta': 'lead_time'}
+    )
+    metrics = {'rmse': deterministic.RMSE()}
+    aggregator = aggregation.Aggregator(reduce_dims=['init_time'])
+    statistics = metrics_base.compute_unique_statistics_for_all_metrics(
+        metrics, predictions, targets
+    )
+    aggregation_state = aggregator.aggregate_statistics(statistics)
+    init_times = predictions.init_time.values
+
+    path = os.path.join(self.create_tempdir().full_path, 'results.nc')
+    state_path = checkpointing.incremental_state_path(path)
+    self.assertIsNone(
+        checkpointing.IncrementalAggregationState.load(state_path)
+    )
+    state = checkpointing.IncrementalAggregationState.load_for_update(
+        state_path, metrics, aggregator, init_times[:2]
+    )
+    self.assertTrue(state.aggregation_state.is_zero())
+    state = state.add(aggregation_state, init_times[:2])
+    state.save(state_path)
+
+    loaded = checkpointing.IncrementalAggregationState.load_for_update(
+        state_path, metrics, aggregator, init_times[2:]
+    )
+    self.assertEqual(loaded.config_key, state.config_key)
+    np.testing.assert_array_equal(loaded.init_times, init_times[:2])
+    xr.testing.assert_identical(
+        loaded.aggregation_state.metric_values(metrics),
+        aggregation_state.metric_values(metrics),
+    )
+
+    with self.assertRaisesRegex(ValueError, 'already included'):
+      checkpointing.IncrementalAggregationState.load_for_update(
+          state_path, metrics, aggregator, init_times[1:]
+      )
+    with self.assertRaisesRegex(ValueError, 'Metrics or aggregator differ'):
+      checkpointing.IncrementalAggregationState.load_for_update(
+          state_path, {'mae': deterministic.MAE()}, aggregator, init_times[2:]
+      )
+
+
+class CheckpointedPipelineTest(parameterized.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    predictions_path = self.create_tempdir('predictions.zarr').full_path
+    targets_path = self.create_tempdir('targets.zarr').full_path
+    predictions = test_utils.mock_prediction_data(
+        time_start='2020-01-01T00',
+        time_stop='2020-01-03T00',
+        lead_start='0 days',
+        lead_stop='1 day',
+    )
+    targets = test_utils.mock_target_data(
+        time_start='2020-01-01T00', time_stop='2020-01-05T00'
+    )
+    predictions.to_zarr(predictions_path)
+    targets.to_zarr(targets_path)
+
+    self.config_args = (
+        predictions_path,
+        targets_path,
+        predictions.time.values,
+        predictions.prediction_timedelta.values,
+    )
+    self.init_times = predictions.time.values
+    self.lead_times = predictions.prediction_timedelta.values
+    self.times = time_chunks.TimeChunks(
+        self.init_times,
+        self.lead_times,
+        init_time_chunk_size=1,
+        lead_time_chunk_size=1,
+    )
+    self.targets_loader = xarray_loaders.TargetsFromXarray(path=targets_path)
+    self.predictions_loader = xarray_loaders.PredictionsFromXarray(
+        path=predictions_path
+    )
+    self.metrics = {'rmse': deterministic.RMSE(), 'mse': deterministic.MSE()}
+    self.aggregator = aggregation.Aggregator(reduce_dims=['init_time'])
+
+  def _run_local(self, checkpoint_dir, targets_loader=None, **kwargs):
+    return local_pipeline.run_pipeline(
+        self.times,
+        self.predictions_loader,
+        targets_loader or self.targets_loader,
+        self.metrics,
+        self.aggregator,
+        max_chunks_per_aggregation_stage=2,
+        checkpoint_dir=checkpoint_dir,
+        **kwargs,
+    )
+
+  @parameterized.parameters(
+      {'num_workers': None},
+      {'num_workers': 2},
+  )
+  def test_local_pipeline_resumes_from_checkpoints(self, num_workers):
+    checkpoint_dir = self.create_tempdir().full_path
+    expected = self._run_local(None)
+    results = self._run_local(checkpoint_dir, num_workers=num_workers)
+    xr.testing.assert_identical(expected, results)
+
+    [key] = os.listdir(checkpoint_dir)
+    self.assertEqual(
+        checkpointing.ChunkCheckpoints(checkpoint_dir, key).completed_chunks(),
+        set(range(len(self.times))),
+    )
+    # The same config results in the same key.
+    self.assertEqual(
+        checkpointing.ChunkCheckpoints.for_evaluation(
+            checkpoint_dir,
+            self.times,
+            self.predictions_loader,
+            self.targets_loader,
+            self.metrics,
+            self.aggregator,
+        ).key,
+        key,
+    )
+
+    # All chunks are loaded from the checkpoints.
+    results = self._run_local(
+        checkpoint_dir,
+        targets_loader=_FailingLoader(),
+        checkpoint_key=key,
+        num_workers=num_workers,
+    )
+    xr.testing.assert_identical(expected, results)
+
+    # Only missing chunks are recomputed.
+    for chunk_index in (0, 3):
+      os.remove(
+          os.path.join(checkpoint_dir, key, f'chunk-{chunk_index:08d}.wbx')
+      )
+    results = self._run_local(checkpoint_dir, num_workers=num_workers)
+    xr.testing.assert_identical(expected, results)
+    self.assertLen(
+        os.listdir(os.path.join(checkpoint_dir, key)), len(self.times)
+    )
+
+  def test_beam_pipeline_resumes_from_checkpoints(self):
+    checkpoint_dir = self.create_tempdir().full_path
+    expected = self._run_local(None)
+
+    def run_beam(targets_loader):
+      results_path = self.create_tempfile().full_path
+      with test_pipeline.TestPipeline() as root:
+        beam_pipeline.define_pipeline(
+            root,
+            self.times,
+            self.predictions_loader,
+            targets_loader,
+            self.metrics,
+            self.aggregator,
+            out_path=results_path,
+            max_chunks_per_aggregation_stage=2,
+            checkpoint_dir=checkpoint_dir,
+            checkpoint_key='beam',
+        )
+      return xr.open_dataset(results_path).compute()
+
+    xr.testing.assert_identical(expected, run_beam(self.targets_loader))
+    os.remove(os.path.join(checkpoint_dir, 'beam', 'chunk-00000002.wbx'))
+    xr.testing.assert_identical(expected, run_beam(self.targets_loader))
+    xr.testing.assert_identical(expected, run_beam(_FailingLoader()))
+    # Checkpoints written by Beam can be used by the local pipeline.
+    xr.testing.assert_identical(
+        expected,
+        self._run_local(
+            checkpoint_dir,
+            targets_loader=_FailingLoader(),
+            checkpoint_key='beam',
+        ),
+    )
+
+  def _time_chunks(self, init_times):
+    return time_chunks.TimeChunks(
+        init_times,
+        self.lead_times,
+        init_time_chunk_size=1,
+        lead_time_chunk_size=1,
+    )
+
+  def test_local_pipeline_incremental(self):
+    expected = self._run_local(None)
+    results_path = os.path.join(self.create_tempdir().full_path, 'results.nc')
+
+    def run_incremental(init_times):
+      return local_pipeline.run_pipeline(
+          self._time_chunks(init_times),
+          self.predictions_loader,
+          self.targets_loader,
+          self.metrics,
+          self.aggregator,
+          out_path=results_path,
+          incremental=True,
+      )
+
+    first = run_incremental(self.init_times[:1])
+    self.assertEqual(first.sizes, expected.sizes)
+    results = run_incremental(self.init_times[1:])
+    xr.testing.assert_allclose(expected, results)
+    xr.testing.assert_identical(
+        results, xr.open_dataset(results_path).compute()
+    )
+    with self.assertRaisesRegex(ValueError, 'already included'):
+      run_incremental(self.init_times[1:])
+    # The failed run left the stored metrics and state unchanged.
+    xr.testing.assert_identical(
+        results, xr.open_dataset(results_path).compute()
+    )
+
+  def test_config_keys_are_stable_across_processes(self):
+    config = _evaluation_config(*self.config_args)
+    times, _, targets_loader, _, _ = config
+    # Fills the cache of the loader, which must not change the keys.
+    for init_times, lead_times in times:
+      targets_loader.load_chunk(init_times, lead_times)
+    self.assertEqual(
+        _keys(*config),
+        _run_in_subprocess(_config_keys, *self.config_args),
+    )
+
+  def test_incremental_across_processes(self):
+    results_path = os.path.join(self.create_tempdir().full_path, 'results.nc')
+    (predictions_path, targets_path, init_times, lead_times) = self.config_args
+    _run_in_subprocess(
+        _run_incremental,
+        results_path,
+        predictions_path,
+        targets_path,
+        init_times[:1],
+        lead_times,
+    )
+    _run_incremental(
+        results_path, predictions_path, targets_path, init_times[1:], lead_times
+    )
+    expected = local_pipeline.run_pipeline(
+        *_evaluation_config(*self.config_args)
+    )
+    xr.testing.assert_allclose(
+        expected, xr.open_dataset(results_path).compute()
+    )
+
+  def test_beam_pipeline_incremental(self):
+    expected = self._run_local(None)
+    results_path = os.path.join(self.create_tempdir().full_path, 'results.nc')
+    with test_pipeline.TestPipeline() as root:
+      beam_pipeline.define_pipeline(
+          root,
+          self._time_chunks(self.init_times[:1]),
+          self.predictions_loader,
+          self.targets_loader,
+          self.metrics,
+          self.aggregator,
+          out_path=results_path,
+          incremental=True,
+      )
+    with test_pipeline.TestPipeline() as root:
+      beam_pipeline.define_pipeline(
+          root,
+          self._time_chunks(self.init_times[1:]),
+          self.predictions_loader,
+          self.targets_loader,
+          self.metrics,
+          self.aggregator,
+          out_path=results_path,
+          incremental=True,
+      )
+    xr.testing.assert_allclose(
+        expected, xr.open_dataset(results_path).compute()
+    )
+    with self.assertRaisesRegex(ValueError, 'already included'):
+      beam_pipeline.define_pipeline(
+          test_pipeline.TestPipeline(),
+          self._time_chunks(self.init_times),
+          self.predictions_loader,
+          self.targets_loader,
+          self.metrics,
+          self.aggregator,
+          out_path=results_path,
+          incremental=True,
+      )
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -17,6 +17,7 @@ import abc
 from typing import Collection, Hashable, Mapping, Optional, Union
 import numpy as np
 from weatherbenchX import interpolations
+from weatherbenchX import profiling
 from weatherbenchX import xarray_tree
 import xarray as xr
 
@@ -55,6 +56,55 @@ def add_nan_mask_to_data(
   return data
 
 
+def compute_chunk(
+    chunk: Mapping[Hashable, xr.DataArray],
+    max_concurrent_reads: Optional[int] = None,
+) -> Mapping[Hashable, xr.DataArray]:
+  """Loads all variables of a chunk into memory with a single dask compute.
+
+  Computing variables one by one only reads the storage chunks of one variable
+  at a time. Instead, the storage chunks of all variables are read and decoded
+  concurrently, on the threads of the dask scheduler.
+
+  Args:
+    chunk: Xarray Dataset or dictionary of DataArrays.
+    max_concurrent_reads: (Optional) Number of threads reading and decoding
+      storage chunks. Default: dask's default, the number of cores.
+
+  Returns:
+    The chunk with the same structure, as returned by computing each variable.
+  """
+  leaves = []
+  # In the order in which map_structure visits them, without merging them.
+  xarray_tree.map_structure(
+      leaves.append,
+      dict(chunk.data_vars) if isinstance(chunk, xr.Dataset) else chunk,
+  )
+  lazy = [
+      i
+      for i, leaf in enumerate(leaves)
+      if isinstance(leaf, xr.DataArray) and leaf.chunks is not None
+  ]
+  if lazy:
+    # Dims are renamed per variable, so that variables with differently sized
+    # dims of the same name can be computed as a single Dataset.
+    computed = xr.Dataset({
+        str(i): xr.Variable(
+            [f'{i}/{dim}' for dim in leaves[i].dims], leaves[i].data
+        )
+        for i in lazy
+    })
+    compute_kwargs = {}
+    if max_concurrent_reads is not None:
+      compute_kwargs['num_workers'] = max_concurrent_reads
+    computed = computed.compute(**compute_kwargs)
+    for i in lazy:
+      leaves[i] = leaves[i].copy(deep=False, data=computed[str(i)].data)
+  leaves = iter(leaves)
+  # Also computes coordinates, and non-dask lazy arrays.
+  return xarray_tree.map_structure(lambda _: next(leaves).compute(), chunk)
+
+
 class DataLoader(abc.ABC):
   """Base class for data loaders.
 
@@ -71,6 +121,7 @@ class DataLoader(abc.ABC):
       interpolation: Optional[interpolations.Interpolation] = None,
       compute: bool = True,
       add_nan_mask: bool = False,
+      max_concurrent_reads: Optional[int] = None,
   ):
     """Shared initialization for data loaders.
 
@@ -81,10 +132,27 @@ class DataLoader(abc.ABC):
         (variables will be split into DataArrays if they aren't already), with
         False indicating NaN values. To be used for masked aggregation. Default:
         False.
+      max_concurrent_reads: (Optional) Number of threads which read and decode
+        the storage chunks of all variables of a chunk concurrently, when
+        computing it, see compute_chunk. Default: dask's default.
     """
     self._interpolation = interpolation
     self._compute = compute
     self._add_nan_mask = add_nan_mask
+    self._max_concurrent_reads = max_concurrent_reads
+
+  @property
+  def requires_reference(self) -> bool:
+    """Whether load_chunk uses the reference, e.g. for interpolation.
+
+    If False, a chunk can be loaded before or concurrently with its reference.
+    Subclasses overriding load_chunk are assumed to require the reference,
+    unless they also override this property.
+    """
+    return (
+        self._interpolation is not None
+        or type(self).load_chunk is not DataLoader.load_chunk
+    )
 
   @abc.abstractmethod
   def _load_chunk_from_source(
@@ -116,16 +184,20 @@ class DataLoader(abc.ABC):
       data_chunk: Xarray Dataset or dictionary of DataArrays containing data for
       given times.
     """
-    chunk = self._load_chunk_from_source(init_times, lead_times)
+    with profiling.timer('source'):
+      chunk = self._load_chunk_from_source(init_times, lead_times)
 
     if self._interpolation is not None:
       # TODO(srasp): Potentially implement consistency check between lead_times
       # and lead_time coordinate on reference.
-      chunk = self._interpolation.interpolate(chunk, reference)
+      with profiling.timer('interpolation'):
+        chunk = self._interpolation.interpolate(chunk, reference)
 
     # Compute after interpolation avoids loading unnecessary data.
     if self._compute:
-      chunk = xarray_tree.map_structure(lambda x: x.compute(), chunk)
+      with profiling.timer('compute'):
+        chunk = compute_chunk(chunk, self._max_concurrent_reads)
+      profiling.record('bytes', sum(x.nbytes for x in chunk.values()))
 
     if self._add_nan_mask:
       chunk = add_nan_mask_to_data(chunk)
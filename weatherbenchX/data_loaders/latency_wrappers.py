@@ -15,6 +15,7 @@
 
 from typing import Hashable, Mapping, Optional, Union
 import numpy as np
+from weatherbenchX import logging_utils
 from weatherbenchX import xarray_tree
 from weatherbenchX.data_loaders import base
 from weatherbenchX.data_loaders import xarray_loaders
@@ -88,6 +89,7 @@ class ConstantLatencyWrapper(base.DataLoader):
         interpolation=data_loader._interpolation,
         compute=data_loader._compute,
         add_nan_mask=data_loader._add_nan_mask,
+        max_concurrent_reads=data_loader._max_concurrent_reads,
     )
 
   def get_available_init_time(self, init_time: np.datetime64) -> np.datetime64:
@@ -132,7 +134,7 @@ class ConstantLatencyWrapper(base.DataLoader):
           ' time %s, adjusted lead times %s',
           init_time,
           available_init_time,
-          adjusted_lead_times.astype('timedelta64[m]'),
+          logging_utils.Summary(adjusted_lead_times),
       )
       raw_chunk = self.data_loader._load_chunk_from_source(  # pystyle: disable=protected-access
           np.array([available_init_time]), adjusted_lead_times
@@ -217,6 +219,10 @@ class MultipleConstantLatencyWrapper(base.DataLoader):
     self._data_loaders = data_loaders
     self._concat_dim = concat_dim
 
+  @property
+  def requires_reference(self) -> bool:
+    return any(d.requires_reference for d in self._data_loaders)
+
   def _load_chunk_from_source(
       self,
       init_times: np.ndarray,
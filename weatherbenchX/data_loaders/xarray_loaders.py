@@ -15,7 +15,10 @@
 
 from typing import Any, Callable, Hashable, Iterable, Mapping, Optional, Union
 import numpy as np
+from weatherbenchX import caching
 from weatherbenchX import interpolations
+from weatherbenchX import profiling
+from weatherbenchX import shared_arrays
 from weatherbenchX.data_loaders import base
 import xarray as xr
 
@@ -50,6 +53,20 @@ def _rename_dataset(
   return ds
 
 
+def _build_index_engines(ds: xr.Dataset) -> None:
+  """Builds the lookup tables of the pandas indexes of a dataset.
+
+  Pandas builds them lazily on the first lookup, which isn't thread-safe, e.g.
+  when chunks are prefetched on a thread pool. Once built, lookups are safe.
+
+  Args:
+    ds: Dataset whose indexes are used to select chunks.
+  """
+  for index in ds.indexes.values():
+    _ = index.is_unique
+    _ = index.is_monotonic_increasing
+
+
 class XarrayDataLoader(base.DataLoader):
   """Base class for Xarray data loaders."""
 
@@ -66,6 +83,7 @@ class XarrayDataLoader(base.DataLoader):
       compute: bool = True,
       add_nan_mask: bool = False,
       preprocessing_fn: Optional[Callable[[xr.Dataset], xr.Dataset]] = None,
+      max_concurrent_reads: Optional[int] = None,
   ):
     """Init.
 
@@ -97,6 +115,10 @@ class XarrayDataLoader(base.DataLoader):
         False.
       preprocessing_fn: (Optional) A function that is applied to the dataset
         right after it is opened.
+      max_concurrent_reads: (Optional) Number of threads which read and decode
+        the storage chunks of all variables concurrently when computing a
+        chunk. Latency bound reads from object storage benefit from more
+        threads than cores. Default: dask's default, the number of cores.
     """
     if path is not None and ds is not None:
       raise ValueError('Only one of path or ds can be specified, not both.')
@@ -122,12 +144,28 @@ class XarrayDataLoader(base.DataLoader):
     if sel_kwargs is not None:
       self._ds = self._ds.sel(**sel_kwargs)
     self._variables = variables
+    _build_index_engines(self._ds)
     super().__init__(
         interpolation=interpolation,
         compute=compute,
         add_nan_mask=add_nan_mask,
+        max_concurrent_reads=max_concurrent_reads,
     )
 
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    # The lookup tables of pandas indexes aren't pickled.
+    _build_index_engines(self._ds)
+
+  @property
+  def dataset(self) -> xr.Dataset:
+    """The (lazily opened) dataset chunks are selected from.
+
+    Dimensions and variables are already renamed, e.g. for
+    TimeChunks.aligned_to_storage.
+    """
+    return self._ds
+
   def _load_chunk_from_source(
       self,
       init_times: np.ndarray,
@@ -215,6 +253,50 @@ class TargetsFromXarray(XarrayDataLoader):
           248.5...
   """
 
+  def __init__(self, *args, cache_max_bytes: Optional[int] = None, **kwargs):
+    """Init.
+
+    Args:
+      *args: Positional arguments to pass to XarrayDataLoader.
+      cache_max_bytes: (Optional) If given, the data of each valid time is
+        kept in a least-recently-used cache of this size, in this process. A
+        chunk is then assembled from the cached valid times, and a single read
+        of the missing ones. Since consecutive init times share most of their
+        valid times, this avoids most reads, e.g. when chunks are loaded in
+        order of init time. Chunks are then always loaded into memory, even
+        with compute=False. Default: None, no caching.
+      **kwargs: Other arguments to pass to XarrayDataLoader.
+    """
+    super().__init__(*args, **kwargs)
+    self._cache = None
+    if cache_max_bytes is not None:
+      self._cache = caching.BytesLRUCache(cache_max_bytes)
+
+  def _select_valid_times(
+      self, valid_times: Union[np.ndarray, xr.DataArray]
+  ) -> xr.Dataset:
+    """Selects the data of valid times, from the cache where possible."""
+    if self._cache is None:
+      return self._ds.sel(valid_time=valid_times)
+    unique_valid_times = np.unique(
+        np.asarray(valid_times).astype('datetime64[ns]')
+    )
+    # Each valid time is cached once, keyed by its value in nanoseconds.
+    keys = unique_valid_times.view(np.int64).tolist()
+    slices = [self._cache.get(key) for key in keys]
+    missing = [i for i, s in enumerate(slices) if s is None]
+    profiling.record('cached_valid_times', len(slices) - len(missing))
+    profiling.record('read_valid_times', len(missing))
+    if missing:
+      loaded = self._ds.sel(valid_time=unique_valid_times[missing]).compute()
+      for position, i in enumerate(missing):
+        # A copy, so that the cached slice doesn't keep the whole read alive.
+        slices[i] = loaded.isel(valid_time=[position]).copy(deep=True)
+        self._cache.put(keys[i], slices[i], slices[i].nbytes)
+    return xr.concat(
+        slices, dim='valid_time', data_vars='minimal', coords='minimal'
+    ).sel(valid_time=valid_times)
+
   def _load_chunk_from_source(
       self,
       init_times: np.ndarray,
@@ -226,13 +308,13 @@ class TargetsFromXarray(XarrayDataLoader):
       valid_time = xr.DataArray(
           init_times, coords={'init_time': init_times}
       ) + xr.DataArray(lead_times, coords={'lead_time': lead_times})
-      chunk = self._ds.sel(valid_time=valid_time)
+      chunk = self._select_valid_times(valid_time)
     # Lead time slice: not allowed.
     elif isinstance(lead_times, slice):
       raise ValueError('Lead time slice not supported for target data loaders.')
     # No lead time slice, in this case treat the init times as valid times.
     else:
-      chunk = self._ds.sel(valid_time=init_times)
+      chunk = self._select_valid_times(init_times)
     return chunk
 
 
@@ -243,6 +325,8 @@ class ClimatologyFromXarray(XarrayDataLoader):
       self,
       climatology_time_coords: Iterable[str] = ('dayofyear', 'hour'),
       rename_dimensions: Optional[Union[Mapping[str, str], str]] = None,
+      shared_key: Optional[str] = None,
+      shared_directory: Optional[str] = None,
       **kwargs
   ):
     """Init.
@@ -252,9 +336,19 @@ class ClimatologyFromXarray(XarrayDataLoader):
         to select. Default: ('dayofyear', 'hour').
       rename_dimensions: (Optional) Dictionary of dimensions to rename. Default:
         None.
+      shared_key: (Optional) If given, the (selected) climatology is stored
+        once per host under this key, and shared by all processes, see
+        shared_arrays.share_dataset.
+      shared_directory: (Optional) Directory of the shared climatology.
+        Default: shared_arrays.default_directory().
       **kwargs: Other arguments to pass to XarrayDataLoader.
     """
     super().__init__(rename_dimensions=rename_dimensions, **kwargs)
+    if shared_key is not None:
+      self._ds = shared_arrays.share_dataset(
+          self._ds, shared_key, shared_directory
+      )
+      _build_index_engines(self._ds)
     self._climatology_time_coords = climatology_time_coords
 
   def _load_chunk_from_source(
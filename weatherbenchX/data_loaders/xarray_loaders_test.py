@@ -14,7 +14,9 @@
 
 from absl.testing import absltest
 import numpy as np
+from weatherbenchX import profiling
 from weatherbenchX import test_utils
+from weatherbenchX.data_loaders import base
 from weatherbenchX.data_loaders import xarray_loaders
 import xarray as xr
 
@@ -58,6 +60,76 @@ class XarrayLoadersTest(absltest.TestCase):
     for d in target_chunk.dims:
       xr.testing.assert_equal(target_chunk[d], prediction_chunk[d])
 
+  def test_targets_cache(self):
+    target = test_utils.mock_target_data(
+        time_start='2020-01-01T00',
+        time_stop='2020-01-05T00',
+        time_resolution='6 hours',
+        random=True,
+    )
+    target_path = self.create_tempdir('target.zarr').full_path
+    target.to_zarr(target_path)
+    uncached_loader = xarray_loaders.TargetsFromXarray(path=target_path)
+    slice_nbytes = target.isel(time=[0]).nbytes
+    # Positional arguments are passed on to XarrayDataLoader.
+    cached_loader = xarray_loaders.TargetsFromXarray(
+        target_path, cache_max_bytes=6 * slice_nbytes
+    )
+    lead_times = np.arange(0, 30, 6, dtype='timedelta64[h]').astype(
+        'timedelta64[ns]'
+    )
+    with profiling.collect() as profile:
+      for init_time in target.time.values[:4]:
+        init_times = np.array([init_time])
+        xr.testing.assert_identical(
+            cached_loader.load_chunk(init_times, lead_times),
+            uncached_loader.load_chunk(init_times, lead_times),
+        )
+      # Valid times without lead times.
+      xr.testing.assert_identical(
+          cached_loader.load_chunk(target.time.values[2:5]),
+          uncached_loader.load_chunk(target.time.values[2:5]),
+      )
+    samples = profile.drain()
+    # 5 new valid times for the first init time, 1 for each following one.
+    self.assertEqual(samples['source/read_valid_times'], [5, 1, 1, 1, 0])
+    self.assertEqual(samples['source/cached_valid_times'], [0, 4, 4, 4, 3])
+    self.assertLessEqual(cached_loader._cache.nbytes, 6 * slice_nbytes)
+
+  def test_compute_chunk(self):
+    target = test_utils.mock_target_data(
+        time_start='2020-01-01T00', time_stop='2020-01-05T00', random=True
+    )
+    target_path = self.create_tempdir('target.zarr').full_path
+    target.chunk({'time': 1, 'level': 1}).to_zarr(target_path)
+    loader = xarray_loaders.TargetsFromXarray(
+        path=target_path, max_concurrent_reads=4
+    )
+    init_times = target.time.values[:2]
+    lead_times = np.array([0, 1], dtype='timedelta64[D]')
+    chunk = loader.load_chunk(init_times, lead_times)
+    self.assertIsInstance(chunk, xr.Dataset)
+    for data_array in chunk.values():
+      self.assertIsNone(data_array.chunks)
+    xr.testing.assert_identical(
+        chunk,
+        xarray_loaders.TargetsFromXarray(ds=target).load_chunk(
+            init_times, lead_times
+        ),
+    )
+
+    # Dicts of DataArrays with differently sized dims of the same name.
+    lazy = xr.open_zarr(target_path)
+    chunk = {
+        'a': lazy['2m_temperature'].isel(time=[0]),
+        'b': lazy['2m_temperature'].isel(time=[1, 2]),
+    }
+    computed = base.compute_chunk(chunk, max_concurrent_reads=2)
+    self.assertIsInstance(computed, dict)
+    for name in chunk:
+      self.assertIsNone(computed[name].chunks)
+      xr.testing.assert_identical(computed[name], chunk[name].compute())
+
   def test_climatology_loader(self):
     target = test_utils.mock_prediction_data(
         time_start='2020-01-01T00',
@@ -87,6 +159,17 @@ class XarrayLoadersTest(absltest.TestCase):
         {'init_time', 'lead_time', 'level', 'latitude', 'longitude'},
     )
 
+    shared_loader = xarray_loaders.ClimatologyFromXarray(
+        ds=climatology,
+        variables=variables,
+        climatology_time_coords=['dayofyear', 'hour'],
+        shared_key='climatology',
+        shared_directory=self.create_tempdir().full_path,
+    )
+    xr.testing.assert_identical(
+        shared_loader.load_chunk(init_times, lead_times), climatology_chunk
+    )
+
   def test_persistence_loader(self):
     target = test_utils.mock_target_data(
         time_start='2020-01-01T00',
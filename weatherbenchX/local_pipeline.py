@@ -0,0 +1,376 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Runs evaluations on a single machine, without Beam.
+
+This is equivalent to beam_pipeline.define_pipeline, but streams over the time
+chunks in the current process, or in a pool of worker processes, which avoids
+the startup and per-element overhead of a Beam runner for small and medium
+sized evaluations. Only a few chunks are loaded at a time, and their statistics
+are summed into a few partial AggregationStates.
+"""
+
+import collections
+from concurrent import futures
+import contextlib
+import logging
+import multiprocessing
+from typing import Iterable, Mapping, Optional, Tuple, Union
+
+import numpy as np
+from weatherbenchX import aggregation
+from weatherbenchX import checkpointing
+from weatherbenchX import prefetching
+from weatherbenchX import profiling
+from weatherbenchX import writers
+from weatherbenchX.data_loaders import base as data_loaders_base
+from weatherbenchX.metrics import base as metrics_base
+import xarray as xr
+
+
+def _aggregate_chunk(
+    predictions_chunk: prefetching.Chunk,
+    targets_chunk: prefetching.Chunk,
+    metrics: Mapping[str, metrics_base.Metric],
+    aggregator: aggregation.Aggregator,
+    pack_aggregation_states: bool,
+) -> aggregation.AggregationState:
+  with profiling.timer('statistics'):
+    statistics = metrics_base.compute_unique_statistics_for_all_metrics(
+        metrics, predictions_chunk, targets_chunk
+    )
+  with profiling.timer('aggregation'):
+    aggregation_state = aggregator.aggregate_statistics(statistics)
+    if pack_aggregation_states:
+      aggregation_state = aggregation_state.pack()
+  profiling.record('aggregation_state_bytes', aggregation_state.nbytes)
+  return aggregation_state
+
+
+def _collect(profile: Optional[profiling.Profile]):
+  """Collects measurements into profile, if given, see profiling.collect."""
+  if profile is None:
+    return contextlib.nullcontext()
+  return profiling.collect(profile)
+
+
+# Loaders, metrics, aggregator, pack_aggregation_states and checkpoints of a
+# worker process, set once per process by _init_worker, so they aren't pickled
+# for every chunk.
+_worker_context = None
+
+
+def _init_worker(*context) -> None:
+  global _worker_context
+  _worker_context = context
+
+
+def _load_and_aggregate_chunk_in_worker(
+    chunk_index: int,
+    init_times: np.ndarray,
+    lead_times: Union[np.ndarray, slice],
+) -> Tuple[Union[aggregation.AggregationState, bytes], Mapping[str, list]]:
+  """Returns the AggregationState of a chunk and the worker's measurements.
+
+  The state is serialized if packed.
+  """
+  predictions_loader, targets_loader, metrics, aggregator, pack, checkpoints = (
+      _worker_context
+  )
+  with profiling.collect() as profile:
+    targets_chunk = prefetching.load_targets(
+        targets_loader, init_times, lead_times
+    )
+    predictions_chunk = prefetching.load_predictions(
+        predictions_loader, init_times, lead_times, targets_chunk
+    )
+    aggregation_state = _aggregate_chunk(
+        predictions_chunk, targets_chunk, metrics, aggregator, pack
+    )
+    if checkpoints is not None:
+      checkpoints.save(chunk_index, aggregation_state)
+    if isinstance(aggregation_state, aggregation.PackedAggregationState):
+      # Much cheaper to send back to the parent than a pickled state.
+      aggregation_state = aggregation_state.to_bytes()
+  return aggregation_state, profile.drain()
+
+
+def aggregate_chunks(
+    times: Iterable[Tuple[np.ndarray, Union[np.ndarray, slice]]],
+    predictions_loader: data_loaders_base.DataLoader,
+    targets_loader: data_loaders_base.DataLoader,
+    metrics: Mapping[str, metrics_base.Metric],
+    aggregator: aggregation.Aggregator,
+    pack_aggregation_states: bool = True,
+    prefetch_depth: int = 1,
+    prefetch_max_bytes: Optional[int] = None,
+    max_chunks_per_aggregation_stage: Optional[int] = 10,
+    num_workers: Optional[int] = None,
+    mp_context: Optional[multiprocessing.context.BaseContext] = None,
+    checkpoints: Optional[checkpointing.ChunkCheckpoints] = None,
+    profile: Optional[profiling.Profile] = None,
+) -> aggregation.AggregationState:
+  """Streams over time chunks and sums their AggregationStates.
+
+  The states are summed in the same stages as in beam_pipeline.define_pipeline,
+  see aggregation.MultiStageSum, so that results are identical to the Beam
+  pipeline, independently of the number of workers.
+
+  Args:
+    times: TimeChunks instance, or any iterable of (init_times, lead_times).
+    predictions_loader: DataLoader instance.
+    targets_loader: DataLoader instance.
+    metrics: A dictionary of metrics to compute.
+    aggregator: Aggregation instance.
+    pack_aggregation_states: Whether to pack the AggregationStates of each
+      chunk, which makes summing them much cheaper. Default: True.
+    prefetch_depth: Number of chunks to load on a thread pool while the current
+      chunk is being computed. Only used without worker processes. Default: 1.
+    prefetch_max_bytes: (Optional) Limit on the size of prefetched chunks, see
+      prefetching.ChunkPrefetcher.
+    max_chunks_per_aggregation_stage: The maximum number of chunks to sum in a
+      single stage, as in define_pipeline. If None, all chunks are summed in a
+      single stage. Default: 10.
+    num_workers: (Optional) Number of worker processes which load and aggregate
+      chunks. Loaders, metrics and aggregator are sent to each worker once.
+      The states of the chunks are summed in this process. If None, everything
+      runs in this process.
+    mp_context: (Optional) Multiprocessing context for the worker processes.
+      Default: 'spawn', since forking a process which uses threads (e.g. for
+      prefetching or in Beam) can deadlock.
+    checkpoints: (Optional) Where to store the AggregationState of each chunk.
+      Chunks which are already stored are not loaded again, but their stored
+      states are summed instead.
+    profile: (Optional) Profile to add the timings and sizes of the stages of
+      all chunks to, see profiling. Without a profile, nothing is measured.
+
+  Returns:
+    The AggregationState summed over all chunks.
+  """
+  with _collect(profile):
+    chunks = list(times)
+    multi_stage_sum = aggregation.MultiStageSum(
+        len(chunks), max_chunks_per_aggregation_stage
+    )
+    keys = multi_stage_sum.keys_in_order()
+    completed = frozenset()
+    if checkpoints is not None:
+      completed = checkpoints.completed_chunks()
+      logging.info(
+          'Loading %d of %d chunks from checkpoints in %s',
+          len(completed & set(keys)),
+          len(keys),
+          checkpoints.directory,
+      )
+
+    def add_state(chunk_index, aggregation_state):
+      with profiling.timer('sum'):
+        multi_stage_sum.add(chunk_index, aggregation_state)
+
+    def add_checkpoint(chunk_index):
+      add_state(chunk_index, checkpoints.load(chunk_index))
+
+    if num_workers is None:
+      prefetcher = prefetching.ChunkPrefetcher(
+          predictions_loader,
+          targets_loader,
+          depth=prefetch_depth,
+          max_bytes=prefetch_max_bytes,
+      )
+      loaded_chunks = prefetcher.iterate(
+          (key, chunks[key]) for key in keys if key not in completed
+      )
+      try:
+        for key in keys:
+          if key in completed:
+            add_checkpoint(key)
+            continue
+          chunk_index, predictions_chunk, targets_chunk = next(loaded_chunks)
+          logging.info('Processing chunk %d', chunk_index)
+          aggregation_state = _aggregate_chunk(
+              predictions_chunk,
+              targets_chunk,
+              metrics,
+              aggregator,
+              pack_aggregation_states,
+          )
+          if checkpoints is not None:
+            checkpoints.save(chunk_index, aggregation_state)
+          add_state(chunk_index, aggregation_state)
+      finally:
+        loaded_chunks.close()
+        prefetcher.close()
+      return multi_stage_sum.result()
+
+    def add_result(chunk_index, future):
+      aggregation_state, samples = future.result()
+      if isinstance(aggregation_state, bytes):
+        aggregation_state = aggregation.PackedAggregationState.from_bytes(
+            aggregation_state
+        )
+      if profile is not None:
+        profile.update(samples)
+      logging.info('Processed chunk %d', chunk_index)
+      add_state(chunk_index, aggregation_state)
+
+    if mp_context is None:
+      mp_context = multiprocessing.get_context('spawn')
+    with futures.ProcessPoolExecutor(
+        max_workers=num_workers,
+        mp_context=mp_context,
+        initializer=_init_worker,
+        initargs=(
+            predictions_loader,
+            targets_loader,
+            metrics,
+            aggregator,
+            pack_aggregation_states,
+            checkpoints,
+        ),
+    ) as executor:
+      # Results are summed in order, so bound the number of submitted chunks to
+      # limit the number of finished states waiting for earlier ones.
+      pending = collections.deque()
+      for key in keys:
+        if key in completed:
+          if not pending:
+            add_checkpoint(key)
+            continue
+          future = futures.Future()
+          future.set_result((checkpoints.load(key), {}))
+        else:
+          future = executor.submit(
+              _load_and_aggregate_chunk_in_worker, key, *chunks[key]
+          )
+        pending.append((key, future))
+        if len(pending) >= 2 * num_workers:
+          add_result(*pending.popleft())
+      while pending:
+        add_result(*pending.popleft())
+    return multi_stage_sum.result()
+
+
+def run_pipeline(
+    times: Iterable[Tuple[np.ndarray, Union[np.ndarray, slice]]],
+    predictions_loader: data_loaders_base.DataLoader,
+    targets_loader: data_loaders_base.DataLoader,
+    metrics: Mapping[str, metrics_base.Metric],
+    aggregator: aggregation.Aggregator,
+    out_path: Optional[str] = None,
+    pack_aggregation_states: bool = True,
+    prefetch_depth: int = 1,
+    prefetch_max_bytes: Optional[int] = None,
+    max_chunks_per_aggregation_stage: Optional[int] = 10,
+    num_workers: Optional[int] = None,
+    checkpoint_dir: Optional[str] = None,
+    checkpoint_key: Optional[str] = None,
+    incremental: bool = False,
+    output_compression: Optional[str] = None,
+    profile: Optional[profiling.Profile] = None,
+) -> xr.Dataset:
+  """Runs the evaluation in the current process.
+
+  Args:
+    times: TimeChunks instance, or any iterable of (init_times, lead_times).
+    predictions_loader: DataLoader instance.
+    targets_loader: DataLoader instance.
+    metrics: A dictionary of metrics to compute.
+    aggregator: Aggregation instance.
+    out_path: (Optional) The full path to write the metrics to, as NetCDF, or
+      as Zarr if it ends in '.zarr'.
+    pack_aggregation_states: Whether to pack the AggregationStates of each
+      chunk, which makes summing them much cheaper. Default: True.
+    prefetch_depth: Number of chunks to load on a thread pool while the current
+      chunk is being computed. Default: 1.
+    prefetch_max_bytes: (Optional) Limit on the size of prefetched chunks, see
+      prefetching.ChunkPrefetcher.
+    max_chunks_per_aggregation_stage: The maximum number of chunks to sum in a
+      single stage, as in define_pipeline. Default: 10.
+    num_workers: (Optional) Number of worker processes which load and aggregate
+      chunks in parallel. If None, everything runs in this process.
+    checkpoint_dir: (Optional) Local or fsspec directory to store the
+      AggregationState of each chunk in, see checkpointing.ChunkCheckpoints. A
+      rerun of the same evaluation only computes the chunks which are missing.
+    checkpoint_key: (Optional) Key of the checkpoints, instead of a fingerprint
+      of times, loaders, metrics and aggregator.
+    incremental: Whether to add the AggregationState of `times` to the one
+      stored next to `out_path` by previous incremental runs, see
+      checkpointing.IncrementalAggregationState. The metrics are then computed
+      from the total state, and the total state is stored for the next run.
+      Raises a ValueError if metrics or aggregator differ from previous runs, or
+      if any init times were already included. Default: False.
+    output_compression: (Optional) Lossless compression of NetCDF output, see
+      writers.write_metrics. Default: None.
+    profile: (Optional) Profile to add the timings and sizes of all stages to,
+      e.g. loading, statistics, aggregation and writing, see profiling. Its
+      summary is also logged.
+
+  Returns:
+    The metrics Dataset, the same as written by beam_pipeline.define_pipeline.
+  """
+  times = list(times)
+  if incremental:
+    if out_path is None:
+      raise ValueError('Incremental evaluations require an out_path.')
+    incremental_state_path = checkpointing.incremental_state_path(out_path)
+    init_times = checkpointing.init_times_of_chunks(times)
+    # Fails before computing anything if init_times can't be added.
+    incremental_state = (
+        checkpointing.IncrementalAggregationState.load_for_update(
+            incremental_state_path, metrics, aggregator, init_times
+        )
+    )
+
+  checkpoints = None
+  if checkpoint_dir is not None:
+    checkpoints = checkpointing.ChunkCheckpoints.for_evaluation(
+        checkpoint_dir,
+        times,
+        predictions_loader,
+        targets_loader,
+        metrics,
+        aggregator,
+        checkpoint_key=checkpoint_key,
+    )
+  aggregation_state = aggregate_chunks(
+      times,
+      predictions_loader,
+      targets_loader,
+      metrics,
+      aggregator,
+      pack_aggregation_states=pack_aggregation_states,
+      prefetch_depth=prefetch_depth,
+      prefetch_max_bytes=prefetch_max_bytes,
+      max_chunks_per_aggregation_stage=max_chunks_per_aggregation_stage,
+      num_workers=num_workers,
+      checkpoints=checkpoints,
+      profile=profile,
+  )
+  if incremental:
+    incremental_state = incremental_state.add(aggregation_state, init_times)
+    aggregation_state = incremental_state.aggregation_state
+  with _collect(profile):
+    with profiling.timer('metrics'):
+      results = aggregation_state.metric_values(metrics)
+    if out_path is not None:
+      with profiling.timer('write'):
+        writers.write_metrics(
+            results, out_path, compression=output_compression
+        )
+  if incremental:
+    # Only stored once the metrics are written, so that a failed run can simply
+    # be repeated.
+    incremental_state.save(incremental_state_path)
+  if profile is not None:
+    logging.info('Evaluation profile:\n%s', profile.format_summary())
+  return results
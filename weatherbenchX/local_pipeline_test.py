@@ -0,0 +1,184 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from absl.testing import absltest
+from absl.testing import parameterized
+from apache_beam.testing import test_pipeline
+import numpy as np
+from weatherbenchX import aggregation
+from weatherbenchX import beam_pipeline
+from weatherbenchX import local_pipeline
+from weatherbenchX import profiling
+from weatherbenchX import test_utils
+from weatherbenchX import time_chunks
+from weatherbenchX.data_loaders import xarray_loaders
+from weatherbenchX.metrics import base as metrics_base
+from weatherbenchX.metrics import deterministic
+import xarray as xr
+
+
+class LocalPipelineTest(parameterized.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    predictions_path = self.create_tempdir('predictions.zarr').full_path
+    targets_path = self.create_tempdir('targets.zarr').full_path
+
+    predictions = (
+        test_utils.mock_prediction_data(
+            time_start='2020-01-01T00',
+            time_stop='2020-01-03T00',
+            lead_start='0 days',
+            lead_stop='1 day',
+        )
+        + np.random.uniform()
+    )
+    targets = (
+        test_utils.mock_target_data(
+            time_start='2020-01-01T00',
+            time_stop='2020-01-05T00',
+        )
+        + np.random.uniform()
+    )
+    predictions.to_zarr(predictions_path)
+    targets.to_zarr(targets_path)
+
+    self.init_times = predictions.time.values
+    self.lead_times = predictions.prediction_timedelta.values
+    self.times = time_chunks.TimeChunks(
+        self.init_times,
+        self.lead_times,
+        init_time_chunk_size=1,
+        lead_time_chunk_size=1,
+    )
+    self.targets_loader = xarray_loaders.TargetsFromXarray(path=targets_path)
+    self.predictions_loader = xarray_loaders.PredictionsFromXarray(
+        path=predictions_path
+    )
+    self.metrics = {'rmse': deterministic.RMSE(), 'mse': deterministic.MSE()}
+
+  @parameterized.parameters(
+      {'reduce_dims': ['init_time', 'latitude', 'longitude']},
+      {'reduce_dims': ['init_time'], 'pack_aggregation_states': False},
+      {'reduce_dims': []},
+      {'reduce_dims': ['init_time'], 'prefetch_depth': 0},
+      {
+          'reduce_dims': ['init_time'],
+          'prefetch_depth': 3,
+          'prefetch_max_bytes': 10**6,
+      },
+  )
+  def test_matches_direct_results(
+      self,
+      reduce_dims,
+      pack_aggregation_states=True,
+      prefetch_depth=1,
+      prefetch_max_bytes=None,
+  ):
+    aggregator = aggregation.Aggregator(reduce_dims=reduce_dims)
+    statistics = metrics_base.compute_unique_statistics_for_all_metrics(
+        self.metrics,
+        self.predictions_loader.load_chunk(self.init_times, self.lead_times),
+        self.targets_loader.load_chunk(self.init_times, self.lead_times),
+    )
+    direct_results = aggregator.aggregate_statistics(statistics).metric_values(
+        self.metrics
+    )
+
+    results_path = self.create_tempfile('results.nc').full_path
+    results = local_pipeline.run_pipeline(
+        self.times,
+        self.predictions_loader,
+        self.targets_loader,
+        self.metrics,
+        aggregator,
+        out_path=results_path,
+        pack_aggregation_states=pack_aggregation_states,
+        prefetch_depth=prefetch_depth,
+        prefetch_max_bytes=prefetch_max_bytes,
+    )
+
+    # There can be small differences due to numerical errors.
+    xr.testing.assert_allclose(direct_results, results, rtol=1e-3)
+    xr.testing.assert_identical(
+        results, xr.open_dataset(results_path).compute()
+    )
+
+  @parameterized.parameters(
+      {'num_workers': None},
+      {'num_workers': 2},
+  )
+  def test_identical_to_beam_pipeline(self, num_workers):
+    aggregator = aggregation.Aggregator(reduce_dims=['init_time'])
+    results_path = self.create_tempfile('results.nc').full_path
+    with test_pipeline.TestPipeline() as root:
+      beam_pipeline.define_pipeline(
+          root,
+          self.times,
+          self.predictions_loader,
+          self.targets_loader,
+          self.metrics,
+          aggregator,
+          out_path=results_path,
+          max_chunks_per_aggregation_stage=2,
+      )
+    beam_results = xr.open_dataset(results_path).compute()
+
+    results = local_pipeline.run_pipeline(
+        self.times,
+        self.predictions_loader,
+        self.targets_loader,
+        self.metrics,
+        aggregator,
+        max_chunks_per_aggregation_stage=2,
+        num_workers=num_workers,
+    )
+    xr.testing.assert_identical(beam_results, results)
+
+
+  @parameterized.parameters(
+      {'num_workers': None},
+      {'num_workers': 2},
+  )
+  def test_profile(self, num_workers):
+    profile = profiling.Profile()
+    local_pipeline.run_pipeline(
+        self.times,
+        self.predictions_loader,
+        self.targets_loader,
+        self.metrics,
+        aggregation.Aggregator(reduce_dims=['init_time']),
+        out_path=self.create_tempfile('results.nc').full_path,
+        num_workers=num_workers,
+        profile=profile,
+    )
+    summary = profile.summary()
+    for name in [
+        'targets_load_seconds',
+        'targets_load/compute_seconds',
+        'targets_load/bytes',
+        'predictions_load_seconds',
+        'predictions_load/bytes',
+        'statistics_seconds',
+        'aggregation_seconds',
+        'aggregation_state_bytes',
+        'sum_seconds',
+    ]:
+      self.assertEqual(summary[name]['count'], len(self.times), msg=name)
+    self.assertGreater(summary['targets_load/bytes']['min'], 0)
+    self.assertEqual(summary['write_seconds']['count'], 1)
+
+
+if __name__ == '__main__':
+  absltest.main()
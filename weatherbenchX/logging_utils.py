@@ -0,0 +1,137 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Cheap, lazily formatted summaries of chunks and states for logging.
+
+Formatting the repr of xarray objects or AggregationStates for every element
+is measurable work, and floods worker logs. Instead, log
+
+  logging.info('Chunk: %s', logging_utils.Summary(chunk))
+
+which is only formatted if the message is emitted, and then only contains
+shapes, dtypes, sizes and the first and last value of each dimension
+coordinate. Full reprs are logged instead if the 'weatherbenchX' logger is
+enabled for DEBUG, e.g. with logging.getLogger().setLevel(logging.DEBUG).
+"""
+
+import logging
+from typing import Any, Mapping
+
+import numpy as np
+import pandas as pd
+from weatherbenchX import aggregation
+import xarray as xr
+
+# Logger whose level decides whether full reprs are logged. It inherits the
+# level of the root logger, unless set explicitly.
+_LOGGER = logging.getLogger('weatherbenchX')
+
+
+def _format_value(value: Any) -> str:
+  if isinstance(value, np.datetime64):
+    return str(pd.Timestamp(value))
+  if isinstance(value, np.timedelta64):
+    return str(pd.Timedelta(value))
+  return str(value)
+
+
+def _format_range(values: np.ndarray) -> str:
+  if values.size == 0:
+    return '[]'
+  if values.size == 1:
+    return f'[{_format_value(values[0])}]'
+  return f'[{_format_value(values[0])} .. {_format_value(values[-1])}]'
+
+
+def _summarize_array(array: np.ndarray) -> str:
+  summary = f'{array.dtype}{list(array.shape)}'
+  if array.ndim == 1:
+    summary += f' {_format_range(array)}'
+  return summary
+
+
+def _summarize_data_array(data_array: xr.DataArray) -> str:
+  """dtype, sizes, bytes and ranges of the dimension coordinates."""
+  dims = ', '.join(f'{d}: {s}' for d, s in data_array.sizes.items())
+  summary = f'{data_array.dtype}({dims}), {data_array.nbytes} bytes'
+  ranges = [
+      f'{d}={_format_range(data_array.indexes[d].values)}'
+      for d in data_array.dims
+      if d in data_array.indexes
+  ]
+  if ranges:
+    summary += ', ' + ', '.join(ranges)
+  return summary
+
+
+def _summarize_mapping(mapping: Mapping[Any, Any]) -> str:
+  return '{' + ', '.join(
+      f'{k!r}: {summarize(v)}' for k, v in mapping.items()
+  ) + '}'
+
+
+def summarize(obj: Any) -> str:
+  """Short description of chunks, states, arrays and containers of them.
+
+  Args:
+    obj: DataArray, Dataset, AggregationState, numpy array, or a mapping, list
+      or tuple of them. Anything else is formatted with repr.
+
+  Returns:
+    A summary, which never includes data values, and only the first and last
+    value of dimension coordinates.
+  """
+  if isinstance(obj, xr.DataArray):
+    return _summarize_data_array(obj)
+  if isinstance(obj, xr.Dataset):
+    return f'Dataset({_summarize_mapping(obj.data_vars)})'
+  if isinstance(obj, aggregation.PackedAggregationState):
+    # Already cheap, without reconstructing DataArrays.
+    return repr(obj)
+  if isinstance(obj, aggregation.AggregationState):
+    if obj.is_zero():
+      return 'AggregationState(zero)'
+    return (
+        f'AggregationState(<{len(obj.sum_weighted_statistics)} statistics,'
+        f' {obj.nbytes} bytes>)'
+    )
+  if isinstance(obj, np.ndarray):
+    return _summarize_array(obj)
+  if isinstance(obj, Mapping):
+    return _summarize_mapping(obj)
+  if isinstance(obj, tuple) and hasattr(obj, '_fields'):
+    fields = ', '.join(
+        f'{name}={summarize(value)}'
+        for name, value in zip(obj._fields, obj)
+    )
+    return f'{type(obj).__name__}({fields})'
+  if isinstance(obj, (list, tuple)):
+    items = ', '.join(summarize(v) for v in obj)
+    return f'[{items}]' if isinstance(obj, list) else f'({items})'
+  return repr(obj)
+
+
+class Summary:
+  """Formats `obj` with summarize, or repr for DEBUG logging, when logged."""
+
+  __slots__ = ('obj',)
+
+  def __init__(self, obj: Any):
+    self.obj = obj
+
+  def __str__(self) -> str:
+    if _LOGGER.isEnabledFor(logging.DEBUG):
+      return repr(self.obj)
+    return summarize(self.obj)
+
+  __repr__ = __str__
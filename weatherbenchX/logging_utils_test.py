@@ -0,0 +1,84 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+
+from absl.testing import absltest
+import numpy as np
+from weatherbenchX import aggregation
+from weatherbenchX import logging_utils
+from weatherbenchX import test_utils
+
+
+class SummaryTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.chunk = test_utils.mock_prediction_data(
+        time_start='2020-01-01T00',
+        time_stop='2020-01-02T00',
+        lead_start='0 days',
+        lead_stop='1 day',
+    )
+
+  def test_summarize_data_array(self):
+    summary = logging_utils.summarize(self.chunk['2m_temperature'])
+    self.assertIn('float32(', summary)
+    self.assertIn('time: 1', summary)
+    self.assertIn(f'{self.chunk["2m_temperature"].nbytes} bytes', summary)
+    self.assertIn('time=[2020-01-01 00:00:00]', summary)
+    self.assertIn(
+        'prediction_timedelta=[0 days 00:00:00 .. 1 days 00:00:00]', summary
+    )
+    # Never formats data values.
+    self.assertLess(len(summary), 300)
+
+  def test_summarize_containers(self):
+    summary = logging_utils.summarize(
+        (3, (dict(self.chunk), self.chunk), np.arange(4))
+    )
+    self.assertStartsWith(summary, "(3, ({'geopotential': float32(")
+    self.assertIn('Dataset({', summary)
+    self.assertEndsWith(summary, 'int64[4] [0 .. 3])')
+
+  def test_summarize_aggregation_states(self):
+    self.assertEqual(
+        logging_utils.summarize(aggregation.AggregationState.zero()),
+        'AggregationState(zero)',
+    )
+    state = aggregation.AggregationState(
+        sum_weighted_statistics={'mse': dict(self.chunk)},
+        sum_weights={'mse': dict(self.chunk)},
+    )
+    self.assertEqual(
+        logging_utils.summarize(state),
+        f'AggregationState(<1 statistics, {state.nbytes} bytes>)',
+    )
+    packed = state.pack()
+    self.assertEqual(logging_utils.summarize(packed), repr(packed))
+
+  def test_full_repr_for_debug_logging(self):
+    summary = logging_utils.Summary(self.chunk)
+    self.assertEqual(str(summary), logging_utils.summarize(self.chunk))
+    logger = logging.getLogger('weatherbenchX')
+    level = logger.level
+    logger.setLevel(logging.DEBUG)
+    try:
+      self.assertEqual(str(summary), repr(self.chunk))
+    finally:
+      logger.setLevel(level)
+
+
+if __name__ == '__main__':
+  absltest.main()
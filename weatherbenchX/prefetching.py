@@ -0,0 +1,363 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Prefetching of prediction and target chunks on a thread pool.
+
+Loading chunks is typically I/O bound, e.g. when reading Zarr from object
+storage. Prefetching overlaps loading the next chunks with computing the
+statistics of the current one.
+"""
+
+import collections
+from concurrent import futures
+import threading
+from typing import Any, Hashable, Iterable, Iterator, Mapping, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from weatherbenchX import profiling
+from weatherbenchX import time_chunks
+from weatherbenchX.data_loaders import base as data_loaders_base
+import xarray as xr
+
+
+Chunk = Mapping[Hashable, xr.DataArray]
+
+
+def chunk_nbytes(chunk: Chunk) -> int:
+  """Size of the data of a chunk in bytes."""
+  return sum(data_array.nbytes for data_array in chunk.values())
+
+
+def load_targets(
+    targets_loader: data_loaders_base.DataLoader,
+    init_times: np.ndarray,
+    lead_times: Optional[Union[np.ndarray, slice]],
+) -> Chunk:
+  """Loads a target chunk, measured as the 'targets_load' stage."""
+  with profiling.timer('targets_load'):
+    return targets_loader.load_chunk(init_times, lead_times)
+
+
+def load_predictions(
+    predictions_loader: data_loaders_base.DataLoader,
+    init_times: np.ndarray,
+    lead_times: Optional[Union[np.ndarray, slice]],
+    reference: Optional[Chunk] = None,
+) -> Chunk:
+  """Loads a prediction chunk, measured as the 'predictions_load' stage."""
+  with profiling.timer('predictions_load'):
+    return predictions_loader.load_chunk(init_times, lead_times, reference)
+
+
+def select_valid_times(
+    targets: Chunk, init_times: np.ndarray, lead_times: np.ndarray
+) -> Chunk:
+  """Selects the targets of init and lead times from targets by valid time.
+
+  Args:
+    targets: Targets with a valid_time dimension, e.g. as loaded by
+      TargetsFromXarray without lead times.
+    init_times: Init times of the chunk.
+    lead_times: Exact lead times of the chunk.
+
+  Returns:
+    Targets with init_time and lead_time dimensions instead of valid_time, as
+    loaded by TargetsFromXarray with lead times.
+  """
+  valid_time = xr.DataArray(
+      init_times, coords={'init_time': init_times}
+  ) + xr.DataArray(lead_times, coords={'lead_time': lead_times})
+  return {
+      name: (
+          data_array.sel(valid_time=valid_time)
+          if 'valid_time' in data_array.dims
+          else data_array
+      )
+      for name, data_array in targets.items()
+  }
+
+
+class ValidTimeGroupedTargets:
+  """Loads the targets of groups of chunks once per valid time of the group.
+
+  The targets of all valid times of a group, see
+  time_chunks.group_by_valid_time, are loaded with a single load_chunk
+  without lead times, when the first chunk of the group is requested. The
+  targets of each chunk are then selected from them, see select_valid_times.
+  This requires a targets loader which treats init times as valid times if no
+  lead times are given, like TargetsFromXarray.
+
+  The targets of the most recently used groups are kept, so chunks should be
+  loaded group by group. Chunks which aren't part of any group are loaded
+  directly.
+  """
+
+  def __init__(
+      self,
+      targets_loader: data_loaders_base.DataLoader,
+      times: Sequence[time_chunks.TimeChunk],
+      groups: Sequence[Sequence[int]],
+      max_cached_groups: int = 2,
+  ):
+    """Init.
+
+    Args:
+      targets_loader: The data loader for the targets.
+      times: TimeChunks instance whose chunk indices are grouped.
+      groups: Groups of chunk indices, e.g. from
+        time_chunks.group_by_valid_time.
+      max_cached_groups: Number of groups whose targets are kept, e.g. to
+        prefetch the next group while the current one is processed. Default: 2.
+    """
+    if max_cached_groups < 1:
+      raise ValueError(f'{max_cached_groups=} but should be positive.')
+    self.targets_loader = targets_loader
+    self.times = times
+    self.groups = groups
+    self.max_cached_groups = max_cached_groups
+    self._group_of_chunk = {
+        chunk_index: group_index
+        for group_index, group in enumerate(groups)
+        for chunk_index in group
+    }
+    self._lock = threading.Lock()
+    self._cached_groups = collections.OrderedDict()
+
+  def __getstate__(self):
+    # Targets loaded e.g. while constructing a Beam pipeline aren't pickled.
+    state = self.__dict__.copy()
+    del state['_lock'], state['_cached_groups']
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self._lock = threading.Lock()
+    self._cached_groups = collections.OrderedDict()
+
+  def _load_group(self, group_index: int) -> Chunk:
+    group_valid_times = np.unique(np.concatenate([
+        time_chunks.valid_times(*self.times[chunk_index])
+        for chunk_index in self.groups[group_index]
+    ]))
+    profiling.record('group_valid_times', len(group_valid_times))
+    targets = load_targets(self.targets_loader, group_valid_times, None)
+    # Pandas builds the lookup tables of indexes lazily, which isn't
+    # thread-safe, and chunks are selected concurrently when prefetching.
+    for data_array in targets.values():
+      for index in data_array.indexes.values():
+        _ = index.is_unique
+        _ = index.is_monotonic_increasing
+    return targets
+
+  def load(
+      self,
+      chunk_index: int,
+      init_times: np.ndarray,
+      lead_times: Union[np.ndarray, slice],
+  ) -> Chunk:
+    """Returns the targets of a chunk, loading its group if necessary."""
+    group_index = self._group_of_chunk.get(chunk_index)
+    if group_index is None:
+      return load_targets(self.targets_loader, init_times, lead_times)
+    with self._lock:
+      group_future = self._cached_groups.get(group_index)
+      is_loader = group_future is None
+      if is_loader:
+        # Other threads wait for this thread to load the group.
+        group_future = futures.Future()
+        self._cached_groups[group_index] = group_future
+        while len(self._cached_groups) > self.max_cached_groups:
+          self._cached_groups.popitem(last=False)
+      else:
+        self._cached_groups.move_to_end(group_index)
+    if is_loader:
+      try:
+        group_future.set_result(self._load_group(group_index))
+      except BaseException as e:
+        group_future.set_exception(e)
+        with self._lock:
+          # Retry on the next request, rather than caching the error.
+          if self._cached_groups.get(group_index) is group_future:
+            del self._cached_groups[group_index]
+        raise
+    with profiling.timer('targets_select'):
+      return select_valid_times(group_future.result(), init_times, lead_times)
+
+
+class ChunkPrefetcher:
+  """Loads prediction and target chunks ahead of time on a thread pool.
+
+  Chunks are submitted with `submit` and retrieved, in submission order, with
+  `pop`. Targets and predictions of a chunk are loaded concurrently, unless the
+  predictions loader requires the targets as reference (e.g. for
+  interpolation), in which case predictions are loaded once the targets are
+  available.
+
+  Example:
+    prefetcher = ChunkPrefetcher(predictions_loader, targets_loader, depth=2)
+    for key, predictions, targets in prefetcher.iterate(
+        enumerate(time_chunks)
+    ):
+      ...
+  """
+
+  def __init__(
+      self,
+      predictions_loader: data_loaders_base.DataLoader,
+      targets_loader: data_loaders_base.DataLoader,
+      depth: int = 1,
+      max_bytes: Optional[int] = None,
+      grouped_targets: Optional[ValidTimeGroupedTargets] = None,
+  ):
+    """Init.
+
+    Args:
+      predictions_loader: The data loader for the predictions.
+      targets_loader: The data loader for the targets.
+      depth: Number of chunks to load ahead of the chunk that is currently
+        being processed. 0 only loads targets and predictions concurrently.
+        Default: 1.
+      max_bytes: (Optional) Limit on the total size of prefetched chunks. Since
+        the size of a chunk is only known after it's loaded, this is estimated
+        from the most recently loaded chunk. At least one chunk is always
+        loaded.
+      grouped_targets: (Optional) Loads targets by group of valid times,
+        instead of targets_loader. Keys of submitted chunks must then be chunk
+        indices into the TimeChunks of grouped_targets.
+    """
+    if depth < 0:
+      raise ValueError(f'depth must be non-negative, got {depth}.')
+    self.predictions_loader = predictions_loader
+    self.targets_loader = targets_loader
+    self.depth = depth
+    self.max_bytes = max_bytes
+    self.grouped_targets = grouped_targets
+    # Targets and predictions of every chunk in flight can be loaded at once.
+    self._executor = futures.ThreadPoolExecutor(
+        max_workers=2 * (depth + 1), thread_name_prefix='ChunkPrefetcher'
+    )
+    self._pending = collections.deque()
+    self._last_chunk_nbytes = 0
+
+  def __len__(self) -> int:
+    """Number of submitted chunks which haven't been popped yet."""
+    return len(self._pending)
+
+  def submit(
+      self,
+      key: Any,
+      init_times: np.ndarray,
+      lead_times: Optional[Union[np.ndarray, slice]],
+  ) -> None:
+    """Starts loading a chunk in the background.
+
+    Loads are measured in the Profile active here, see profiling.collect.
+
+    Args:
+      key: Key of the chunk, returned with it by `pop`.
+      init_times: Init times of the chunk.
+      lead_times: Lead times of the chunk.
+    """
+    if self.grouped_targets is not None:
+      targets_future = self._executor.submit(
+          profiling.in_active_profile(self.grouped_targets.load),
+          key,
+          init_times,
+          lead_times,
+      )
+    else:
+      targets_future = self._executor.submit(
+          profiling.in_active_profile(load_targets),
+          self.targets_loader,
+          init_times,
+          lead_times,
+      )
+    if self.predictions_loader.requires_reference:
+      # The executor runs tasks in submission order, so the targets are already
+      # being loaded by the time this waits on them.
+      predictions_future = self._executor.submit(
+          profiling.in_active_profile(
+              lambda: load_predictions(
+                  self.predictions_loader,
+                  init_times,
+                  lead_times,
+                  targets_future.result(),
+              )
+          )
+      )
+    else:
+      predictions_future = self._executor.submit(
+          profiling.in_active_profile(load_predictions),
+          self.predictions_loader,
+          init_times,
+          lead_times,
+      )
+    self._pending.append((key, predictions_future, targets_future))
+
+  def is_full(self) -> bool:
+    """Whether the oldest chunk should be popped before submitting more."""
+    if len(self._pending) > self.depth:
+      return True
+    return (
+        self.max_bytes is not None
+        and len(self._pending) * self._last_chunk_nbytes > self.max_bytes
+    )
+
+  def pop(self) -> Tuple[Any, Chunk, Chunk]:
+    """Waits for the oldest submitted chunk and returns it.
+
+    Returns:
+      (key, predictions_chunk, targets_chunk)
+    """
+    key, predictions_future, targets_future = self._pending.popleft()
+    targets = targets_future.result()
+    predictions = predictions_future.result()
+    self._last_chunk_nbytes = chunk_nbytes(targets) + chunk_nbytes(predictions)
+    return key, predictions, targets
+
+  def iterate(
+      self,
+      chunks: Iterable[
+          Tuple[Any, Tuple[np.ndarray, Optional[Union[np.ndarray, slice]]]]
+      ],
+  ) -> Iterator[Tuple[Any, Chunk, Chunk]]:
+    """Loads chunks with prefetching.
+
+    Args:
+      chunks: Iterable of (key, (init_times, lead_times)), e.g.
+        enumerate(time_chunks).
+
+    Yields:
+      (key, predictions_chunk, targets_chunk), in the order of `chunks`.
+    """
+    try:
+      for key, (init_times, lead_times) in chunks:
+        self.submit(key, init_times, lead_times)
+        while self.is_full():
+          yield self.pop()
+      while self._pending:
+        yield self.pop()
+    finally:
+      self.cancel()
+
+  def cancel(self) -> None:
+    """Cancels all chunks which haven't been popped yet."""
+    while self._pending:
+      _, predictions_future, targets_future = self._pending.popleft()
+      predictions_future.cancel()
+      targets_future.cancel()
+
+  def close(self) -> None:
+    """Cancels pending chunks and shuts down the thread pool."""
+    self.cancel()
+    self._executor.shutdown(wait=True)
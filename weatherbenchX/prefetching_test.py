@@ -0,0 +1,213 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+from weatherbenchX import interpolations
+from weatherbenchX import prefetching
+from weatherbenchX import test_utils
+from weatherbenchX import time_chunks
+from weatherbenchX.data_loaders import base as data_loaders_base
+from weatherbenchX.data_loaders import xarray_loaders
+import xarray as xr
+
+
+class _RecordingLoader(data_loaders_base.DataLoader):
+  """Returns the init times as data and records concurrent loads."""
+
+  def __init__(self, interpolation=None, delay=0.01):
+    super().__init__(interpolation=interpolation)
+    self.delay = delay
+    self.lock = threading.Lock()
+    self.loading = 0
+    self.max_loading = 0
+    self.loaded = []
+
+  def _load_chunk_from_source(self, init_times, lead_times=None):
+    with self.lock:
+      self.loading += 1
+      self.max_loading = max(self.max_loading, self.loading)
+    time.sleep(self.delay)
+    with self.lock:
+      self.loading -= 1
+      self.loaded.append(init_times[0])
+    return {'x': xr.DataArray(np.asarray(init_times), dims=['init_time'])}
+
+
+class _CopyReference(interpolations.Interpolation):
+
+  def interpolate_data_array(self, da, reference=None):
+    if reference is None:
+      raise ValueError('Reference is required.')
+    return da + reference * 0
+
+
+class ChunkPrefetcherTest(parameterized.TestCase):
+
+  @parameterized.parameters(
+      {'depth': 0},
+      {'depth': 1},
+      {'depth': 3},
+  )
+  def test_iterate_in_order_with_bounded_depth(self, depth):
+    predictions_loader = _RecordingLoader()
+    targets_loader = _RecordingLoader()
+    prefetcher = prefetching.ChunkPrefetcher(
+        predictions_loader, targets_loader, depth=depth
+    )
+    chunks = [(np.array([i]), None) for i in range(8)]
+    keys = []
+    for key, predictions, targets in prefetcher.iterate(enumerate(chunks)):
+      keys.append(key)
+      self.assertEqual(predictions['x'].item(), key)
+      self.assertEqual(targets['x'].item(), key)
+      # At most `depth` chunks are loaded ahead of the current one.
+      self.assertLessEqual(len(targets_loader.loaded), key + 1 + depth)
+    prefetcher.close()
+
+    self.assertEqual(keys, list(range(8)))
+    self.assertLessEqual(targets_loader.max_loading, depth + 1)
+    self.assertFalse(predictions_loader.requires_reference)
+
+  def test_predictions_wait_for_reference(self):
+    predictions_loader = _RecordingLoader(interpolation=_CopyReference())
+    targets_loader = _RecordingLoader()
+    self.assertTrue(predictions_loader.requires_reference)
+    prefetcher = prefetching.ChunkPrefetcher(
+        predictions_loader, targets_loader, depth=2
+    )
+    chunks = [(np.array([i]), None) for i in range(5)]
+    results = list(prefetcher.iterate(enumerate(chunks)))
+    prefetcher.close()
+    self.assertEqual([key for key, _, _ in results], list(range(5)))
+    for key, predictions, _ in results:
+      self.assertEqual(predictions['x'].item(), key)
+
+  def test_max_bytes(self):
+    prefetcher = prefetching.ChunkPrefetcher(
+        _RecordingLoader(), _RecordingLoader(), depth=3, max_bytes=1
+    )
+    chunks = [(np.array([i]), None) for i in range(8)]
+    for key, _, _ in prefetcher.iterate(enumerate(chunks)):
+      if key >= 3:
+        # Once the chunk size is known, no more chunks are prefetched.
+        self.assertEmpty(prefetcher)
+    prefetcher.close()
+
+  def test_errors_are_raised_on_pop(self):
+    class _FailingLoader(_RecordingLoader):
+
+      def _load_chunk_from_source(self, init_times, lead_times=None):
+        raise ValueError('Failed to load')
+
+    prefetcher = prefetching.ChunkPrefetcher(
+        _RecordingLoader(), _FailingLoader(), depth=1
+    )
+    with self.assertRaisesRegex(ValueError, 'Failed to load'):
+      list(prefetcher.iterate(enumerate([(np.array([0]), None)])))
+    prefetcher.close()
+
+
+class _CountingTargetsLoader(xarray_loaders.TargetsFromXarray):
+
+  def __init__(self, **kwargs):
+    super().__init__(**kwargs)
+    self.loaded_valid_times = []
+
+  def _load_chunk_from_source(self, init_times, lead_times=None):
+    self.loaded_valid_times.append(
+        time_chunks.valid_times(init_times, lead_times)
+        if lead_times is not None
+        else init_times
+    )
+    return super()._load_chunk_from_source(init_times, lead_times)
+
+
+class ValidTimeGroupedTargetsTest(parameterized.TestCase):
+
+  @parameterized.parameters(
+      {'depth': 0},
+      {'depth': 2},
+  )
+  def test_targets_equal_direct_loads(self, depth):
+    targets = test_utils.mock_target_data(
+        time_start='2020-01-01T00',
+        time_stop='2020-01-05T00',
+        time_resolution='6 hours',
+        random=True,
+    )
+    init_times = targets.time.values[:8]
+    lead_times = np.arange(0, 30, 6, dtype='timedelta64[h]')
+    times = time_chunks.TimeChunks(
+        init_times, lead_times, init_time_chunk_size=1, lead_time_chunk_size=2
+    )
+    groups = time_chunks.group_by_valid_time(times, 4)
+    direct_loader = xarray_loaders.TargetsFromXarray(ds=targets)
+    grouped_loader = _CountingTargetsLoader(ds=targets, add_nan_mask=True)
+    prefetcher = prefetching.ChunkPrefetcher(
+        _RecordingLoader(delay=0),
+        grouped_loader,
+        depth=depth,
+        grouped_targets=prefetching.ValidTimeGroupedTargets(
+            grouped_loader, times, groups
+        ),
+    )
+    ordered_chunks = [(i, times[i]) for group in groups for i in group]
+    for key, _, grouped in prefetcher.iterate(ordered_chunks):
+      direct = direct_loader.load_chunk(*times[key])
+      self.assertCountEqual(grouped, direct.keys())
+      for name in direct:
+        xr.testing.assert_identical(
+            grouped[name].drop_vars('mask'), direct[name]
+        )
+        self.assertTrue(grouped[name].mask.all())
+    prefetcher.close()
+
+    # Every valid time is loaded once per group.
+    self.assertLen(grouped_loader.loaded_valid_times, len(groups))
+    num_loaded = sum(len(v) for v in grouped_loader.loaded_valid_times)
+    self.assertEqual(
+        num_loaded,
+        sum(
+            len(
+                np.unique(
+                    np.concatenate(
+                        [time_chunks.valid_times(*times[i]) for i in group]
+                    )
+                )
+            )
+            for group in groups
+        ),
+    )
+    self.assertLess(num_loaded, len(init_times) * len(lead_times))
+
+  def test_chunks_outside_groups_are_loaded_directly(self):
+    targets = test_utils.mock_target_data(time_resolution='6 hours')
+    times = time_chunks.TimeChunks(
+        targets.time.values[:2], np.array([0, 6], dtype='timedelta64[h]')
+    )
+    loader = _CountingTargetsLoader(ds=targets)
+    grouped_targets = prefetching.ValidTimeGroupedTargets(loader, times, [])
+    chunk = grouped_targets.load(0, *times[0])
+    direct = loader.load_chunk(*times[0])
+    self.assertEqual(dict(chunk.sizes), dict(direct.sizes))
+    self.assertLen(loader.loaded_valid_times, 2)
+
+
+if __name__ == '__main__':
+  absltest.main()
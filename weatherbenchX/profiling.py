@@ -0,0 +1,169 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Timings and sizes of the stages of an evaluation.
+
+Stages are measured with `timer` and sizes recorded with `record`. Both are
+no-ops unless a Profile is active, see `collect`, so that e.g. data loaders
+used outside of a pipeline don't accumulate measurements. Each context collects
+into its own Profile, also on other threads if their work is wrapped with
+`in_active_profile`. Timers nest per thread, e.g. the compute inside a targets
+load is recorded as 'targets_load/compute_seconds'. The pipelines report the
+measurements as Beam metrics, or add them to a Profile given by the caller,
+whose `summary` gives count, total, mean, min and max per measurement.
+
+Example:
+  >>> with profiling.collect() as profile:
+  >>>   loader.load_chunk(init_times, lead_times)
+  >>> print(profile.format_summary())
+"""
+
+import collections
+import contextlib
+import contextvars
+import functools
+import threading
+import time
+from typing import Callable, Iterator, Mapping, Optional, Sequence, TypeVar
+
+
+class Profile:
+  """Thread-safe collection of measurements by name."""
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._samples = collections.defaultdict(list)
+
+  def record(self, name: str, value: float) -> None:
+    """Adds a single measurement."""
+    with self._lock:
+      self._samples[name].append(value)
+
+  def update(self, samples: Mapping[str, Sequence[float]]) -> None:
+    """Adds measurements, e.g. from `drain` in another process."""
+    with self._lock:
+      for name, values in samples.items():
+        self._samples[name].extend(values)
+
+  def drain(self) -> dict[str, list[float]]:
+    """Returns and removes all measurements."""
+    with self._lock:
+      samples, self._samples = self._samples, collections.defaultdict(list)
+    return dict(samples)
+
+  def summary(self) -> dict[str, dict[str, float]]:
+    """Count, total, mean, min and max of the measurements, by name."""
+    with self._lock:
+      samples = {name: list(values) for name, values in self._samples.items()}
+    return {
+        name: {
+            'count': len(values),
+            'total': sum(values),
+            'mean': sum(values) / len(values),
+            'min': min(values),
+            'max': max(values),
+        }
+        for name, values in sorted(samples.items())
+        if values
+    }
+
+  def format_summary(self) -> str:
+    """Summary as a table, one measurement per line."""
+    lines = [
+        f'{"name":<48} {"count":>8} {"total":>12} {"mean":>12} {"max":>12}'
+    ]
+    for name, stats in self.summary().items():
+      lines.append(
+          f'{name:<48} {stats["count"]:>8d} {stats["total"]:>12.4g}'
+          f' {stats["mean"]:>12.4g} {stats["max"]:>12.4g}'
+      )
+    return '\n'.join(lines)
+
+
+_ACTIVE_PROFILE = contextvars.ContextVar('weatherbenchX_profile', default=None)
+_scopes = threading.local()
+
+T = TypeVar('T')
+
+
+@contextlib.contextmanager
+def collect(profile: Optional[Profile] = None) -> Iterator[Profile]:
+  """Collects the measurements of this context into a Profile.
+
+  Args:
+    profile: (Optional) Profile to add the measurements to. Default: a new
+      Profile.
+
+  Yields:
+    The active Profile.
+  """
+  if profile is None:
+    profile = Profile()
+  token = _ACTIVE_PROFILE.set(profile)
+  try:
+    yield profile
+  finally:
+    _ACTIVE_PROFILE.reset(token)
+
+
+def in_active_profile(fn: Callable[..., T]) -> Callable[..., T]:
+  """Wraps fn to record into the Profile active here, e.g. on other threads."""
+  profile = _ACTIVE_PROFILE.get()
+  if profile is None:
+    return fn
+
+  @functools.wraps(fn)
+  def wrapped(*args, **kwargs):
+    with collect(profile):
+      return fn(*args, **kwargs)
+
+  return wrapped
+
+
+def _scoped_name(name: str) -> str:
+  return '/'.join(getattr(_scopes, 'stack', []) + [name])
+
+
+def record(name: str, value: float) -> None:
+  """Records a measurement, within the timers active in this thread."""
+  profile = _ACTIVE_PROFILE.get()
+  if profile is not None:
+    profile.record(_scoped_name(name), value)
+
+
+@contextlib.contextmanager
+def timer(stage: str) -> Iterator[None]:
+  """Records the duration of a stage as '<stage>_seconds'.
+
+  Measurements within the stage on the same thread are prefixed with
+  '<stage>/'.
+
+  Args:
+    stage: Name of the stage.
+
+  Yields:
+    None
+  """
+  profile = _ACTIVE_PROFILE.get()
+  if profile is None:
+    yield
+    return
+  name = _scoped_name(f'{stage}_seconds')
+  stack = getattr(_scopes, 'stack', [])
+  _scopes.stack = stack + [stage]
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    _scopes.stack = stack
+    profile.record(name, time.perf_counter() - start)
@@ -0,0 +1,111 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from concurrent import futures
+
+from absl.testing import absltest
+from weatherbenchX import profiling
+
+
+class ProfilingTest(absltest.TestCase):
+
+  def test_nested_timers(self):
+    with profiling.collect() as profile:
+      with profiling.timer('targets_load'):
+        with profiling.timer('compute'):
+          pass
+        profiling.record('bytes', 100)
+      profiling.record('bytes', 1)
+    samples = profile.drain()
+    self.assertCountEqual(
+        samples,
+        [
+            'targets_load_seconds',
+            'targets_load/compute_seconds',
+            'targets_load/bytes',
+            'bytes',
+        ],
+    )
+    self.assertEqual(samples['targets_load/bytes'], [100])
+    self.assertGreaterEqual(
+        samples['targets_load_seconds'][0],
+        samples['targets_load/compute_seconds'][0],
+    )
+    self.assertEqual(profile.drain(), {})
+
+  def test_nothing_recorded_without_profile(self):
+    with profiling.timer('targets_load'):
+      profiling.record('bytes', 100)
+    with profiling.collect() as profile:
+      pass
+    self.assertEqual(profile.drain(), {})
+
+  def test_timers_are_scoped_per_thread(self):
+    def load():
+      with profiling.timer('predictions_load'):
+        pass
+
+    with profiling.collect() as profile:
+      with profiling.timer('targets_load'):
+        with futures.ThreadPoolExecutor(1) as executor:
+          executor.submit(profiling.in_active_profile(load)).result()
+          # Not recorded without the active profile of the caller.
+          executor.submit(load).result()
+    self.assertEqual(
+        {name: len(values) for name, values in profile.drain().items()},
+        {'targets_load_seconds': 1, 'predictions_load_seconds': 1},
+    )
+
+  def test_profiles_are_scoped_per_context(self):
+    def work(stage):
+      with profiling.collect() as profile:
+        with profiling.timer(stage):
+          pass
+      return profile.drain()
+
+    with futures.ThreadPoolExecutor(2) as executor:
+      samples = list(executor.map(work, ['targets_load', 'predictions_load']))
+    self.assertCountEqual(samples[0], ['targets_load_seconds'])
+    self.assertCountEqual(samples[1], ['predictions_load_seconds'])
+
+  def test_timer_records_on_error(self):
+    with profiling.collect() as profile:
+      with self.assertRaises(ValueError):
+        with profiling.timer('compute'):
+          raise ValueError()
+      with profiling.timer('statistics'):
+        pass
+    self.assertCountEqual(
+        profile.drain(), ['compute_seconds', 'statistics_seconds']
+    )
+
+  def test_profile_summary(self):
+    profile = profiling.Profile()
+    profile.record('bytes', 1)
+    profile.update({'bytes': [2, 6], 'sum_seconds': [0.5]})
+    summary = profile.summary()
+    self.assertEqual(
+        summary['bytes'],
+        {'count': 3, 'total': 9, 'mean': 3, 'min': 1, 'max': 6},
+    )
+    self.assertEqual(summary['sum_seconds']['count'], 1)
+    self.assertIn('sum_seconds', profile.format_summary())
+    self.assertEqual(
+        profile.drain(), {'bytes': [1, 2, 6], 'sum_seconds': [0.5]}
+    )
+    self.assertEqual(profile.summary(), {})
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,207 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Read-only datasets shared by all processes on a host.
+
+Otherwise, each Beam SDK harness or multiprocessing worker holds its own copy
+of e.g. the climatology of ClimatologyFromXarray, or of metrics like
+PerVariableStatisticWithClimatology and SEEPSStatistic. Instead, use
+
+  climatology = shared_arrays.share_dataset(climatology, key='era5_1990_2019')
+
+The data variables of the returned dataset are backed by memory-mapped .npy
+files in a shared directory, by default in /dev/shm, which are written by the
+first process of each host that accesses them. All other processes of the host
+map the same files, and indexing returns views of them rather than copies.
+
+The dataset is pickled with the source of its data, so that it can be written
+on any host. The source should therefore be opened lazily, e.g. with open_zarr,
+so that only a reference to it is pickled and kept by each process, rather than
+the data.
+
+Files are never removed automatically, and persist across runs until the host
+restarts (for /dev/shm) or they are removed with `remove`, e.g. at the end of
+a pipeline or when the source data changes. On platforms without fcntl, e.g.
+Windows, datasets are not shared, and share_dataset returns them unchanged.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from typing import Optional
+
+import numpy as np
+from weatherbenchX import caching
+import xarray as xr
+from xarray.core import indexing
+
+try:
+  import fcntl  # pylint: disable=g-import-not-at-top
+except ImportError:
+  fcntl = None
+
+
+def default_directory() -> str:
+  """Directory of shared datasets, in memory (/dev/shm) if available."""
+  if os.path.isdir('/dev/shm'):
+    return '/dev/shm/weatherbenchX'
+  return os.path.join(tempfile.gettempdir(), 'weatherbenchX_shared_arrays')
+
+
+# Sources are written in slabs along their first dimension of about this size,
+# to bound the memory of the process writing them.
+_WRITE_SLAB_BYTES = 256 * 2**20
+
+# Memory maps of this process, by path, shared by all arrays using them.
+_MAPPED_ARRAYS = {}
+_MAPPED_ARRAYS_LOCK = threading.Lock()
+
+
+def _write_npy(path: str, source: xr.Variable) -> None:
+  """Writes source to path, if no other process did so already."""
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with open(f'{path}.lock', 'w') as lock_file:
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    if os.path.exists(path):
+      return
+    logging.info('Writing shared array %s', path)
+    tmp_path = f'{path}.tmp.npy'
+    array = np.lib.format.open_memmap(
+        tmp_path, mode='w+', dtype=source.dtype, shape=source.shape
+    )
+    if source.ndim == 0:
+      array[...] = source.values
+    else:
+      slab_size = max(_WRITE_SLAB_BYTES // max(source[0].nbytes, 1), 1)
+      for start in range(0, source.shape[0], slab_size):
+        array[start : start + slab_size] = source[
+            start : start + slab_size
+        ].values
+    array.flush()
+    del array
+    # Other processes only ever see complete files.
+    os.replace(tmp_path, path)
+
+
+def _map_npy(path: str) -> np.ndarray:
+  with _MAPPED_ARRAYS_LOCK:
+    if path not in _MAPPED_ARRAYS:
+      _MAPPED_ARRAYS[path] = np.load(path, mmap_mode='r')
+    return _MAPPED_ARRAYS[path]
+
+
+class _SharedArray(xr.backends.BackendArray):
+  """Lazily written and memory-mapped array of a variable."""
+
+  def __init__(self, path: str, source: xr.Variable):
+    self.path = path
+    self.shape = source.shape
+    self.dtype = source.dtype
+    self._source = source
+    self._written = False
+    self._lock = threading.Lock()
+
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    del state['_lock']
+    # Files are checked again in every process, which may be on another host.
+    state['_written'] = False
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self._lock = threading.Lock()
+
+  def _array(self) -> np.ndarray:
+    with self._lock:
+      if not self._written:
+        # The source is kept, for processes on other hosts this is sent to.
+        _write_npy(self.path, self._source)
+        self._written = True
+    return _map_npy(self.path)
+
+  def __getitem__(self, key: indexing.ExplicitIndexer) -> np.ndarray:
+    # Only basic indexing, which returns views of the memory map. Other
+    # indexing is applied to the views by xarray.
+    return indexing.explicit_indexing_adapter(
+        key,
+        self.shape,
+        indexing.IndexingSupport.BASIC,
+        lambda basic_key: self._array()[basic_key],
+    )
+
+
+def _dataset_directory(ds: xr.Dataset, key: str, directory: str) -> str:
+  """Directory of a dataset, specific to its key and structure."""
+  structure = [sorted(ds.attrs.items(), key=str)]
+  for name, data_array in ds.data_vars.items():
+    structure.append((
+        name,
+        data_array.dtype.str,
+        caching.coordinates_fingerprint(data_array, exclude=()),
+    ))
+  digest = hashlib.blake2b(repr(structure).encode(), digest_size=8).hexdigest()
+  return os.path.join(directory, f'{key}-{digest}')
+
+
+def share_dataset(
+    ds: xr.Dataset, key: str, directory: Optional[str] = None
+) -> xr.Dataset:
+  """Dataset whose data variables are shared by all processes of a host.
+
+  Args:
+    ds: Read-only dataset, preferably opened lazily, e.g. with open_zarr.
+    key: Name of the data, e.g. 'era5_climatology_1990_2019'. Datasets with the
+      same key, variables, dims, dtypes and coordinates are assumed to have the
+      same data, also across runs, as long as their files exist.
+    directory: (Optional) Directory to store the data in. Must be local to the
+      host, and is best backed by memory. Default: default_directory().
+
+  Returns:
+    Dataset with the same variables, coordinates and attributes as ds. Data
+    variables are written on first access, and never loaded into memory as a
+    whole. Coordinates are kept in memory. The files are kept after the run,
+    use `remove` to delete them. Without fcntl, ds itself.
+  """
+  if fcntl is None:
+    logging.warning('File locks are not supported, not sharing %s.', key)
+    return ds
+  if directory is None:
+    directory = default_directory()
+  dataset_directory = _dataset_directory(ds, key, directory)
+  data_vars = {}
+  for index, (name, data_array) in enumerate(ds.data_vars.items()):
+    shared = _SharedArray(
+        os.path.join(dataset_directory, f'{index}.npy'), data_array.variable
+    )
+    data_vars[name] = xr.Variable(
+        data_array.dims,
+        indexing.LazilyIndexedArray(shared),
+        attrs=data_array.attrs,
+    )
+  return xr.Dataset(data_vars, coords=ds.coords, attrs=ds.attrs)
+
+
+def remove(key: str, directory: Optional[str] = None) -> None:
+  """Removes the files of all shared datasets with the given key."""
+  if directory is None:
+    directory = default_directory()
+  if not os.path.isdir(directory):
+    return
+  for name in os.listdir(directory):
+    if name.rpartition('-')[0] == key:
+      shutil.rmtree(os.path.join(directory, name))
+
@@ -0,0 +1,106 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from concurrent import futures
+import multiprocessing
+import os
+import pickle
+from unittest import mock
+
+from absl.testing import absltest
+import numpy as np
+from weatherbenchX import shared_arrays
+from weatherbenchX import test_utils
+import xarray as xr
+
+
+def _sum_in_worker(ds: xr.Dataset) -> float:
+  return float(ds['2m_temperature'].sum())
+
+
+class SharedArraysTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.directory = self.create_tempdir().full_path
+    self.data = test_utils.mock_target_data(
+        time_start='2020-01-01', time_stop='2020-01-05', random=True, seed=0
+    )
+    self.path = self.create_tempdir('data.zarr').full_path
+    self.data.to_zarr(self.path)
+
+  def test_share_dataset(self):
+    shared = shared_arrays.share_dataset(
+        xr.open_zarr(self.path), 'data', self.directory
+    )
+    # Nothing is written before the data is accessed.
+    self.assertEmpty(os.listdir(self.directory))
+    xr.testing.assert_identical(shared.compute(), self.data.compute())
+    selected = shared.sel(time=self.data.time[1:3], level=500).compute()
+    xr.testing.assert_identical(
+        selected, self.data.sel(time=self.data.time[1:3], level=500)
+    )
+    # Views of the read-only memory maps.
+    values = shared['geopotential'].values
+    self.assertFalse(values.flags.writeable)
+    self.assertIsInstance(values.base, np.memmap)
+    (dataset_directory,) = os.listdir(self.directory)
+    self.assertLen(
+        [
+            name
+            for name in os.listdir(
+                os.path.join(self.directory, dataset_directory)
+            )
+            if name.endswith('.npy')
+        ],
+        len(self.data.data_vars),
+    )
+
+  def test_files_are_reused_by_key_and_structure(self):
+    shared_arrays.share_dataset(self.data, 'data', self.directory).compute()
+    # The same key and structure is assumed to be the same data.
+    shared = shared_arrays.share_dataset(self.data + 1, 'data', self.directory)
+    xr.testing.assert_identical(shared.compute(), self.data)
+    # A different structure is stored separately.
+    subset = self.data.isel(time=slice(2))
+    shared = shared_arrays.share_dataset(subset + 1, 'data', self.directory)
+    xr.testing.assert_identical(shared.compute(), subset + 1)
+    self.assertLen(os.listdir(self.directory), 2)
+
+    shared_arrays.remove('data', self.directory)
+    self.assertEmpty(os.listdir(self.directory))
+
+  def test_pickled_to_processes(self):
+    shared = shared_arrays.share_dataset(
+        xr.open_zarr(self.path), 'data', self.directory
+    )
+    # Only a reference to the lazily opened source is pickled.
+    self.assertLess(len(pickle.dumps(shared)), self.data.nbytes)
+    with futures.ProcessPoolExecutor(
+        max_workers=2, mp_context=multiprocessing.get_context('spawn')
+    ) as executor:
+      sums = list(executor.map(_sum_in_worker, [shared] * 4))
+    expected = float(self.data['2m_temperature'].sum())
+    for total in sums:
+      self.assertAlmostEqual(total, expected, places=2)
+
+  def test_not_shared_without_file_locks(self):
+    with mock.patch.object(shared_arrays, 'fcntl', None):
+      shared = shared_arrays.share_dataset(self.data, 'data', self.directory)
+    self.assertIs(shared, self.data)
+    self.assertEmpty(os.listdir(self.directory))
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -16,18 +16,117 @@
 Chunks can be defined in init_time and lead_time dimensions.
 """
 
-from collections.abc import Iterable, Iterator
-import itertools
-from typing import Optional, Tuple, Union
+from collections.abc import Iterator, Sequence
+import math
+from typing import Optional, Tuple, Union, overload
 import numpy as np
+import xarray as xr
 
 
 # Tuple of (init_times, lead_times).
 TimeChunk = Tuple[np.ndarray, Union[np.ndarray, slice]]
 
+# Dimensions of (renamed) predictions and targets along which chunks are
+# selected.
+_TIME_DIMS = ('init_time', 'lead_time', 'valid_time')
 
-class TimeChunks(Iterable[TimeChunk]):
-  """Iterable defining chunks in init and lead time."""
+
+def _storage_chunk_boundaries(ds: xr.Dataset, dim: str) -> Optional[np.ndarray]:
+  """End positions of the storage chunks of `ds` along `dim`, if chunked.
+
+  Dask chunks are used if the dataset is opened lazily, e.g. with open_zarr,
+  since they are aligned with the storage chunks, also after selecting a
+  subset. Otherwise, the chunks in the encoding are used.
+
+  Args:
+    ds: Dataset.
+    dim: Dimension.
+
+  Returns:
+    Cumulative chunk sizes along `dim`, or None if no variable is chunked
+    along it.
+  """
+  for data_array in ds.data_vars.values():
+    if dim not in data_array.dims:
+      continue
+    if data_array.chunks is not None:
+      return np.cumsum(data_array.chunksizes[dim])
+    chunk_size = data_array.encoding.get('preferred_chunks', {}).get(dim)
+    if chunk_size is not None:
+      return np.arange(chunk_size, ds.sizes[dim] + chunk_size, chunk_size)
+  return None
+
+
+def _split_at_storage_chunks(
+    values: np.ndarray, datasets: Sequence[xr.Dataset], dims: Sequence[str]
+) -> list[np.ndarray]:
+  """Splits values where the storage chunk along any of `dims` changes."""
+  split = np.zeros(len(values), dtype=bool)
+  for ds in datasets:
+    for dim in dims:
+      if dim not in ds.indexes:
+        continue
+      boundaries = _storage_chunk_boundaries(ds, dim)
+      if boundaries is None:
+        continue
+      positions = ds.indexes[dim].get_indexer(values)
+      chunk_ids = np.searchsorted(boundaries, positions, side='right')
+      split[1:] |= chunk_ids[1:] != chunk_ids[:-1]
+  return np.split(values, np.flatnonzero(split))
+
+
+def _bytes_per_time(ds: xr.Dataset) -> int:
+  """Size of the data of a single init and lead (or valid) time."""
+  return sum(
+      data_array.dtype.itemsize
+      * math.prod(
+          size
+          for dim, size in data_array.sizes.items()
+          if dim not in _TIME_DIMS
+      )
+      for data_array in ds.data_vars.values()
+  )
+
+
+def _chunk_bounds(num_times: int, chunk_size: Optional[int]) -> np.ndarray:
+  """Start of every chunk of chunk_size, and the end of the last one."""
+  # If chunk size is None, return all elements in a single chunk.
+  if not chunk_size:
+    chunk_size = max(num_times, 1)
+  return np.append(np.arange(0, num_times, chunk_size), num_times)
+
+
+def _chunk_bounds_from_sizes(chunk_sizes: Sequence[int]) -> np.ndarray:
+  return np.cumsum([0] + list(chunk_sizes))
+
+
+def _shard(indices: range, index: int, count: int) -> range:
+  if not 0 <= index < count:
+    raise ValueError(f'Shard {index=} should be in [0, {count=}).')
+  return indices[
+      len(indices) * index // count : len(indices) * (index + 1) // count
+  ]
+
+
+def _merge_consecutive(
+    chunks: Sequence[np.ndarray], max_size: int
+) -> list[np.ndarray]:
+  """Concatenates consecutive chunks up to max_size, keeping larger ones."""
+  merged = []
+  for chunk in chunks:
+    if merged and len(merged[-1]) + len(chunk) <= max_size:
+      merged[-1] = np.concatenate([merged[-1], chunk])
+    else:
+      merged.append(chunk)
+  return merged
+
+
+class TimeChunks(Sequence[TimeChunk]):
+  """Sequence defining chunks in init and lead time.
+
+  Chunks are computed on access, so any chunk can be accessed by its index,
+  e.g. times[k], and slices and shards of the chunks are cheap to create.
+  """
 
   def __init__(
       self,
@@ -111,16 +210,12 @@ class TimeChunks(Iterable[TimeChunk]):
           f'{lead_time_chunk_size=} but should be non-negative or None'
       )
 
-    init_times = init_times.astype('datetime64[ns]')
-
-    # If chunk size is None, return all elements in a single chunk.
-    if not init_time_chunk_size:
-      init_time_chunk_size = len(init_times)
-    # Split init_times into chunks
-    self._init_time_chunks = [
-        init_times[i : i + init_time_chunk_size]
-        for i in range(0, len(init_times), init_time_chunk_size)
-    ]
+    # Chunks are only stored as bounds into the arrays of all times, and
+    # sliced out on access.
+    self._init_times = init_times.astype('datetime64[ns]')
+    self._init_time_bounds = _chunk_bounds(
+        len(self._init_times), init_time_chunk_size
+    )
 
     if isinstance(lead_times, slice):
       # Enforce slice start and stop to be specified and step be None.
@@ -131,21 +226,409 @@ class TimeChunks(Iterable[TimeChunk]):
 
       if lead_time_chunk_size:
         raise ValueError('Chunking in lead time not compatible for slice.')
-      self._lead_time_chunks = [lead_times]
+      self._lead_times = lead_times
+      self._lead_time_bounds = None
     elif isinstance(lead_times, np.ndarray):
-      lead_times = lead_times.astype('timedelta64[ns]')
-      if not lead_time_chunk_size:
-        lead_time_chunk_size = len(lead_times)
-      # Split lead_times into chunks
-      self._lead_time_chunks = [
-          lead_times[i : i + lead_time_chunk_size]
-          for i in range(0, len(lead_times), lead_time_chunk_size)
-      ]
+      self._lead_times = lead_times.astype('timedelta64[ns]')
+      self._lead_time_bounds = _chunk_bounds(
+          len(self._lead_times), lead_time_chunk_size
+      )
     else:
       raise ValueError('Lead times must be either np.ndarray or slice.')
 
+  @classmethod
+  def aligned_to_storage(
+      cls,
+      init_times: np.ndarray,
+      lead_times: Union[np.ndarray, slice],
+      datasets: Sequence[xr.Dataset],
+      memory_budget_bytes: int,
+  ) -> 'TimeChunks':
+    """TimeChunks whose boundaries align with the storage chunks of datasets.
+
+    Init and lead times are first split wherever the storage chunk of any
+    dataset changes, so that no storage chunk is read by several chunks of the
+    same lead (or init) times. Consecutive pieces are then merged, as long as
+    the data of a chunk stays within the memory budget. Lead times are merged
+    first, since they are typically stored in a single chunk.
+
+    Datasets are matched by dimension name, as returned by the data loaders,
+    e.g. XarrayDataLoader.dataset. Boundaries are aligned along init_time and
+    lead_time, typically of predictions. The valid times of targets, which are
+    init plus lead times, generally can't be aligned, so target datasets only
+    count towards the memory budget. Dimensions which aren't chunked are
+    ignored.
+
+    Args:
+      init_times: Numpy array of init_times (dtype: np.datetime64).
+      lead_times: Array of exact lead times, or a slice of lead times, which is
+        always a single chunk, as in TimeChunks.
+      datasets: Datasets which chunks are loaded from, e.g. predictions and
+        targets.
+      memory_budget_bytes: Maximum size of the data of all datasets for a
+        chunk. Single pieces which exceed it aren't split further.
+
+    Returns:
+      TimeChunks, iterated over in the same order as for fixed chunk sizes.
+    """
+    times = cls(init_times, lead_times)
+    init_times = times._init_times
+    bytes_per_time = max(sum(_bytes_per_time(ds) for ds in datasets), 1)
+    max_times = max(memory_budget_bytes // bytes_per_time, 1)
+
+    init_pieces = _split_at_storage_chunks(init_times, datasets, ('init_time',))
+    largest_init_piece = max(len(p) for p in init_pieces)
+    if isinstance(lead_times, slice):
+      # Number of stored lead times within the (inclusive) slice.
+      num_lead_times = max(
+          (
+              int(
+                  np.sum(
+                      (ds.indexes['lead_time'] >= lead_times.start)
+                      & (ds.indexes['lead_time'] <= lead_times.stop)
+                  )
+              )
+              for ds in datasets
+              if 'lead_time' in ds.indexes
+          ),
+          default=1,
+      )
+    else:
+      lead_time_chunks = _merge_consecutive(
+          _split_at_storage_chunks(
+              times._lead_times, datasets, ('lead_time',)
+          ),
+          max(max_times // largest_init_piece, 1),
+      )
+      num_lead_times = max(len(c) for c in lead_time_chunks)
+      times._lead_time_bounds = _chunk_bounds_from_sizes(
+          [len(c) for c in lead_time_chunks]
+      )
+    init_time_chunks = _merge_consecutive(
+        init_pieces, max(max_times // num_lead_times, 1)
+    )
+    times._init_time_bounds = _chunk_bounds_from_sizes(
+        [len(c) for c in init_time_chunks]
+    )
+    return times
+
+  @property
+  def num_init_time_chunks(self) -> int:
+    return len(self._init_time_bounds) - 1
+
+  @property
+  def num_lead_time_chunks(self) -> int:
+    if self._lead_time_bounds is None:
+      return 1
+    return len(self._lead_time_bounds) - 1
+
+  def init_time_chunk(self, index: int) -> np.ndarray:
+    """The init times of the index-th chunk of init times."""
+    return self._init_times[
+        self._init_time_bounds[index] : self._init_time_bounds[index + 1]
+    ]
+
+  def lead_time_chunk(self, index: int) -> Union[np.ndarray, slice]:
+    """The lead times of the index-th chunk of lead times."""
+    if self._lead_time_bounds is None:
+      return self._lead_times
+    return self._lead_times[
+        self._lead_time_bounds[index] : self._lead_time_bounds[index + 1]
+    ]
+
+  @property
+  def init_time_chunks(self) -> list[np.ndarray]:
+    """Chunks of init times, in the order they are iterated over."""
+    return [self.init_time_chunk(i) for i in range(self.num_init_time_chunks)]
+
+  @property
+  def lead_time_chunks(self) -> list[Union[np.ndarray, slice]]:
+    """Chunks of lead times, iterated over for each chunk of init times."""
+    return [self.lead_time_chunk(i) for i in range(self.num_lead_time_chunks)]
+
+  def __len__(self) -> int:
+    return self.num_init_time_chunks * self.num_lead_time_chunks
+
+  @overload
+  def __getitem__(self, key: int) -> TimeChunk:
+    ...
+
+  @overload
+  def __getitem__(self, key: slice) -> 'TimeChunksSubset':
+    ...
+
+  def __getitem__(
+      self, key: Union[int, slice]
+  ) -> Union[TimeChunk, 'TimeChunksSubset']:
+    """The chunk with the given index, or a subset of chunks for a slice.
+
+    Chunks are computed from their index, without iterating over the chunks
+    before them.
+
+    Args:
+      key: Index of the chunk, in iteration order, or a slice of indices.
+
+    Returns:
+      (init_times, lead_times), or TimeChunksSubset for a slice.
+    """
+    if isinstance(key, slice):
+      return TimeChunksSubset(self, range(len(self))[key])
+    index = range(len(self))[key]  # Handles negative indices and IndexErrors.
+    init_index, lead_index = divmod(index, self.num_lead_time_chunks)
+    return self.init_time_chunk(init_index), self.lead_time_chunk(lead_index)
+
   def __iter__(self) -> Iterator[TimeChunk]:
-    return itertools.product(self._init_time_chunks, self._lead_time_chunks)
+    return map(self.__getitem__, range(len(self)))
+
+  def shard(self, index: int, count: int) -> 'TimeChunksSubset':
+    """The index-th of `count` contiguous, equally sized subsets of chunks.
+
+    Contiguous subsets keep neighboring chunks, which often share storage
+    chunks, together.
+
+    Args:
+      index: Index of the shard, in [0, count).
+      count: Number of shards.
+
+    Returns:
+      TimeChunksSubset, whose `indices` are the indices of its chunks in self.
+    """
+    return TimeChunksSubset(self, _shard(range(len(self)), index, count))
+
+
+class TimeChunksSubset(Sequence[TimeChunk]):
+  """A range of the chunks of TimeChunks, e.g. a slice or a shard.
+
+  Chunks are computed on access, from the TimeChunks they belong to. Their
+  indices in the TimeChunks, e.g. for checkpoints, are given by `indices`:
+
+    for chunk_index, (init_times, lead_times) in zip(
+        subset.indices, subset
+    ):
+      ...
+  """
+
+  def __init__(self, time_chunks: TimeChunks, indices: range):
+    self._time_chunks = time_chunks
+    self._indices = indices
+
+  @property
+  def indices(self) -> range:
+    """Indices of the chunks of this subset in the TimeChunks."""
+    return self._indices
 
   def __len__(self) -> int:
-    return len(self._init_time_chunks) * len(self._lead_time_chunks)
+    return len(self._indices)
+
+  @overload
+  def __getitem__(self, key: int) -> TimeChunk:
+    ...
+
+  @overload
+  def __getitem__(self, key: slice) -> 'TimeChunksSubset':
+    ...
+
+  def __getitem__(
+      self, key: Union[int, slice]
+  ) -> Union[TimeChunk, 'TimeChunksSubset']:
+    if isinstance(key, slice):
+      return TimeChunksSubset(self._time_chunks, self._indices[key])
+    return self._time_chunks[self._indices[key]]
+
+  def shard(self, index: int, count: int) -> 'TimeChunksSubset':
+    """The index-th of `count` contiguous, equally sized subsets of chunks."""
+    return TimeChunksSubset(
+        self._time_chunks, _shard(self._indices, index, count)
+    )
+
+
+def _split_points(costs: np.ndarray, max_cost: float) -> list[int]:
+  """Starts of contiguous groups of rows, with column sums up to max_cost."""
+  starts = [0]
+  group_cost = np.zeros(costs.shape[1])
+  for i, row in enumerate(costs):
+    if i > starts[-1] and np.any(group_cost + row > max_cost):
+      starts.append(i)
+      group_cost = row.copy()
+    else:
+      group_cost += row
+  return starts
+
+
+class CostBalancedTimeChunks(TimeChunks):
+  """TimeChunks whose init time chunks have (roughly) equal cost.
+
+  Instead of a fixed number of init times per chunk, init times are split into
+  contiguous chunks such that the largest cost of any chunk, i.e. the summed
+  cost of its init and lead times, is as small as possible. This evens out the
+  work per chunk, e.g. for sparse observations whose number varies a lot
+  between times, and thereby avoids stragglers.
+
+  Chunks are still products of init time and lead time chunks, iterated over in
+  the same order as TimeChunks, e.g. for define_pipeline. Not for
+  define_time_series_pipeline, whose blocks must all have the same number of
+  init times.
+
+  Example:
+    >>> times = time_chunks.CostBalancedTimeChunks(
+    >>>     init_times,
+    >>>     slice(np.timedelta64(0), np.timedelta64(6, 'h')),
+    >>>     costs=number_of_observations_per_init_time,
+    >>>     num_init_time_chunks=100,
+    >>> )
+  """
+
+  def __init__(
+      self,
+      init_times: np.ndarray,
+      lead_times: Union[np.ndarray, slice],
+      costs: np.ndarray,
+      max_chunk_cost: Optional[float] = None,
+      num_init_time_chunks: Optional[int] = None,
+      lead_time_chunk_size: Optional[int] = None,
+  ):
+    """Init.
+
+    Args:
+      init_times: Numpy array of init_times (dtype: np.datetime64).
+      lead_times: Array of exact lead times, or a slice of lead times, as in
+        TimeChunks.
+      costs: Non-negative estimates of the work per init and lead time, e.g.
+        number of observations or bytes to read. Shape (len(init_times),
+        len(lead_times)) for exact lead times, or (len(init_times),) for a cost
+        per init time, which then applies to each lead time, or to the whole
+        slice.
+      max_chunk_cost: Maximum cost of a chunk. Chunks of a single init time can
+        exceed it. Exactly one of max_chunk_cost and num_init_time_chunks must
+        be given.
+      num_init_time_chunks: Maximum number of init time chunks. The largest
+        chunk cost is minimized, which can require fewer chunks, e.g. if a
+        single init time dominates the cost.
+      lead_time_chunk_size: Chunk size in lead_time dimension, as in
+        TimeChunks.
+    """
+    super().__init__(
+        init_times, lead_times, lead_time_chunk_size=lead_time_chunk_size
+    )
+    if (max_chunk_cost is None) == (num_init_time_chunks is None):
+      raise ValueError(
+          'Exactly one of max_chunk_cost and num_init_time_chunks must be'
+          ' given.'
+      )
+    if num_init_time_chunks is not None and num_init_time_chunks < 1:
+      raise ValueError(f'{num_init_time_chunks=} but should be positive.')
+
+    init_times = init_times.astype('datetime64[ns]')
+    if isinstance(lead_times, slice):
+      num_lead_times = 1
+      lead_time_chunk_starts = [0]
+    else:
+      num_lead_times = len(lead_times)
+      lead_time_chunk_starts = np.cumsum(
+          [0] + [len(c) for c in self.lead_time_chunks[:-1]]
+      )
+    costs = np.asarray(costs, dtype=np.float64)
+    if costs.ndim == 1:
+      costs = np.repeat(costs[:, np.newaxis], num_lead_times, axis=1)
+    if costs.shape != (len(init_times), num_lead_times):
+      raise ValueError(
+          f'costs has shape {costs.shape}, but should be'
+          f' ({len(init_times)}, {num_lead_times}) or ({len(init_times)},).'
+      )
+    if not np.all(np.isfinite(costs)) or np.any(costs < 0):
+      raise ValueError('costs must be finite and non-negative.')
+    # Cost of each init time for each lead time chunk.
+    costs = np.add.reduceat(costs, lead_time_chunk_starts, axis=1)
+
+    if num_init_time_chunks is not None:
+      # Bisection for the smallest max_chunk_cost which results in at most
+      # num_init_time_chunks chunks.
+      low, high = costs.max(initial=0), costs.sum(axis=0).max(initial=0)
+      while high - low > 1e-9 * high:
+        middle = (low + high) / 2
+        if len(_split_points(costs, middle)) <= num_init_time_chunks:
+          high = middle
+        else:
+          low = middle
+      max_chunk_cost = high
+
+    starts = _split_points(costs, max_chunk_cost)
+    stops = starts[1:] + [len(init_times)]
+    self._init_time_bounds = np.array(starts + [len(init_times)])
+    # Cost of each chunk, by init time chunk and lead time chunk.
+    self._chunk_costs = np.stack(
+        [costs[start:stop].sum(axis=0) for start, stop in zip(starts, stops)]
+    )
+
+  @property
+  def chunk_costs(self) -> list[float]:
+    """Estimated cost of each chunk, in iteration order."""
+    return self._chunk_costs.ravel().tolist()
+
+
+def valid_times(
+    init_times: np.ndarray, lead_times: Union[np.ndarray, slice]
+) -> np.ndarray:
+  """Sorted unique valid times of a chunk with exact lead times."""
+  if isinstance(lead_times, slice):
+    raise ValueError('Valid times require exact lead times, not a slice.')
+  return np.unique(
+      init_times.astype('datetime64[ns]')[:, np.newaxis]
+      + lead_times.astype('timedelta64[ns]')[np.newaxis, :]
+  )
+
+
+def group_by_valid_time(
+    times: Sequence[TimeChunk], max_valid_times_per_group: int
+) -> list[list[int]]:
+  """Groups chunks which need the same valid times, e.g. of targets.
+
+  Chunks of different init and lead times often have valid times in common,
+  e.g. for 10-day forecasts initialized every 6 hours, each valid time is part
+  of up to 40 chunks. Chunks are ordered by their earliest valid time, and
+  consecutive chunks are grouped as long as the group has at most
+  max_valid_times_per_group distinct valid times. Loading the targets of a group
+  at once, see prefetching.ValidTimeGroupedTargets, then reads every valid time
+  of the group once.
+
+  Args:
+    times: TimeChunks instance with exact lead times, or any sequence of
+      (init_times, lead_times).
+    max_valid_times_per_group: Maximum number of distinct valid times of a
+      group, which bounds the size of the targets loaded for it. Chunks with
+      more valid times form a group of their own.
+
+  Returns:
+    Groups of chunk indices into `times`, which together contain every chunk
+    once. Groups, and chunks within a group, are ordered by earliest valid
+    time.
+  """
+  if max_valid_times_per_group < 1:
+    raise ValueError(f'{max_valid_times_per_group=} but should be positive.')
+  chunk_valid_times = [
+      valid_times(init_times, lead_times).view(np.int64)
+      for init_times, lead_times in times
+  ]
+  # Stable, so chunks with the same earliest valid time keep their order.
+  order = sorted(
+      range(len(chunk_valid_times)),
+      key=lambda index: (
+          chunk_valid_times[index][0] if chunk_valid_times[index].size else 0
+      ),
+  )
+  groups = []
+  group_valid_times = set()
+  for index in order:
+    new_valid_times = set(chunk_valid_times[index].tolist())
+    new_valid_times -= group_valid_times
+    if (
+        groups
+        and len(group_valid_times) + len(new_valid_times)
+        <= max_valid_times_per_group
+    ):
+      groups[-1].append(index)
+      group_valid_times |= new_valid_times
+    else:
+      groups.append([index])
+      group_valid_times = set(chunk_valid_times[index].tolist())
+  return groups
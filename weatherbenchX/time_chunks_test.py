@@ -15,6 +15,7 @@
 from absl.testing import absltest
 import numpy as np
 from weatherbenchX import time_chunks
+import xarray as xr
 
 
 class TimeChunksTest(absltest.TestCase):
@@ -45,6 +46,16 @@ class TimeChunksTest(absltest.TestCase):
         lead_time_chunk_size=2,
     )
     self.assertLen(list(times), 4)
+    self.assertLen(times.init_time_chunks, 2)
+    self.assertLen(times.lead_time_chunks, 2)
+    # Lead time chunks are iterated over for each init time chunk.
+    for i, (init_time_chunk, lead_time_chunk) in enumerate(times):
+      np.testing.assert_array_equal(
+          init_time_chunk, times.init_time_chunks[i // 2]
+      )
+      np.testing.assert_array_equal(
+          lead_time_chunk, times.lead_time_chunks[i % 2]
+      )
 
     # Case #2: Lead time interval
     lead_times = slice(np.timedelta64(0, 'h'), np.timedelta64(6, 'h'))
@@ -56,6 +67,266 @@ class TimeChunksTest(absltest.TestCase):
     )
     self.assertLen(list(times), 2)
 
+  def test_random_access(self):
+    init_times = np.arange(
+        '2020-01-01T00',
+        '2020-01-03T00',
+        np.timedelta64(6, 'h'),
+        dtype='datetime64[ns]',
+    )
+    lead_times = np.arange(0, 30, 6, dtype='timedelta64[h]')
+    times = time_chunks.TimeChunks(
+        init_times,
+        lead_times,
+        init_time_chunk_size=3,
+        lead_time_chunk_size=2,
+    )
+    chunks = list(times)
+    self.assertLen(chunks, 9)
+    self.assertEqual(times.num_init_time_chunks, 3)
+    self.assertEqual(times.num_lead_time_chunks, 3)
+
+    def assert_chunks_equal(actual, expected):
+      self.assertLen(actual, len(expected))
+      for (init_a, lead_a), (init_e, lead_e) in zip(actual, expected):
+        np.testing.assert_array_equal(init_a, init_e)
+        np.testing.assert_array_equal(lead_a, lead_e)
+
+    assert_chunks_equal([times[i] for i in range(len(times))], chunks)
+    assert_chunks_equal([times[-1]], chunks[-1:])
+    with self.assertRaises(IndexError):
+      _ = times[9]
+
+    subset = times[2:8:2]
+    self.assertEqual(subset.indices, range(2, 8, 2))
+    assert_chunks_equal(list(subset), chunks[2:8:2])
+    assert_chunks_equal(list(subset[1:]), chunks[4:8:2])
+
+    shards = [times.shard(i, 4) for i in range(4)]
+    self.assertEqual([len(s) for s in shards], [2, 2, 2, 3])
+    self.assertEqual(
+        [i for s in shards for i in s.indices], list(range(len(times)))
+    )
+    assert_chunks_equal([c for s in shards for c in s], chunks)
+    self.assertEqual(shards[3].shard(1, 2).indices, range(7, 9))
+    with self.assertRaisesRegex(ValueError, 'Shard'):
+      times.shard(4, 4)
+
+  def test_group_by_valid_time(self):
+    init_times = np.arange(
+        '2020-01-01T00',
+        '2020-01-03T00',
+        np.timedelta64(6, 'h'),
+        dtype='datetime64[ns]',
+    )
+    lead_times = np.arange(0, 30, 6, dtype='timedelta64[h]')
+    times = time_chunks.TimeChunks(
+        init_times, lead_times, init_time_chunk_size=1, lead_time_chunk_size=1
+    )
+    groups = time_chunks.group_by_valid_time(times, 3)
+    self.assertCountEqual(
+        [i for group in groups for i in group], range(len(times))
+    )
+    for group in groups:
+      group_valid_times = np.unique(
+          np.concatenate([time_chunks.valid_times(*times[i]) for i in group])
+      )
+      self.assertLessEqual(len(group_valid_times), 3)
+    # Each chunk has a single valid time, shared by up to 5 chunks, so the
+    # 40 chunks have 12 valid times, and each group has 3 of them.
+    self.assertLen(groups, 4)
+    # Chunks with the same valid time are in the same group.
+    self.assertCountEqual(groups[0], [0, 1, 5, 2, 6, 10])
+
+    # Chunks with too many valid times form a group of their own.
+    times = time_chunks.TimeChunks(init_times, lead_times)
+    self.assertEqual(time_chunks.group_by_valid_time(times, 3), [[0]])
+    with self.assertRaisesRegex(ValueError, 'exact lead times'):
+      time_chunks.group_by_valid_time(
+          time_chunks.TimeChunks(init_times, slice(*lead_times[[0, -1]])), 3
+      )
+
+
+class CostBalancedTimeChunksTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.init_times = np.arange(
+        '2020-01-01T00',
+        '2020-01-03T00',
+        np.timedelta64(6, 'h'),
+        dtype='datetime64[ns]',
+    )
+    self.lead_times = slice(np.timedelta64(0, 'h'), np.timedelta64(6, 'h'))
+
+  def test_num_init_time_chunks(self):
+    costs = np.array([4, 1, 1, 1, 1, 1, 1, 4])
+    times = time_chunks.CostBalancedTimeChunks(
+        self.init_times, self.lead_times, costs, num_init_time_chunks=3
+    )
+    self.assertLen(times, 3)
+    self.assertEqual(times.chunk_costs, [5, 5, 4])
+    np.testing.assert_array_equal(
+        np.concatenate([init_times for init_times, _ in times]),
+        self.init_times,
+    )
+    for _, lead_times in times:
+      self.assertEqual(lead_times, self.lead_times)
+
+  def test_max_chunk_cost(self):
+    costs = np.array([10, 1, 1, 1, 1, 1, 1, 4])
+    times = time_chunks.CostBalancedTimeChunks(
+        self.init_times, self.lead_times, costs, max_chunk_cost=5
+    )
+    # A single init time can exceed the maximum.
+    self.assertEqual(times.chunk_costs, [10, 5, 5])
+    self.assertEqual([len(c) for c in times.init_time_chunks], [1, 5, 2])
+
+  def test_uniform_costs_match_time_chunks(self):
+    lead_times = np.arange(0, 18, 6, dtype='timedelta64[h]')
+    times = time_chunks.CostBalancedTimeChunks(
+        self.init_times,
+        lead_times,
+        np.ones((len(self.init_times), len(lead_times))),
+        num_init_time_chunks=4,
+        lead_time_chunk_size=2,
+    )
+    expected = time_chunks.TimeChunks(
+        self.init_times,
+        lead_times,
+        init_time_chunk_size=2,
+        lead_time_chunk_size=2,
+    )
+    self.assertLen(times, len(expected))
+    for (init_times, lead_times), (
+        expected_init_times,
+        expected_lead_times,
+    ) in zip(times, expected):
+      np.testing.assert_array_equal(init_times, expected_init_times)
+      np.testing.assert_array_equal(lead_times, expected_lead_times)
+    self.assertEqual(times.chunk_costs, [4, 2] * 4)
+
+  def test_costs_per_lead_time_chunk(self):
+    lead_times = np.arange(0, 12, 6, dtype='timedelta64[h]')
+    costs = np.zeros((len(self.init_times), 2))
+    # The first init times are expensive for the first lead time only.
+    costs[:4, 0] = 3
+    costs[4:, 1] = 1
+    times = time_chunks.CostBalancedTimeChunks(
+        self.init_times,
+        lead_times,
+        costs,
+        max_chunk_cost=6,
+        lead_time_chunk_size=1,
+    )
+    # Costs of different lead time chunks don't add up.
+    self.assertEqual([len(c) for c in times.init_time_chunks], [2, 6])
+    self.assertEqual(times.chunk_costs, [6, 0, 6, 4])
+
+  def test_invalid_arguments(self):
+    costs = np.ones(len(self.init_times))
+    with self.assertRaisesRegex(ValueError, 'Exactly one'):
+      time_chunks.CostBalancedTimeChunks(
+          self.init_times, self.lead_times, costs
+      )
+    with self.assertRaisesRegex(ValueError, 'shape'):
+      time_chunks.CostBalancedTimeChunks(
+          self.init_times, self.lead_times, costs[1:], max_chunk_cost=1
+      )
+    with self.assertRaisesRegex(ValueError, 'non-negative'):
+      time_chunks.CostBalancedTimeChunks(
+          self.init_times, self.lead_times, -costs, max_chunk_cost=1
+      )
+
+
+
+class AlignedToStorageTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    init_times = np.arange(
+        '2020-01-01',
+        '2020-01-11',
+        np.timedelta64(1, 'D'),
+        dtype='datetime64[ns]',
+    )
+    lead_times = np.arange(0, 54, 6, dtype='timedelta64[h]').astype(
+        'timedelta64[ns]'
+    )
+    # 8 bytes per init and lead time.
+    self.predictions = xr.Dataset(
+        {'x': (('init_time', 'lead_time'), np.zeros((10, 9)))},
+        coords={'init_time': init_times, 'lead_time': lead_times},
+    ).chunk({'init_time': 3, 'lead_time': 4})
+    # 4 bytes per valid time.
+    self.targets = xr.Dataset(
+        {'y': (('valid_time',), np.zeros(20, dtype=np.float32))},
+        coords={
+            'valid_time': np.arange(
+                '2020-01-01',
+                '2020-01-21',
+                np.timedelta64(1, 'D'),
+                dtype='datetime64[ns]',
+            )
+        },
+    ).chunk({'valid_time': 4})
+
+  def _chunk_sizes(self, times):
+    return (
+        [len(c) for c in times.init_time_chunks],
+        [len(c) for c in times.lead_time_chunks],
+    )
+
+  def test_split_at_storage_chunks(self):
+    # A subset of init times, offset from the storage chunks.
+    init_times = self.predictions.init_time.values[1:]
+    lead_times = self.predictions.lead_time.values
+    times = time_chunks.TimeChunks.aligned_to_storage(
+        init_times, lead_times, [self.predictions, self.targets], 1
+    )
+    self.assertEqual(self._chunk_sizes(times), ([2, 3, 3, 1], [4, 4, 1]))
+    np.testing.assert_array_equal(
+        np.concatenate(times.init_time_chunks), init_times
+    )
+    np.testing.assert_array_equal(
+        np.concatenate(times.lead_time_chunks), lead_times
+    )
+
+  def test_merge_within_memory_budget(self):
+    init_times = self.predictions.init_time.values
+    lead_times = self.predictions.lead_time.values
+    # 12 bytes per init and lead time, so up to 54 times per chunk: all lead
+    # times, and 6 init times.
+    times = time_chunks.TimeChunks.aligned_to_storage(
+        init_times, lead_times, [self.predictions, self.targets], 12 * 54
+    )
+    self.assertEqual(self._chunk_sizes(times), ([6, 4], [9]))
+    times = time_chunks.TimeChunks.aligned_to_storage(
+        init_times, lead_times, [self.predictions, self.targets], 10**9
+    )
+    self.assertEqual(self._chunk_sizes(times), ([10], [9]))
+
+  def test_lead_time_slice(self):
+    init_times = self.predictions.init_time.values
+    lead_times = slice(np.timedelta64(0, 'h'), np.timedelta64(12, 'h'))
+    # 3 lead times in the slice.
+    times = time_chunks.TimeChunks.aligned_to_storage(
+        init_times, lead_times, [self.predictions], 8 * 3 * 6
+    )
+    self.assertEqual([len(c) for c in times.init_time_chunks], [6, 4])
+    self.assertEqual(times.lead_time_chunks, [lead_times])
+
+  def test_encoding_chunks(self):
+    predictions = self.predictions.compute()
+    predictions.x.encoding['preferred_chunks'] = {'init_time': 5}
+    times = time_chunks.TimeChunks.aligned_to_storage(
+        predictions.init_time.values,
+        predictions.lead_time.values,
+        [predictions],
+        1,
+    )
+    self.assertEqual(self._chunk_sizes(times), ([5, 5], [9]))
+
 
 if __name__ == '__main__':
   absltest.main()
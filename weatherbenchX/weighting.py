@@ -31,7 +31,8 @@ class Weighting(abc.ABC):
     """Return weights for a given statistic.
 
     For now the implementation assumes that all information necessary to
-    calculate the weights is contained in the statistic.
+    calculate the weights is contained in the coordinates of the statistic.
+    Weights may be reused for other statistics with the same coordinates.
 
     Args:
       statistic: Individual DataArray with statistic values.
@@ -0,0 +1,95 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Writers for metrics Datasets.
+
+Metrics are written to files, rather than serialized into memory first, so that
+writing them takes little memory beyond the metrics themselves.
+"""
+
+import os
+import posixpath
+import tempfile
+from typing import Any, Optional
+
+import fsspec
+from fsspec.implementations import local as local_fs
+import xarray as xr
+
+
+# NetCDF engines which support compression, in order of preference.
+_COMPRESSING_NETCDF_ENGINES = ('netcdf4', 'h5netcdf')
+
+
+def _netcdf_encoding(
+    metrics: xr.Dataset, compression: Optional[str], compression_level: int
+) -> tuple[str, dict[str, Any]]:
+  """NetCDF engine and encoding for the given compression."""
+  if compression is None:
+    # NetCDF3, as before compression was supported, even if netCDF4 is
+    # installed.
+    return 'scipy', {}
+  if compression != 'zlib':
+    raise ValueError(f'Unknown compression {compression}.')
+  available_engines = xr.backends.list_engines()
+  engine = next(
+      (e for e in _COMPRESSING_NETCDF_ENGINES if e in available_engines), None
+  )
+  if engine is None:
+    raise ValueError(
+        'Compressed NetCDF output requires netCDF4 or h5netcdf to be installed.'
+    )
+  encoding = {
+      name: {'zlib': True, 'complevel': compression_level}
+      for name in metrics.data_vars
+  }
+  return engine, encoding
+
+
+def write_metrics(
+    metrics: xr.Dataset,
+    out_path: str,
+    compression: Optional[str] = None,
+    compression_level: int = 4,
+) -> None:
+  """Writes metrics to a NetCDF file or a Zarr store.
+
+  Paths ending in '.zarr' are written as Zarr, chunked and compressed with
+  Zarr's defaults. Everything else is written as NetCDF, directly for local
+  paths, and otherwise to a local temporary file first, which is then copied
+  to the fsspec path.
+
+  Args:
+    metrics: Metrics to write.
+    out_path: Local or fsspec path.
+    compression: (Optional) Lossless compression of NetCDF output, None or
+      'zlib'. Without compression, files are NetCDF3, written with scipy.
+      Compressed files are NetCDF4, and require netCDF4 or h5netcdf.
+      Default: None.
+    compression_level: Compression level, if compression is used. Default: 4.
+  """
+  if out_path.rstrip('/').endswith('.zarr'):
+    metrics.to_zarr(out_path, mode='w')
+    return
+
+  engine, encoding = _netcdf_encoding(metrics, compression, compression_level)
+  fs, path = fsspec.core.url_to_fs(out_path)
+  if isinstance(fs, local_fs.LocalFileSystem):
+    if posixpath.dirname(path):
+      fs.makedirs(posixpath.dirname(path), exist_ok=True)
+    metrics.to_netcdf(path, engine=engine, encoding=encoding)
+    return
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    tmp_path = os.path.join(tmp_dir, 'metrics.nc')
+    metrics.to_netcdf(tmp_path, engine=engine, encoding=encoding)
+    fs.put_file(tmp_path, path)
@@ -0,0 +1,98 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+from absl.testing import absltest
+import fsspec
+import numpy as np
+from weatherbenchX import writers
+import xarray as xr
+
+
+def _metrics() -> xr.Dataset:
+  return xr.Dataset(
+      {
+          'rmse.2m_temperature': (
+              ('lead_time', 'level'),
+              np.random.rand(3, 2),
+          ),
+          'mse.2m_temperature': (
+              ('lead_time', 'level'),
+              np.random.rand(3, 2),
+          ),
+      },
+      coords={
+          'lead_time': np.arange(3) * np.timedelta64(6, 'h'),
+          'level': [500, 850],
+      },
+  )
+
+
+class WriteMetricsTest(absltest.TestCase):
+
+  def test_netcdf_round_trip(self):
+    metrics = _metrics()
+    out_path = os.path.join(
+        self.create_tempdir().full_path, 'nested', 'metrics.nc'
+    )
+    writers.write_metrics(metrics, out_path)
+    xr.testing.assert_identical(xr.load_dataset(out_path), metrics)
+    # NetCDF3 without compression, independently of the installed engines.
+    with open(out_path, 'rb') as f:
+      self.assertEqual(f.read(3), b'CDF')
+    self.assertEqual(writers._netcdf_encoding(metrics, None, 4), ('scipy', {}))
+
+  def test_zarr_round_trip(self):
+    metrics = _metrics()
+    out_path = os.path.join(self.create_tempdir().full_path, 'metrics.zarr')
+    writers.write_metrics(metrics, out_path)
+    xr.testing.assert_identical(
+        xr.open_zarr(out_path).compute(), metrics
+    )
+
+  def test_remote_netcdf(self):
+    metrics = _metrics()
+    out_path = 'memory://writers_test/metrics.nc'
+    writers.write_metrics(metrics, out_path)
+    with fsspec.open(out_path, 'rb') as f:
+      written = xr.load_dataset(f.read())
+    xr.testing.assert_identical(written, metrics)
+
+  def test_unknown_compression_raises(self):
+    out_path = os.path.join(self.create_tempdir().full_path, 'metrics.nc')
+    with self.assertRaisesRegex(ValueError, 'Unknown compression'):
+      writers.write_metrics(_metrics(), out_path, compression='lz4')
+
+  def test_zlib_compression(self):
+    available_engines = xr.backends.list_engines()
+    if not any(e in available_engines for e in ('netcdf4', 'h5netcdf')):
+      self.skipTest('netCDF4 or h5netcdf is required for compression.')
+    metrics = xr.Dataset(
+        {'rmse': ('lead_time', np.zeros(10_000))},
+        coords={'lead_time': np.arange(10_000)},
+    )
+    out_dir = self.create_tempdir().full_path
+    compressed_path = os.path.join(out_dir, 'compressed.nc')
+    uncompressed_path = os.path.join(out_dir, 'uncompressed.nc')
+    writers.write_metrics(metrics, compressed_path, compression='zlib')
+    writers.write_metrics(metrics, uncompressed_path)
+    xr.testing.assert_identical(xr.load_dataset(compressed_path), metrics)
+    self.assertLess(
+        os.path.getsize(compressed_path), os.path.getsize(uncompressed_path)
+    )
+
+
+if __name__ == '__main__':
+  absltest.main()